@@ -2,6 +2,7 @@ from itertools import count
 from typing import Any, List, Optional, Tuple
 from django.contrib.contenttypes.admin import GenericTabularInline
 from django.contrib import admin
+from django.core.files.storage import default_storage
 from django.db.models.query import QuerySet
 from django.http.request import HttpRequest
 from django.urls import reverse
@@ -38,41 +39,38 @@ class CollectionAdmin(admin.ModelAdmin):
             'collection__id': str(collection.id)
         }))
         return format_html('<a href="{}">{}</a>',url,collection.products_count)
-    
-    def get_queryset(self, request):
-        return super().get_queryset(request).annotate(products_count=Count('title'))
                                                       
 
 @admin.register(models.Customer)
 class CustomerAdmin(admin.ModelAdmin):
-    list_display = ['first_name','last_name','membership','Display_order']
-    list_editable = ['membership']
-    list_select_related = ["user"]
-    ordering = ['user__first_name','user__last_name']
-    search_fields = ['first_name__istartwith']
+    # membership is computed from the spend, see store/membership.py
+    list_display = ['first_name','last_name','membership','orders','lifetime_spend']
+    readonly_fields = ['membership']
+    ordering = ['first_name','last_name']
+    search_fields = ['first_name__istartswith', 'last_name__istartswith']
     autocomplete_fields = ['user']
 
-    @admin.display(ordering='Display_order')
-    def Display_order(self,customer):
+    # Maintained counter, see Customer.order_count
+    @admin.display(ordering='order_count')
+    def orders(self,customer):
         url = (
             reverse("admin:store_order_changelist")
             + '?'
             + urlencode({
                 'customer__id': str(customer.id)
             }))
-        return format_html('<a href="{}">{}</a>',url,customer.Display_order)
-    
-    def get_queryset(self, request: HttpRequest) -> QuerySet[Any]:
-        return super().get_queryset(request).annotate(Display_order = Count(OrderAdmin))
+        return format_html('<a href="{}">{}</a>',url,customer.order_count)
 
 class ProductImageInline(admin.TabularInline):
     model = models.ProductImage
     readonly_fields = ['thumbnail']
 
-    # Add thumbnail to uploaded image
+    # Add thumbnail to uploaded image, the original until the variants exist
     def thumbnail(self, instance):
         if instance.image.name != "":
-            return format_html(f'<img src="{instance.image.url}" class="thunbnail" />')
+            variant = instance.variants.get('thumbnail')
+            url = default_storage.url(variant['webp']) if variant else instance.image.url
+            return format_html('<img src="{}" class="thunbnail" />', url)
         return ''
 
 @admin.register(models.Product)
@@ -0,0 +1,92 @@
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework_simplejwt.authentication import JWTAuthentication as BaseJWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer as BaseTokenObtainPairSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+from .models import Customer
+
+CUSTOMER_ID_CLAIM = 'customer_id'
+
+DEFAULT_AUTH = {
+    # Seconds an authenticated user is served from the cache, 0 loads it
+    # from the database on every request
+    'CACHE_TIMEOUT': 0,
+    'CACHE_ALIAS': 'default',
+}
+
+
+def get_config():
+    config = dict(DEFAULT_AUTH)
+    config.update(getattr(settings, 'STORE_AUTH', {}))
+    return config
+
+
+def principal_key(user_id):
+    return f'store:principal:{user_id}'
+
+
+def forget_principal(user_id):
+    # Called when the user or their customer is saved or deleted
+    caches[get_config()['CACHE_ALIAS']].delete(principal_key(user_id))
+
+
+class TokenObtainPairSerializer(BaseTokenObtainPairSerializer):
+    # The customer id goes into the token, the refreshed access tokens copy it
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+        customer_id = Customer.objects.filter(user_id=user.pk).values_list('pk', flat=True).first()
+        if customer_id is not None:
+            token[CUSTOMER_ID_CLAIM] = customer_id
+        return token
+
+
+class JWTAuthentication(BaseJWTAuthentication):
+    """
+    simplejwt's authentication that sets request.customer_id from the
+    token, and with STORE_AUTH['CACHE_TIMEOUT'] serves the user from the
+    cache instead of loading it per request. Saving the user or customer
+    drops the cached copy, so deactivation and password changes apply at once.
+    """
+    def authenticate(self, request):
+        result = super().authenticate(request)
+        if result is not None:
+            # None for tokens issued before the claim existed
+            request.customer_id = result[1].get(CUSTOMER_ID_CLAIM)
+        return result
+
+    def get_user(self, validated_token):
+        config = get_config()
+        if not config['CACHE_TIMEOUT']:
+            return super().get_user(validated_token)
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            return super().get_user(validated_token)
+
+        cache = caches[config['CACHE_ALIAS']]
+        key = principal_key(user_id)
+        user = cache.get(key)
+        if user is None:
+            # Raises for unknown and inactive users, which aren't cached
+            user = super().get_user(validated_token)
+            cache.set(key, user, config['CACHE_TIMEOUT'])
+        elif api_settings.CHECK_REVOKE_TOKEN and \
+                validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+            # Tokens issued before a password change, checked against the cached user
+            raise AuthenticationFailed("The user's password has been changed.", code='password_changed')
+        return user
+
+
+def get_customer_id(request):
+    # From the token when it carries one, else looked up once per request.
+    # request.user goes first, it runs the authentication
+    if not request.user.is_authenticated:
+        return None
+    customer_id = getattr(request, 'customer_id', None)
+    if customer_id is None:
+        customer_id = Customer.objects.filter(user_id=request.user.id).values_list('pk', flat=True).first()
+        request.customer_id = customer_id
+    return customer_id
@@ -0,0 +1,275 @@
+import hashlib
+import time
+from collections import OrderedDict
+from threading import Lock
+from django.conf import settings
+from django.core import checks
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from django.utils.module_loading import import_string
+from rest_framework.response import Response
+
+PRODUCTS = 'products'
+COLLECTIONS = 'collections'
+# Product.inventory and reserved, which carts and checkouts move far more
+# often than the rest of a product changes
+STOCK = 'stock'
+
+DEFAULT_RESPONSE_CACHE = {
+    'BACKEND': 'store.caching.DjangoCacheBackend',
+    'VERSION_CACHE': 'default',
+    'TIMEOUT': 300,
+    'OPTIONS': {},
+}
+
+
+class LRUBackend:
+    # In-process cache, every worker keeps its own copy
+    def __init__(self, max_entries=1024, timeout=300, **kwargs):
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.timeout)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class DjangoCacheBackend:
+    # Shared between workers when the CACHES alias is, e.g. Redis
+    def __init__(self, alias='default', timeout=300, **kwargs):
+        self.alias = alias
+        self.timeout = timeout
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def set(self, key, value):
+        self.cache.set(key, value, self.timeout)
+
+    def clear(self):
+        self.cache.clear()
+
+
+_backend = None
+
+
+def get_config():
+    config = dict(DEFAULT_RESPONSE_CACHE)
+    config.update(getattr(settings, 'STORE_RESPONSE_CACHE', {}))
+    return config
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        config = get_config()
+        backend_class = import_string(config['BACKEND'])
+        _backend = backend_class(timeout=config['TIMEOUT'], **config['OPTIONS'])
+    return _backend
+
+
+@receiver(setting_changed)
+def reset_backend(sender, setting, **kwargs):
+    global _backend
+    if setting == 'STORE_RESPONSE_CACHE':
+        _backend = None
+
+
+# Generation counters live in VERSION_CACHE, which has to be shared by
+# every web and Celery process (see the check below) for a write in one of
+# them to invalidate the entries and ETags of all of them.
+# They start from the clock, so a counter lost to eviction never comes
+# back with a number that was already handed out.
+# Backends that keep a copy per process
+LOCAL_CACHE_BACKENDS = [
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+]
+
+
+@checks.register(checks.Tags.caches)
+def check_version_cache(app_configs, **kwargs):
+    alias = get_config()['VERSION_CACHE']
+    backend = settings.CACHES.get(alias, {}).get('BACKEND')
+    if backend in LOCAL_CACHE_BACKENDS:
+        return [checks.Warning(
+            f"STORE_RESPONSE_CACHE['VERSION_CACHE'] is the '{alias}' cache, {backend}, "
+            'which every process keeps its own copy of',
+            hint='Writes in one worker or in Celery will not change the ETags and cached '
+                 'responses of the others. Point it at a shared cache such as RedisCache.',
+            id='store.W001',
+        )]
+    return []
+
+
+def _version_cache():
+    return caches[get_config()['VERSION_CACHE']]
+
+
+def _version_key(namespace):
+    return f'store:version:{namespace}'
+
+
+def _modified_key(namespace):
+    return f'store:modified:{namespace}'
+
+
+def _new_generation():
+    return time.time_ns() // 1000
+
+
+def cart_namespace(cart_id):
+    return f'cart:{cart_id}'
+
+
+def get_version(namespace):
+    cache = _version_cache()
+    key = _version_key(namespace)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, _new_generation(), None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(namespace):
+    cache = _version_cache()
+    cache.set(_modified_key(namespace), int(time.time()), None)
+    key = _version_key(namespace)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        cache.add(key, _new_generation(), None)
+        return cache.get(key)
+
+
+def forget_versions(namespaces):
+    # Dropping a counter is a bump, the next read starts a new generation.
+    # One round trip for many namespaces, e.g. a batch of purged carts
+    keys = [key for namespace in namespaces for key in (_version_key(namespace), _modified_key(namespace))]
+    if keys:
+        _version_cache().delete_many(keys)
+
+
+def get_last_modified(namespace):
+    # Unknown after eviction, so claim the namespace changed just now
+    cache = _version_cache()
+    key = _modified_key(namespace)
+    modified = cache.get(key)
+    if modified is None:
+        cache.add(key, int(time.time()), None)
+        modified = cache.get(key)
+    return modified
+
+
+def normalize_query(query_params):
+    # Parameter order and empty values don't change the result
+    pairs = []
+    for name, values in sorted(query_params.lists()):
+        pairs.extend((name, value) for value in sorted(values) if value != '')
+    return '&'.join(f'{name}={value}' for name, value in pairs)
+
+
+def signature(request, *parts):
+    raw = '|'.join([
+        request.build_absolute_uri(request.path),
+        normalize_query(request.query_params),
+        *[str(part) for part in parts],
+    ])
+    return hashlib.md5(raw.encode()).hexdigest()
+
+
+def make_key(namespace, request, *parts):
+    digest = signature(request, get_version(namespace), *parts)
+    return f'store:response:{namespace}:{digest}'
+
+
+class CachedResponseMixin:
+    cache_namespace = None
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(request, super().list, 'list', *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(request, super().retrieve, 'retrieve', *args, **kwargs)
+
+    def get_cache_versions(self, action):
+        # Versions of other namespaces the action's response depends on
+        return []
+
+    def cached_response(self, request, handler, action, *args, **kwargs):
+        backend = get_backend()
+        key = make_key(self.cache_namespace, request, action, kwargs.get(self.lookup_field, ''),
+                       *self.get_cache_versions(action))
+        data = backend.get(key)
+        if data is not None:
+            return Response(data)
+
+        response = handler(request, *args, **kwargs)
+        if response.status_code == 200:
+            backend.set(key, response.data)
+        return response
+
+
+class ConditionalRetrieveMixin:
+    # Answers If-None-Match / If-Modified-Since from the version counters
+    # alone, before the queryset or the serializer run
+    def get_validator_namespaces(self):
+        return [self.cache_namespace]
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(request, super().retrieve, 'retrieve', *args, **kwargs)
+
+    def conditional_response(self, request, handler, action, *args, **kwargs):
+        namespaces = self.get_validator_namespaces()
+        if not namespaces:
+            return handler(request, *args, **kwargs)
+
+        etag = '"{}"'.format(signature(
+            request,
+            *[get_version(namespace) for namespace in namespaces],
+            request.accepted_renderer.format,
+            action,
+            kwargs.get(self.lookup_field, '')))
+        last_modified = max(get_last_modified(namespace) for namespace in namespaces)
+
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = handler(request, *args, **kwargs)
+        if response.status_code in (200, 304):
+            response['ETag'] = etag
+            response['Last-Modified'] = http_date(last_modified)
+        return response
+
+
+class ConditionalGetMixin(ConditionalRetrieveMixin):
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(request, super().list, 'list', *args, **kwargs)
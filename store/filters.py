@@ -1,7 +1,10 @@
-from django_filters.rest_framework import FilterSet
+from django_filters.rest_framework import FilterSet, NumberFilter
 from .models import Product
 
 class ProductFilter(FilterSet):
+    # A plain column filter, a ModelChoiceFilter would look the collection up first
+    collection_id = NumberFilter(field_name='collection_id')
+
     class Meta:
         model = Product
         fields = {
@@ -0,0 +1,208 @@
+import hashlib
+import json
+import time
+from collections import namedtuple
+from datetime import timedelta
+from functools import wraps
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+from .models import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+
+DEFAULT_IDEMPOTENCY = {
+    'BACKEND': 'store.idempotency.DatabaseBackend',
+    'TTL': 24 * 60 * 60,
+    'LOCK_TIMEOUT': 30,
+    'WAIT_TIMEOUT': 10,
+    'POLL_INTERVAL': 0.05,
+    'OPTIONS': {},
+}
+
+# status_code is None while the first request is in flight
+Record = namedtuple('Record', ['fingerprint', 'status_code', 'data'])
+
+
+class DatabaseBackend:
+    # Rows in IdempotencyKey, shared by every worker without a shared cache
+    def __init__(self, ttl, lock_timeout, **kwargs):
+        self.ttl = ttl
+        self.lock_timeout = lock_timeout
+
+    def acquire(self, key, fingerprint):
+        # None when this request now owns the key, else what's stored
+        now = timezone.now()
+        values = {
+            'fingerprint': fingerprint,
+            'status_code': None,
+            'data': None,
+            'locked_until': now + timedelta(seconds=self.lock_timeout),
+            'expires_at': now + timedelta(seconds=self.ttl),
+        }
+        try:
+            with transaction.atomic():
+                IdempotencyKey.objects.create(key=key, **values)
+            return None
+        except IntegrityError:
+            pass
+        # Taken over once expired, or when its request died holding it
+        if IdempotencyKey.objects \
+                .filter(key=key) \
+                .filter(Q(expires_at__lte=now) | Q(status_code=None, locked_until__lte=now)) \
+                .update(**values):
+            return None
+        # Released in between, try again
+        return self.get(key) or self.acquire(key, fingerprint)
+
+    def get(self, key):
+        row = IdempotencyKey.objects \
+            .filter(key=key) \
+            .values_list('fingerprint', 'status_code', 'data') \
+            .first()
+        return Record(*row) if row else None
+
+    def complete(self, key, fingerprint, status_code, data):
+        IdempotencyKey.objects \
+            .filter(key=key, fingerprint=fingerprint) \
+            .update(status_code=status_code, data=data, locked_until=None)
+
+    def release(self, key):
+        IdempotencyKey.objects.filter(key=key).delete()
+
+    def purge_expired(self):
+        return IdempotencyKey.objects.filter(expires_at__lte=timezone.now()).delete()[0]
+
+
+class CacheBackend:
+    # Entries in one of the CACHES aliases, which has to be shared between
+    # workers (e.g. Redis) for duplicates to be caught across them
+    def __init__(self, ttl, lock_timeout, alias='default', **kwargs):
+        self.ttl = ttl
+        self.lock_timeout = lock_timeout
+        self.alias = alias
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def acquire(self, key, fingerprint):
+        # The in-flight entry expires on its own if its request dies
+        if self.cache.add(key, Record(fingerprint, None, None), self.lock_timeout):
+            return None
+        return self.get(key) or self.acquire(key, fingerprint)
+
+    def get(self, key):
+        record = self.cache.get(key)
+        return Record(*record) if record is not None else None
+
+    def complete(self, key, fingerprint, status_code, data):
+        self.cache.set(key, Record(fingerprint, status_code, data), self.ttl)
+
+    def release(self, key):
+        self.cache.delete(key)
+
+    def purge_expired(self):
+        return 0
+
+
+_backend = None
+
+
+def get_config():
+    config = dict(DEFAULT_IDEMPOTENCY)
+    config.update(getattr(settings, 'STORE_IDEMPOTENCY', {}))
+    return config
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        config = get_config()
+        backend_class = import_string(config['BACKEND'])
+        _backend = backend_class(ttl=config['TTL'], lock_timeout=config['LOCK_TIMEOUT'], **config['OPTIONS'])
+    return _backend
+
+
+@receiver(setting_changed)
+def reset_backend(sender, setting, **kwargs):
+    global _backend
+    if setting == 'STORE_IDEMPOTENCY':
+        _backend = None
+
+
+def make_key(request, client_key):
+    # The same client key from another user or endpoint is another key
+    user = request.user.pk if request.user and request.user.is_authenticated else 'anonymous'
+    raw = '|'.join([str(user), request.method, request.path, client_key])
+    return 'store:idempotency:' + hashlib.sha256(raw.encode()).hexdigest()
+
+
+def fingerprint(request):
+    body = json.dumps(request.data, sort_keys=True, default=str)
+    return hashlib.sha256(body.encode()).hexdigest()
+
+
+def replay(record):
+    response = Response(record.data, status=record.status_code)
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def idempotent(handler):
+    """
+    Runs a view method once per Idempotency-Key header. The first
+    response is stored and replayed for retries; a retry that arrives
+    while the first request is still running waits for its response.
+    Server errors and exceptions free the key so the request can be retried.
+    """
+    @wraps(handler)
+    def wrapper(view, request, *args, **kwargs):
+        client_key = request.headers.get(HEADER)
+        if not client_key:
+            return handler(view, request, *args, **kwargs)
+        if len(client_key) > MAX_KEY_LENGTH:
+            return Response({'detail': f'{HEADER} is longer than {MAX_KEY_LENGTH} characters'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        config = get_config()
+        backend = get_backend()
+        key = make_key(request, client_key)
+        request_fingerprint = fingerprint(request)
+        deadline = time.monotonic() + config['WAIT_TIMEOUT']
+        while True:
+            record = backend.acquire(key, request_fingerprint)
+            if record is None:
+                break
+            if record.fingerprint != request_fingerprint:
+                return Response({'detail': f'{HEADER} was already used for a different request'},
+                                status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+            if record.status_code is not None:
+                return replay(record)
+            if time.monotonic() >= deadline:
+                return Response({'detail': f'A request with this {HEADER} is still in progress'},
+                                status=status.HTTP_409_CONFLICT)
+            time.sleep(config['POLL_INTERVAL'])
+
+        try:
+            response = handler(view, request, *args, **kwargs)
+        except Exception:
+            backend.release(key)
+            raise
+        if response.status_code >= 500:
+            backend.release(key)
+        else:
+            # Stored as plain JSON, the way it's rendered
+            data = json.loads(JSONRenderer().render(response.data) or 'null')
+            backend.complete(key, request_fingerprint, response.status_code, data)
+        return response
+    return wrapper
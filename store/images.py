@@ -0,0 +1,64 @@
+import hashlib
+from io import BytesIO
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+# Bounding boxes, images are scaled down to fit and never up
+VARIANT_SIZES = {
+    'thumbnail': (150, 150),
+    'medium': (600, 600),
+    'large': (1200, 1200),
+}
+
+FORMATS = {
+    'webp': {'format': 'WEBP', 'quality': 80, 'method': 4},
+    'jpeg': {'format': 'JPEG', 'quality': 85, 'optimize': True, 'progressive': True},
+}
+
+VARIANTS_DIR = 'store/images/variants'
+
+
+def generate_variants(image_file, storage=default_storage):
+    """
+    Writes every size in VARIANT_SIZES in every format in FORMATS and
+    returns {size: {'width', 'height', format: storage name}}.
+    Names are content hashes, so identical output is stored once and
+    the files can be served with far-future cache headers.
+    """
+    image_file.open('rb')
+    try:
+        with Image.open(image_file) as original:
+            original = ImageOps.exif_transpose(original).convert('RGB')
+            variants = {}
+            for size, box in VARIANT_SIZES.items():
+                image = original.copy()
+                image.thumbnail(box, Image.LANCZOS)
+                variant = {'width': image.width, 'height': image.height}
+                for extension, options in FORMATS.items():
+                    variant[extension] = save_variant(image, extension, options, size, storage)
+                variants[size] = variant
+            return variants
+    finally:
+        image_file.close()
+
+
+def save_variant(image, extension, options, size, storage):
+    buffer = BytesIO()
+    image.save(buffer, **options)
+    content = buffer.getvalue()
+    digest = hashlib.sha256(content).hexdigest()[:20]
+    name = f'{VARIANTS_DIR}/{digest}-{size}.{extension}'
+    if not storage.exists(name):
+        name = storage.save(name, ContentFile(content))
+    return name
+
+
+def variant_urls(variants, storage=default_storage):
+    return {
+        size: {
+            key: storage.url(value) if key in FORMATS else value
+            for key, value in variant.items()
+        }
+        for size, variant in variants.items()
+    }
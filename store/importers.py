@@ -0,0 +1,288 @@
+import codecs
+import csv
+import json
+from itertools import islice
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import identify_hasher, make_password
+from django.contrib.auth.validators import UnicodeUsernameValidator
+from django.db import connections, transaction
+from django.utils.text import slugify
+from rest_framework import serializers
+from .caching import bump_version, PRODUCTS
+from .models import Collection, Customer, Product, Promotion
+
+FORMATS = ['ndjson', 'csv']
+
+CONTENT_TYPES = {
+    'application/x-ndjson': 'ndjson',
+    'application/jsonl': 'ndjson',
+    'text/csv': 'csv',
+}
+
+UPDATE_FIELDS = ['title', 'slug', 'description', 'unit_price', 'inventory', 'collection']
+
+
+class ProductRowSerializer(serializers.Serializer):
+    id = serializers.IntegerField(min_value=1)
+    title = serializers.CharField(max_length=225)
+    slug = serializers.SlugField(required=False, allow_blank=True)
+    description = serializers.CharField(required=False, allow_blank=True, allow_null=True)
+    unit_price = serializers.DecimalField(max_digits=6, decimal_places=2, min_value=1)
+    inventory = serializers.IntegerField(min_value=1)
+    collection_id = serializers.IntegerField(required=False, allow_null=True)
+    # Replaces the product's promotions when present, CSV cells are space separated
+    promotion_ids = serializers.ListField(child=serializers.IntegerField(), required=False)
+
+    def to_internal_value(self, data):
+        data = {key: value for key, value in data.items() if value != '' or key == 'description'}
+        if isinstance(data.get('promotion_ids'), str):
+            data['promotion_ids'] = data['promotion_ids'].split()
+        return super().to_internal_value(data)
+
+
+def decode_lines(lines, encoding='utf-8'):
+    # Byte lines from a request or binary file, decoded lazily
+    return codecs.iterdecode(lines, encoding)
+
+
+def read_rows(lines, format):
+    if format == 'csv':
+        yield from csv.DictReader(lines)
+        return
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError as error:
+            yield error
+
+
+class ImportResult:
+    max_errors = 1000
+
+    def __init__(self):
+        self.imported = 0
+        self.failed = 0
+        self.errors = []
+
+    def add_error(self, row, errors):
+        self.failed += 1
+        # Counted but not kept past the cap, so memory stays flat
+        if len(self.errors) < self.max_errors:
+            self.errors.append({'row': row, 'errors': errors})
+
+    def as_dict(self):
+        return {'imported': self.imported, 'failed': self.failed, 'errors': self.errors}
+
+
+def import_products(rows, chunk_size=1000, using='default'):
+    """
+    Upserts products from an iterable of dicts in chunks of chunk_size,
+    one transaction and a fixed number of statements per chunk.
+    Rows are numbered from 1 in the errors.
+    """
+    result = ImportResult()
+    touched_collections = set()
+    numbered = enumerate(rows, start=1)
+    while True:
+        chunk = list(islice(numbered, chunk_size))
+        if not chunk:
+            break
+        valid = validate_chunk(chunk, result, using)
+        if valid:
+            touched_collections |= save_chunk(valid, using)
+            result.imported += len(valid)
+
+    # bulk_create skips the signals that keep these in sync
+    if result.imported:
+        Collection.objects.using(using) \
+            .filter(pk__in=touched_collections) \
+            .refresh_products_count()
+        bump_version(PRODUCTS)
+    return result
+
+
+def validate_chunk(chunk, result, using):
+    rows = []
+    seen = set()
+    for number, data in chunk:
+        if not isinstance(data, dict):
+            message = str(data) if isinstance(data, ValueError) else 'Expected an object'
+            result.add_error(number, {'non_field_errors': [message]})
+            continue
+        serializer = ProductRowSerializer(data=data)
+        if not serializer.is_valid():
+            result.add_error(number, serializer.errors)
+            continue
+        row = serializer.validated_data
+        if row['id'] in seen:
+            result.add_error(number, {'id': ['Duplicate id in the same chunk']})
+            continue
+        seen.add(row['id'])
+        rows.append((number, row))
+
+    # One lookup per chunk for the related rows
+    collection_ids = {row['collection_id'] for _, row in rows if row.get('collection_id')}
+    promotion_ids = {pk for _, row in rows for pk in row.get('promotion_ids', [])}
+    collections = set(Collection.objects.using(using)
+                      .filter(pk__in=collection_ids).values_list('pk', flat=True))
+    promotions = set(Promotion.objects.using(using)
+                     .filter(pk__in=promotion_ids).values_list('pk', flat=True))
+
+    valid = []
+    for number, row in rows:
+        if row.get('collection_id') and row['collection_id'] not in collections:
+            result.add_error(number, {'collection_id': [f"Collection {row['collection_id']} does not exist"]})
+            continue
+        missing = [pk for pk in row.get('promotion_ids', []) if pk not in promotions]
+        if missing:
+            result.add_error(number, {'promotion_ids': [f'Promotions {missing} do not exist']})
+            continue
+        valid.append(row)
+    return valid
+
+
+def save_chunk(rows, using):
+    connection = connections[using]
+    ids = [row['id'] for row in rows]
+    products = [
+        Product(
+            id=row['id'],
+            title=row['title'],
+            slug=row.get('slug') or slugify(row['title']) or '-',
+            description=row.get('description'),
+            unit_price=row['unit_price'],
+            inventory=row['inventory'],
+            collection_id=row.get('collection_id'))
+        for row in rows
+    ]
+    upsert = {'update_conflicts': True, 'update_fields': UPDATE_FIELDS}
+    # MySQL upserts on any unique key and refuses an explicit target
+    if connection.features.supports_update_conflicts_with_target:
+        upsert['unique_fields'] = ['id']
+
+    Link = Product.promotion.through
+    with transaction.atomic(using=using):
+        # Counts of the collections products move out of need refreshing too
+        previous = set(Product.objects.using(using)
+                       .filter(pk__in=ids).exclude(collection=None)
+                       .values_list('collection_id', flat=True))
+        Product.objects.using(using).bulk_create(products, **upsert)
+
+        linked = [row for row in rows if 'promotion_ids' in row]
+        if linked:
+            Link.objects.using(using).filter(product_id__in=[row['id'] for row in linked]).delete()
+            Link.objects.using(using).bulk_create([
+                Link(product_id=row['id'], promotion_id=promotion_id)
+                for row in linked
+                for promotion_id in set(row['promotion_ids'])
+            ])
+    return previous | {product.collection_id for product in products if product.collection_id}
+
+
+class UserRowSerializer(serializers.Serializer):
+    username = serializers.CharField(max_length=150, validators=[UnicodeUsernameValidator()])
+    email = serializers.EmailField(required=False, allow_blank=True, default='')
+    first_name = serializers.CharField(max_length=150, required=False, allow_blank=True, default='')
+    last_name = serializers.CharField(max_length=150, required=False, allow_blank=True, default='')
+    # Stored as is, already hashed by the system the users come from.
+    # Users without one can't log in until they reset it
+    password = serializers.CharField(required=False, allow_blank=True, default='')
+    is_active = serializers.BooleanField(required=False, default=True)
+    date_joined = serializers.DateTimeField(required=False)
+    phone = serializers.CharField(max_length=255, required=False, allow_blank=True, default='')
+    birth_date = serializers.DateField(required=False, allow_null=True)
+    membership = serializers.ChoiceField(choices=Customer.MEMBERSHIP_CHOICES, required=False,
+                                         default=Customer.MEMBERSHIP_BRONZE)
+
+    def to_internal_value(self, data):
+        data = {key: value for key, value in data.items() if value != '' or key == 'password'}
+        return super().to_internal_value(data)
+
+    def validate_password(self, value):
+        if not value:
+            return make_password(None)
+        try:
+            identify_hasher(value)
+        except ValueError:
+            # Hashing plain text here would take the import days
+            raise serializers.ValidationError('Not a password hash this project can check')
+        return value
+
+
+USER_FIELDS = ['username', 'email', 'first_name', 'last_name', 'password', 'is_active', 'date_joined']
+CUSTOMER_FIELDS = ['phone', 'birth_date', 'membership']
+
+
+def import_users(rows, chunk_size=1000, using='default'):
+    """
+    Creates users and their customers from an iterable of dicts, chunk_size
+    at a time: one transaction with an INSERT for the users and one for
+    the customers per chunk. bulk_create sends no post_save, so the signal
+    that creates a customer per user stays out of it. Usernames that
+    exist already are rejected. Rows are numbered from 1 in the errors.
+    """
+    result = ImportResult()
+    numbered = enumerate(rows, start=1)
+    while True:
+        chunk = list(islice(numbered, chunk_size))
+        if not chunk:
+            break
+        valid = validate_user_chunk(chunk, result, using)
+        if valid:
+            save_user_chunk(valid, using)
+            result.imported += len(valid)
+    return result
+
+
+def validate_user_chunk(chunk, result, using):
+    User = get_user_model()
+    rows = []
+    seen = set()
+    for number, data in chunk:
+        if not isinstance(data, dict):
+            message = str(data) if isinstance(data, ValueError) else 'Expected an object'
+            result.add_error(number, {'non_field_errors': [message]})
+            continue
+        serializer = UserRowSerializer(data=data)
+        if not serializer.is_valid():
+            result.add_error(number, serializer.errors)
+            continue
+        row = serializer.validated_data
+        if row['username'] in seen:
+            result.add_error(number, {'username': ['Duplicate username in the same chunk']})
+            continue
+        seen.add(row['username'])
+        rows.append((number, row))
+
+    # One lookup per chunk for the accounts that are already there
+    existing = set(User.objects.using(using)
+                   .filter(username__in=seen).values_list('username', flat=True))
+    valid = []
+    for number, row in rows:
+        if row['username'] in existing:
+            result.add_error(number, {'username': [f"User {row['username']} already exists"]})
+            continue
+        valid.append(row)
+    return valid
+
+
+def save_user_chunk(rows, using):
+    User = get_user_model()
+    users = [User(**{field: row[field] for field in USER_FIELDS if field in row}) for row in rows]
+    with transaction.atomic(using=using):
+        User.objects.using(using).bulk_create(users)
+        # MySQL doesn't hand back the ids of bulk inserted rows
+        if users[0].pk is None:
+            ids = dict(User.objects.using(using)
+                       .filter(username__in=[user.username for user in users])
+                       .values_list('username', 'pk'))
+            for user in users:
+                user.pk = ids[user.username]
+        Customer.objects.using(using).bulk_create([
+            Customer(user_id=user.pk, first_name=user.first_name, last_name=user.last_name,
+                     **{field: row.get(field) for field in CUSTOMER_FIELDS})
+            for user, row in zip(users, rows)
+        ])
@@ -0,0 +1,43 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Max
+from django.test.utils import CaptureQueriesContext
+from store.models import Cart, CartItem, Product
+from store.serializers import CartSerializer
+
+class Command(BaseCommand):
+    help = "times cart retrieval with SQL totals against the Python loop"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lines', type=int, nargs='+', default=[1, 50, 500])
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        # Everything is written in one transaction and rolled back
+        with transaction.atomic():
+            start = (Product.objects.aggregate(Max('id'))['id__max'] or 0) + 1
+            products = Product.objects.bulk_create([
+                Product(id=i, title=f'bench {i}', slug='-', unit_price='19.99', inventory=100)
+                for i in range(start, start + max(options['lines']))
+            ])
+            for lines in options['lines']:
+                cart = Cart.objects.create()
+                CartItem.objects.bulk_create([
+                    CartItem(cart=cart, product=product, quantity=3) for product in products[:lines]
+                ])
+                loop = self.measure(Cart.objects.prefetch_related('items__product'), cart, options['repeat'])
+                annotated = self.measure(Cart.objects.with_totals(), cart, options['repeat'])
+                self.stdout.write(
+                    f'{lines} lines: Python loop {loop[0] * 1000:.2f} ms / {loop[1]} queries, '
+                    f'SQL totals {annotated[0] * 1000:.2f} ms / {annotated[1]} queries')
+            transaction.set_rollback(True)
+
+    def measure(self, queryset, cart, repeat):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            with CaptureQueriesContext(connection) as context:
+                CartSerializer(queryset.get(pk=cart.pk)).data
+            timings.append(time.perf_counter() - started)
+        return min(timings), len(context.captured_queries)
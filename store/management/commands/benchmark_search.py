@@ -0,0 +1,78 @@
+import random
+from decimal import Decimal
+import time
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Max
+from store.models import Product
+from store.search import LikeSearchBackend, get_backend
+
+SYLLABLES = ['ba', 'ko', 'ri', 'mu', 'sel', 'tan', 'vo', 'pi', 'ler', 'du', 'nix', 'fa']
+
+# A vocabulary big enough that a term matches a realistic share of the catalog
+WORDS = sorted({
+    ''.join(random.Random(i).choices(SYLLABLES, k=3)) for i in range(20000)
+})
+
+class Command(BaseCommand):
+    help = "compares LIKE search with the full-text index on a generated catalog"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1_000_000)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--terms', nargs='+')
+
+    def handle(self, *args, **options):
+        # Generated rows are committed (InnoDB only indexes committed rows)
+        # and removed again at the end, above the current highest id
+        start = (Product.objects.aggregate(Max('id'))['id__max'] or 0) + 1
+        end = start + options['rows']
+        try:
+            self.populate(start, end, options['batch_size'])
+            if connection.vendor == 'sqlite':
+                with connection.cursor() as cursor:
+                    cursor.execute('ANALYZE')
+            fulltext = get_backend()
+            like = LikeSearchBackend()
+            fields = ['title', 'description']
+            terms = options['terms'] or [
+                random.choice(WORDS),
+                ' '.join(random.sample(WORDS, 2)),
+                random.choice(WORDS)[:4],
+            ]
+            for term in terms:
+                words = term.split()
+                like_time = self.measure(like, words, fields, options['repeat'])
+                index_time = self.measure(fulltext, words, fields, options['repeat'])
+                self.stdout.write(
+                    f'{term!r}: LIKE {like_time * 1000:.1f} ms, '
+                    f'{type(fulltext).__name__} {index_time * 1000:.1f} ms '
+                    f'({like_time / index_time:.1f}x)')
+        finally:
+            for low in range(start, end, options['batch_size']):
+                Product.objects.filter(id__gte=low, id__lt=low + options['batch_size']).delete()
+
+    def populate(self, start, end, batch_size):
+        self.stdout.write(f'Inserting {end - start} products...')
+        for low in range(start, end, batch_size):
+            Product.objects.bulk_create([
+                Product(
+                    id=i,
+                    title=' '.join(random.sample(WORDS, 3)),
+                    slug='-',
+                    description=' '.join(random.choices(WORDS, k=12)),
+                    unit_price=Decimal(random.randint(100, 99999)) / 100,
+                    inventory=random.randint(1, 100))
+                for i in range(low, min(low + batch_size, end))
+            ])
+
+    def measure(self, backend, terms, fields, repeat):
+        timings = []
+        for _ in range(repeat):
+            # First page in the order ProductViewSet would serve it
+            queryset = backend.search(Product.objects.order_by('title', 'id'), terms, fields)
+            started = time.perf_counter()
+            list(queryset[:10].values_list('id', flat=True))
+            timings.append(time.perf_counter() - started)
+        return min(timings)
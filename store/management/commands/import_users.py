@@ -0,0 +1,36 @@
+import sys
+import time
+from django.core.management.base import BaseCommand, CommandError
+from store.importers import FORMATS, decode_lines, import_users, read_rows
+
+class Command(BaseCommand):
+    help = "creates users and their customers from an NDJSON or CSV file ('-' for stdin), passwords already hashed"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=FORMATS)
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        format = options['format'] or path.rsplit('.', 1)[-1].lower()
+        if format == 'jsonl':
+            format = 'ndjson'
+        if format not in FORMATS:
+            raise CommandError('Pass --format, the extension does not tell the format')
+
+        started = time.perf_counter()
+        stream = sys.stdin.buffer if path == '-' else open(path, 'rb')
+        try:
+            rows = read_rows(decode_lines(stream), format)
+            result = import_users(rows, chunk_size=options['chunk_size'])
+        finally:
+            if stream is not sys.stdin.buffer:
+                stream.close()
+        elapsed = time.perf_counter() - started
+
+        for error in result.errors:
+            self.stderr.write(f"row {error['row']}: {error['errors']}")
+        self.stdout.write(
+            f'{result.imported} users imported, {result.failed} rejected '
+            f'in {elapsed:.1f}s ({result.imported / max(elapsed, 1e-9):.0f} rows/s)')
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from store.carts import purge_expired_carts
+
+class Command(BaseCommand):
+    help = "deletes expired carts in batches, settings in STORE_CART_PURGE"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-age-days', type=int)
+        parser.add_argument('--batch-size', type=int)
+        parser.add_argument('--pause', type=float, help='seconds to sleep between batches')
+        parser.add_argument('--max-runtime', type=float, help='seconds before stopping')
+
+    def handle(self, *args, **options):
+        result = purge_expired_carts(
+            max_age_days=options['max_age_days'],
+            batch_size=options['batch_size'],
+            pause=options['pause'],
+            max_runtime=options['max_runtime'])
+        self.stdout.write(
+            f'{result.carts} carts and {result.items} items purged in {result.batches} batches, '
+            f'{result.elapsed:.1f}s ({result.rows_per_second:.0f} rows/s)')
+        if not result.finished:
+            self.stdout.write('Stopped at the runtime limit, expired carts remain')
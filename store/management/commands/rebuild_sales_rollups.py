@@ -0,0 +1,14 @@
+from datetime import date
+from django.core.management.base import BaseCommand
+from store.reports import rebuild
+
+class Command(BaseCommand):
+    help = "recomputes the sales rollups from the orders, for backfills"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', type=date.fromisoformat, help='only orders placed on or after this date (YYYY-MM-DD)')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        counted = rebuild(since=options['since'], batch_size=options['batch_size'])
+        self.stdout.write(f'{counted} orders counted into the sales rollups')
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, connections
+from store import search
+
+class Command(BaseCommand):
+    help = "recreates the product full-text index and its sync triggers"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        search.uninstall(connection)
+        search.install(connection)
+        self.stdout.write(f'Search index rebuilt on {connection.vendor}')
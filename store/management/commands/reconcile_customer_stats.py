@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from store.reports import reconcile_customers
+
+class Command(BaseCommand):
+    help = "recomputes each customer's order_count and lifetime_spend from the orders and repairs drift"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        repaired = reconcile_customers(batch_size=options['batch_size'])
+        self.stdout.write(f'{repaired} customers repaired')
@@ -2,6 +2,7 @@ from typing import Any
 from django.core.management.base import BaseCommand
 from django.db import connection
 from pathlib import Path
+from store.models import Collection
 import os
 
 class Command(BaseCommand):
@@ -14,4 +15,7 @@ class Command(BaseCommand):
         sql = Path(file_path).read_text()
 
         with connection.cursor() as cursor:
-            cursor.execute(sql)
\ No newline at end of file
+            cursor.execute(sql)
+
+        # Raw inserts skip the signals that maintain the product counts
+        Collection.objects.refresh_products_count()
\ No newline at end of file
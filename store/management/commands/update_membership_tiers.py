@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from store.membership import recompute_all_tiers, update_stale_tiers
+
+class Command(BaseCommand):
+    help = "recomputes membership tiers from the spend window, settings in STORE_MEMBERSHIP"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='every customer, not only the flagged ones')
+        parser.add_argument('--batch-size', type=int)
+
+    def handle(self, *args, **options):
+        update = recompute_all_tiers if options['all'] else update_stale_tiers
+        checked, changed = update(batch_size=options['batch_size'])
+        self.stdout.write(f'{checked} customers checked, {changed} tiers changed')
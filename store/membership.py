@@ -0,0 +1,125 @@
+from datetime import timedelta
+from decimal import Decimal
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+from .models import LINE_TOTAL_FIELD, Customer, Order, OrderItem
+
+DEFAULT_MEMBERSHIP = {
+    # Spend on completed orders placed in the last WINDOW_DAYS days
+    'WINDOW_DAYS': 365,
+    # (tier, minimum spend), highest first; below every minimum is Bronze
+    'TIERS': [
+        (Customer.MEMBERSHIP_GOLD, 1000),
+        (Customer.MEMBERSHIP_SILVER, 250),
+    ],
+    'BATCH_SIZE': 1000,
+    # Days of orders leaving the window that each run rechecks, so a
+    # missed run or two doesn't leave tiers too high
+    'EXPIRY_LOOKBACK_DAYS': 7,
+}
+
+
+def get_config():
+    config = dict(DEFAULT_MEMBERSHIP)
+    config.update(getattr(settings, 'STORE_MEMBERSHIP', {}))
+    return config
+
+
+def tier_for(spend, tiers):
+    for tier, minimum in tiers:
+        if spend >= Decimal(minimum):
+            return tier
+    return Customer.MEMBERSHIP_BRONZE
+
+
+def window_spend(customer_ids, since):
+    # {customer_id: spend} in one GROUP BY, seeking on the
+    # (customer, placed_at, id) index; customers without spend are left out
+    return dict(OrderItem.objects
+                .filter(order__customer_id__in=customer_ids,
+                        order__rollup_status=Order.PAYMENT_STATUS_COMPLETE,
+                        order__placed_at__gte=since)
+                .order_by()
+                .values_list('order__customer_id')
+                .annotate(spend=Sum(F('quantity') * F('unit_price'), output_field=LINE_TOTAL_FIELD)))
+
+
+def update_tiers(customer_ids, config):
+    # At most one UPDATE per tier, only for the customers whose tier moves.
+    # Returns how many moved
+    since = timezone.now().date() - timedelta(days=config['WINDOW_DAYS'])
+    spend = window_spend(customer_ids, since)
+    by_tier = {}
+    for customer_id in customer_ids:
+        tier = tier_for(spend.get(customer_id) or 0, config['TIERS'])
+        by_tier.setdefault(tier, []).append(customer_id)
+    return sum(
+        Customer.objects.filter(pk__in=ids).exclude(membership=tier).update(membership=tier)
+        for tier, ids in by_tier.items()
+    )
+
+
+def mark_expiring(config):
+    # Customers whose completed orders have left the window since recent runs
+    today = timezone.now().date()
+    cutoff = today - timedelta(days=config['WINDOW_DAYS'])
+    expiring = Order.objects \
+        .filter(rollup_status=Order.PAYMENT_STATUS_COMPLETE,
+                placed_at__gte=cutoff - timedelta(days=config['EXPIRY_LOOKBACK_DAYS']),
+                placed_at__lt=cutoff) \
+        .values('customer_id')
+    return Customer.objects.filter(pk__in=expiring, tier_stale=False).update(tier_stale=True)
+
+
+def update_stale_tiers(batch_size=None):
+    """
+    Recomputes the tier of the customers flagged tier_stale, batch_size
+    per transaction, and clears the flag. A batch's customers are locked
+    while it runs, so a sync flagging one of them again waits and is
+    picked up by the next run. Returns (customers checked, tiers changed).
+    """
+    config = get_config()
+    batch_size = batch_size or config['BATCH_SIZE']
+    mark_expiring(config)
+    checked = changed = 0
+    while True:
+        with transaction.atomic():
+            ids = list(Customer.objects
+                       .select_for_update(skip_locked=True)
+                       .filter(tier_stale=True)
+                       .order_by('pk')
+                       .values_list('pk', flat=True)[:batch_size])
+            if not ids:
+                break
+            changed += update_tiers(ids, config)
+            Customer.objects.filter(pk__in=ids).update(tier_stale=False)
+        checked += len(ids)
+        if len(ids) < batch_size:
+            break
+    return checked, changed
+
+
+def recompute_all_tiers(batch_size=None):
+    # Every customer, in pk batches: a GROUP BY and a few UPDATEs per batch
+    config = get_config()
+    batch_size = batch_size or config['BATCH_SIZE']
+    checked = changed = 0
+    last_id = 0
+    while True:
+        with transaction.atomic():
+            ids = list(Customer.objects
+                       .select_for_update()
+                       .filter(pk__gt=last_id)
+                       .order_by('pk')
+                       .values_list('pk', flat=True)[:batch_size])
+            if not ids:
+                break
+            changed += update_tiers(ids, config)
+            Customer.objects.filter(pk__in=ids, tier_stale=True).update(tier_stale=False)
+        checked += len(ids)
+        last_id = ids[-1]
+        if len(ids) < batch_size:
+            break
+    return checked, changed
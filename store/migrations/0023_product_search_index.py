@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:50
+
+import django.db.models.deletion
+import store.search
+from django.db import migrations, models
+
+
+def install_search_index(apps, schema_editor):
+    store.search.install(schema_editor.connection)
+
+
+def uninstall_search_index(apps, schema_editor):
+    store.search.uninstall(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0022_productimage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSearchEntry',
+            fields=[
+                ('product', models.OneToOneField(db_column='rowid', on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_entry', serialize=False, to='store.product')),
+                ('document', store.search.SearchDocumentField(db_column='store_product_fts')),
+                ('rank', models.FloatField()),
+            ],
+            options={
+                'db_table': 'store_product_fts',
+                'managed': False,
+            },
+        ),
+        migrations.RunPython(install_search_index, uninstall_search_index),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:53
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0023_product_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='collection',
+            name='products_count',
+            field=models.PositiveIntegerField(db_default=0, default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='collection',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='products', to='store.collection'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['collection', 'title', 'id'], name='store_produ_collect_59c882_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0024_product_collection'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productimage',
+            name='variants',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
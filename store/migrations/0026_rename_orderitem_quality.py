@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:05
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0025_productimage_variants'),
+    ]
+
+    operations = [
+        migrations.RenameField(
+            model_name='orderitem',
+            old_name='quality',
+            new_name='quantity',
+        ),
+    ]
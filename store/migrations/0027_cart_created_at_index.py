@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0026_rename_orderitem_quality'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='cart',
+            index=models.Index(fields=['created_at'], name='store_cart_created_bb94c8_idx'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:11
+
+import django.db.models.deletion
+import store.search
+from django.db import migrations, models
+
+
+# SQLite rebuilds store_product to add the column, dropping the
+# search triggers with the old table
+def install_search_index(apps, schema_editor):
+    store.search.install(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0027_cart_created_at_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(migrations.RunPython.noop, install_search_index),
+        migrations.AddField(
+            model_name='product',
+            name='reserved',
+            field=models.IntegerField(db_default=0, default=0, editable=False),
+        ),
+        migrations.CreateModel(
+            name='Reservation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cart_id', models.UUIDField()),
+                ('quantity', models.PositiveIntegerField()),
+                ('expires_at', models.DateTimeField()),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='store.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['expires_at'], name='store_reser_expires_b28b80_idx')],
+                'unique_together': {('cart_id', 'product')},
+            },
+        ),
+        migrations.RunPython(install_search_index, migrations.RunPython.noop),
+    ]
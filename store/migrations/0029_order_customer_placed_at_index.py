@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0028_inventory_reservations'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['customer', 'placed_at', 'id'], name='store_order_custome_c64870_idx'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:14
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0029_order_customer_placed_at_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('topic', models.CharField(max_length=50)),
+                ('payload', models.JSONField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('available_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('last_error', models.TextField(blank=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['processed_at', 'available_at', 'id'], name='store_outbo_process_9b464f_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:17
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0031_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='rollup_status',
+            field=models.CharField(editable=False, max_length=1, null=True),
+        ),
+        migrations.CreateModel(
+            name='CollectionSales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('collection_id', models.IntegerField()),
+                ('payment_status', models.CharField(choices=[('P', 'P'), ('C', 'C'), ('F', 'F')], max_length=1)),
+                ('quantity', models.IntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+            ],
+            options={
+                'unique_together': {('day', 'collection_id', 'payment_status')},
+            },
+        ),
+        migrations.CreateModel(
+            name='ProductSales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('payment_status', models.CharField(choices=[('P', 'P'), ('C', 'C'), ('F', 'F')], max_length=1)),
+                ('quantity', models.IntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='+', to='store.product')),
+            ],
+            options={
+                'unique_together': {('day', 'product', 'payment_status')},
+            },
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:23
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def copy_user_names(apps, schema_editor):
+    # One UPDATE with correlated subqueries, no rows through Python
+    Customer = apps.get_model('store', 'Customer')
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split('.'))
+    user = User.objects.filter(pk=models.OuterRef('user_id'))
+    Customer.objects.using(schema_editor.connection.alias).update(
+        first_name=models.Subquery(user.values('first_name')[:1]),
+        last_name=models.Subquery(user.values('last_name')[:1]),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0032_sales_rollups'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='customer',
+            options={'ordering': ['first_name', 'last_name']},
+        ),
+        migrations.AddField(
+            model_name='customer',
+            name='first_name',
+            field=models.CharField(blank=True, editable=False, max_length=150),
+        ),
+        migrations.AddField(
+            model_name='customer',
+            name='last_name',
+            field=models.CharField(blank=True, editable=False, max_length=150),
+        ),
+        migrations.RunPython(copy_user_names, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='customer',
+            index=models.Index(fields=['first_name', 'last_name', 'id'], name='store_custo_first_n_794e2a_idx'),
+        ),
+    ]
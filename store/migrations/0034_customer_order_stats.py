@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0033_customer_names'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customer',
+            name='lifetime_spend',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=14),
+        ),
+        migrations.AddField(
+            model_name='customer',
+            name='order_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
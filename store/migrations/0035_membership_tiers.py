@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:27
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0034_customer_order_stats'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customer',
+            name='tier_stale',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='customer',
+            index=models.Index(fields=['tier_stale', 'id'], name='store_custo_tier_st_f03d6f_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['rollup_status', 'placed_at'], name='store_order_rollup__0de1ee_idx'),
+        ),
+    ]
@@ -1,10 +1,15 @@
 from django.conf import settings
-from django.contrib import admin
-from django.db import models
+from django.db import connections, models
+from django.db.models import ExpressionWrapper, Sum, Value
+from django.db.models.functions import Coalesce
+from decimal import Decimal
 from django.contrib.contenttypes.fields import GenericRelation
 from django.core.validators import MinValueValidator
+from django.utils import timezone
 from uuid import uuid4
 from .validators import validate_file_size
+from .search import SearchDocumentField
+from .caching import bump_version, COLLECTIONS, STOCK
 
 class Promotion(models.Model):
      discription = models.CharField(max_length=255)
@@ -12,14 +17,78 @@ class Promotion(models.Model):
 
      
 
+class CollectionQuerySet(models.QuerySet):
+    # Recomputes the denormalized counts from the product table,
+    # for backfills and for writes that skip the signals (bulk_create, update)
+    def refresh_products_count(self):
+        counts = Product.objects \
+            .filter(collection=models.OuterRef('pk')) \
+            .order_by() \
+            .values('collection') \
+            .annotate(count=models.Count('pk')) \
+            .values('count')
+        updated = self.update(products_count=Coalesce(models.Subquery(counts), 0))
+        bump_version(COLLECTIONS)
+        return updated
+
 class Collection(models.Model):
     id = models.IntegerField(primary_key=True)
     title = models.CharField(max_length=255)
     featured_product = models.ForeignKey('Product', on_delete=models.SET_NULL, null= True, related_name='+') # Many To One Field Relationship
+    # Kept up to date by the Product signal handlers
+    products_count = models.PositiveIntegerField(default=0, db_default=0, editable=False)
+
+    objects = CollectionQuerySet.as_manager()
     
     def __str__(self) -> str:
          return self.title
 
+class InsufficientStock(Exception):
+    pass
+
+def per_product(quantities):
+    # CASE pk WHEN ... THEN quantity, for batched per-product UPDATEs
+    return models.Case(
+        *[models.When(pk=pk, then=Value(quantity)) for pk, quantity in sorted(quantities.items())],
+        default=Value(0),
+        output_field=models.IntegerField())
+
+class ProductQuerySet(models.QuerySet):
+    def decrement_inventory(self, quantities, held=None):
+        # Takes {product_id: quantity} off the stock in one UPDATE that
+        # skips products short of their quantity. Stock reserved by others
+        # isn't available, the caller's own reservations (held) are
+        # released in the same statement. Raises InsufficientStock when
+        # any was skipped, so the enclosing transaction rolls back what
+        # the UPDATE did take
+        if not quantities:
+            return
+        amount = per_product(quantities)
+        released = per_product(held) if held else Value(0)
+        updated = self \
+            .filter(pk__in=list(quantities), inventory__gte=models.F('reserved') - released + amount) \
+            .update(inventory=models.F('inventory') - amount, reserved=models.F('reserved') - released)
+        if updated != len(quantities):
+            raise InsufficientStock(quantities)
+        # update() skips the signals. Product responses leave the stock
+        # to its own endpoint, so only STOCK changes
+        bump_version(STOCK)
+
+    def reserve_inventory(self, quantities):
+        # Same all-or-nothing condition, but the stock is only set aside
+        amount = per_product(quantities)
+        updated = self \
+            .filter(pk__in=list(quantities), inventory__gte=models.F('reserved') + amount) \
+            .update(reserved=models.F('reserved') + amount)
+        if updated != len(quantities):
+            raise InsufficientStock(quantities)
+        bump_version(STOCK)
+
+    def release_reserved(self, quantities):
+        if quantities:
+            self.filter(pk__in=list(quantities)).update(reserved=models.F('reserved') - per_product(quantities))
+            bump_version(STOCK)
+
 class Product(models.Model):
     id = models.IntegerField(primary_key=True)
     title = models.CharField(max_length=225)
@@ -32,20 +101,89 @@ class Product(models.Model):
     inventory = models.IntegerField(
          validators=[MinValueValidator(1)]
     )
+    # Sum of the reservations on this product, kept in step with them so
+    # available_inventory costs no query (see store/reservations.py)
+    reserved = models.IntegerField(default=0, db_default=0, editable=False)
     last_update = models.DateField(auto_now_add=True)
-    models.ForeignKey(Collection, on_delete=models.PROTECT,)
+    collection = models.ForeignKey(Collection, on_delete=models.PROTECT, null=True, blank=True, related_name='products')
     promotion = models.ManyToManyField(Promotion, blank= True)
 
+    objects = ProductQuerySet.as_manager()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+         instance = super().from_db(db, field_names, values)
+         # The collection the counts hold it under, so saving it needs no
+         # lookup (see store/signals/handlers.py). Unknown when deferred
+         if 'collection_id' in instance.__dict__:
+              instance._loaded_collection_id = instance.collection_id
+         return instance
+
+    @property
+    def available_inventory(self):
+         return self.inventory - self.reserved
+
     def __str__ (self) -> str:
          return self.title
     
     class Meta:
          ordering = ['title']
+         indexes = [
+              # Collection listings filter on collection and seek on (title, id)
+              models.Index(fields=['collection', 'title', 'id']),
+         ]
 
 class ProductImage(models.Model):
      product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='images')
      image = models.ImageField(upload_to='store/images',
                                validators=[validate_file_size])
+     # Resized copies, filled in by store.tasks.process_product_image
+     variants = models.JSONField(default=dict, blank=True, editable=False)
+
+class ProductSearchEntry(models.Model):
+     # FTS5 table over store_product on SQLite, created and kept in sync
+     # by store.search.install() rather than by the ORM
+     product = models.OneToOneField(Product, on_delete=models.DO_NOTHING, primary_key=True,
+                                    db_column='rowid', related_name='search_entry')
+     document = SearchDocumentField(db_column='store_product_fts')
+     rank = models.FloatField()
+
+     class Meta:
+          managed = False
+          db_table = 'store_product_fts'
+
+class CustomerQuerySet(models.QuerySet):
+    def order_stats(self):
+        # (order_count, lifetime_spend) subqueries over the orders the
+        # rollups have counted: every one that isn't failed, and the
+        # completed ones for the spend
+        counted = Order.objects \
+            .filter(customer=models.OuterRef('pk'), rollup_status__isnull=False) \
+            .exclude(rollup_status=Order.PAYMENT_STATUS_FAILED) \
+            .order_by() \
+            .values('customer') \
+            .annotate(count=models.Count('pk')) \
+            .values('count')
+        spend = OrderItem.objects \
+            .filter(order__customer=models.OuterRef('pk'), order__rollup_status=Order.PAYMENT_STATUS_COMPLETE) \
+            .order_by() \
+            .values('order__customer') \
+            .annotate(total=Sum(models.F('quantity') * models.F('unit_price'), output_field=LINE_TOTAL_FIELD)) \
+            .values('total')
+        return (Coalesce(models.Subquery(counted), 0),
+                Coalesce(models.Subquery(spend), Value(Decimal(0)), output_field=LINE_TOTAL_FIELD))
+
+    # Recomputes the counters from the orders, for drift and backfills.
+    # The tiers may move with them
+    def refresh_order_stats(self):
+        order_count, lifetime_spend = self.order_stats()
+        return self.update(order_count=order_count, lifetime_spend=lifetime_spend, tier_stale=True)
+
+    def drifted(self):
+        order_count, lifetime_spend = self.order_stats()
+        return self \
+            .annotate(expected_count=order_count, expected_spend=lifetime_spend) \
+            .exclude(order_count=models.F('expected_count'), lifetime_spend=models.F('expected_spend'))
 
 class Customer(models.Model):
     MEMBERSHIP_BRONZE = "B"
@@ -65,21 +203,32 @@ class Customer(models.Model):
     birth_date = models.DateField(null=True, blank=True)
     membership = models.CharField(max_length=50, choices=MEMBERSHIP_CHOICES, default=MEMBERSHIP_BRONZE)
     user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    # Copies of the user's names, kept in sync by the User signal handlers
+    # so lists sort on this table's index without joining auth_user
+    first_name = models.CharField(max_length=150, blank=True, editable=False)
+    last_name = models.CharField(max_length=150, blank=True, editable=False)
+    # Maintained with the sales rollups (store/reports.py), orders count
+    # once relayed. reconcile_customer_stats repairs drift
+    order_count = models.PositiveIntegerField(default=0, editable=False)
+    lifetime_spend = models.DecimalField(max_digits=14, decimal_places=2, default=0, editable=False)
+    # Set when completed orders change, store.membership recomputes the
+    # tier of flagged customers and clears it
+    tier_stale = models.BooleanField(default=False, editable=False)
+
+    objects = CustomerQuerySet.as_manager()
     
     
     def __str__(self):
-         return f'{self.user.first_name} {self.user.last_name}'
-    
-    @admin.display(ordering='user__first_name') # Allow use to by name in Admin page
-    def first_name(self):
-         return self.user.first_name
-    
-    @admin.display(ordering="user__last_name")
-    def last_name(self):
-         return self.user.last_name
+         return f'{self.first_name} {self.last_name}'
     
     class Meta:
-         ordering = ['user__first_name', 'user__last_name']
+         ordering = ['first_name', 'last_name']
+         indexes = [
+              # The default ordering, with the pk pagination adds as tiebreaker
+              models.Index(fields=['first_name', 'last_name', 'id']),
+              # Flagged customers in pk batches
+              models.Index(fields=['tier_stale', 'id']),
+         ]
 
 class Order(models.Model):
         PAYMENT_STATUS_PENDING = "P"
@@ -96,39 +245,219 @@ class Order(models.Model):
         placed_at = models.DateField(auto_now_add=True)
         payment_status = models.CharField(max_length=1, choices=PAYMENT_STATUS_CHIOCE, default=PAYMENT_STATUS_PENDING)
         customer = models.ForeignKey(Customer, on_delete=models.PROTECT)
+        # The payment_status the sales rollups count this order under,
+        # None until store.reports has counted it
+        rollup_status = models.CharField(max_length=1, null=True, editable=False)
 
         class Meta:
              permissions = [
                   ('cancel_order', 'can_cancel_order')
              ]
+             indexes = [
+                  # A customer's orders, newest first, seeking on (placed_at, id)
+                  models.Index(fields=['customer', 'placed_at', 'id']),
+                  # Completed orders leaving the membership spend window
+                  models.Index(fields=['rollup_status', 'placed_at']),
+             ]
 
 
 class OrderItem(models.Model):
      order = models.ForeignKey(Order, on_delete=models.PROTECT, related_name='items')
      product = models.ForeignKey(Product, on_delete=models.PROTECT)
-     quality = models.PositiveSmallIntegerField()
+     quantity = models.PositiveSmallIntegerField()
      unit_price = models.DecimalField(max_digits=6 , decimal_places=2)
-     
+
+class SalesQuerySet(models.QuerySet):
+    def add_sales(self, rows):
+        # Adds each row's quantity and revenue to its key's totals in one
+        # INSERT that bumps existing rows in place. rows are dicts keyed by
+        # the unique_together attnames plus quantity and revenue, which may be negative
+        if not rows:
+            return
+        connection = connections[self.db]
+        meta = self.model._meta
+        quote = connection.ops.quote_name
+        table = quote(meta.db_table)
+        fields = [meta.get_field(name) for name in list(meta.unique_together[0]) + ['quantity', 'revenue']]
+        columns = [quote(field.column) for field in fields]
+        # A fixed row order keeps concurrent statements from deadlocking
+        rows = sorted(rows, key=lambda row: [row[field.attname] for field in fields[:-2]])
+        params = [field.get_db_prep_save(row[field.attname], connection) for row in rows for field in fields]
+
+        placeholders = '(' + ', '.join(['%s'] * len(fields)) + ')'
+        sql = f'INSERT INTO {table} ({", ".join(columns)}) VALUES {", ".join([placeholders] * len(rows))} '
+        totals = columns[-2:]
+        if connection.vendor == 'mysql':
+            sql += 'ON DUPLICATE KEY UPDATE ' + ', '.join(f'{column} = {column} + VALUES({column})' for column in totals)
+        else:
+            sql += (f'ON CONFLICT ({", ".join(columns[:-2])}) DO UPDATE SET '
+                    + ', '.join(f'{column} = {table}.{column} + excluded.{column}' for column in totals))
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+
+class ProductSales(models.Model):
+     # Daily OrderItem totals, maintained by store.reports
+     day = models.DateField()
+     product = models.ForeignKey(Product, on_delete=models.PROTECT, related_name='+')
+     payment_status = models.CharField(max_length=1, choices=Order.PAYMENT_STATUS_CHIOCE)
+     quantity = models.IntegerField(default=0)
+     revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+     objects = SalesQuerySet.as_manager()
+
+     class Meta:
+          unique_together = [['day', 'product', 'payment_status']]
+
+class CollectionSales(models.Model):
+     # The same totals per collection, products without one aren't counted
+     day = models.DateField()
+     collection_id = models.IntegerField()
+     payment_status = models.CharField(max_length=1, choices=Order.PAYMENT_STATUS_CHIOCE)
+     quantity = models.IntegerField(default=0)
+     revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+     objects = SalesQuerySet.as_manager()
+
+     class Meta:
+          unique_together = [['day', 'collection_id', 'payment_status']]
+
+class OutboxEvent(models.Model):
+     # Written in the transaction that makes the change, delivered by
+     # store.outbox.relay once it's committed
+     topic = models.CharField(max_length=50)
+     payload = models.JSONField()
+     created_at = models.DateTimeField(auto_now_add=True)
+     available_at = models.DateTimeField(default=timezone.now)
+     processed_at = models.DateTimeField(null=True, blank=True)
+     attempts = models.PositiveSmallIntegerField(default=0)
+     last_error = models.TextField(blank=True)
+
+     class Meta:
+          indexes = [
+               # Pending events in order: processed_at IS NULL, seek on available_at
+               models.Index(fields=['processed_at', 'available_at', 'id']),
+          ]
+
+class IdempotencyKey(models.Model):
+     # Responses stored by store.idempotency.DatabaseBackend
+     key = models.CharField(max_length=64, unique=True)
+     fingerprint = models.CharField(max_length=64)
+     status_code = models.PositiveSmallIntegerField(null=True)
+     data = models.JSONField(null=True)
+     locked_until = models.DateTimeField(null=True)
+     expires_at = models.DateTimeField()
+
+     class Meta:
+          indexes = [models.Index(fields=['expires_at'])]
+
 class Address(models.Model):
      street = models.CharField(max_length=255)
      city = models.CharField(max_length=255)
      customer = models.ForeignKey(Customer,on_delete= models.PROTECT)
     
 
+# quantity * unit_price with the precision of a cart or order total
+LINE_TOTAL_FIELD = models.DecimalField(max_digits=14, decimal_places=2)
+
+class CartQuerySet(models.QuerySet):
+    def with_totals(self):
+        # Cart total and line totals computed by the database, with only
+        # the product columns SimpleProductSerializer reads
+        total = Sum(models.F('items__quantity') * models.F('items__product__unit_price'),
+                    output_field=LINE_TOTAL_FIELD)
+        return self \
+            .annotate(total_price=Coalesce(total, Value(Decimal(0)), output_field=LINE_TOTAL_FIELD)) \
+            .prefetch_related(models.Prefetch('items', queryset=CartItem.objects.with_totals()))
+
 class Cart(models.Model):
      id = models.UUIDField(primary_key=True, default=uuid4)
      created_at = models.DateField(auto_now_add=True)
 
+     objects = CartQuerySet.as_manager()
+
+     # Expired carts are found by age, see store.carts.purge_expired_carts
+     class Meta:
+          indexes = [models.Index(fields=['created_at'])]
+
+# CartItem.quantity is a PositiveSmallIntegerField, lines are capped at
+# its maximum by every cart store
+MAX_CART_QUANTITY = 32767
+
+class CartItemQuerySet(models.QuerySet):
+    def with_totals(self):
+        return self \
+            .select_related('product') \
+            .only('id', 'cart_id', 'quantity', 'product__id', 'product__title', 'product__unit_price') \
+            .annotate(total_price=ExpressionWrapper(
+                models.F('quantity') * models.F('product__unit_price'), output_field=LINE_TOTAL_FIELD))
+
+    def add_quantities(self, cart_id, quantities):
+        # Adds {product_id: quantity} to the cart in one INSERT that bumps
+        # existing lines in place, so concurrent adds neither lose updates
+        # nor trip the unique constraint. Lines stop at MAX_CART_QUANTITY
+        connection = connections[self.db]
+        meta = self.model._meta
+        quote = connection.ops.quote_name
+        table = quote(meta.db_table)
+        id_column, cart_column, product_column, quantity_column = [
+            quote(meta.get_field(name).column) for name in ('id', 'cart', 'product', 'quantity')
+        ]
+        cart_value = meta.get_field('cart').get_db_prep_value(cart_id, connection)
+        # A fixed row order keeps concurrent statements from deadlocking
+        lines = sorted(quantities.items())
+        params = [
+            value for product_id, quantity in lines
+            for value in (cart_value, product_id, min(quantity, MAX_CART_QUANTITY))
+        ]
+        least = 'MIN' if connection.vendor == 'sqlite' else 'LEAST'
+
+        sql = (f'INSERT INTO {table} ({cart_column}, {product_column}, {quantity_column}) '
+               f'VALUES {", ".join(["(%s, %s, %s)"] * len(lines))} ')
+        if connection.vendor == 'mysql':
+            sql += (f'ON DUPLICATE KEY UPDATE {quantity_column} = '
+                    f'{least}({quantity_column} + VALUES({quantity_column}), %s)')
+        else:
+            sql += (f'ON CONFLICT ({cart_column}, {product_column}) DO UPDATE '
+                    f'SET {quantity_column} = {least}({table}.{quantity_column} + excluded.{quantity_column}, %s)')
+        params.append(MAX_CART_QUANTITY)
+        returning = connection.features.can_return_rows_from_bulk_insert
+        if returning:
+            sql += f' RETURNING {id_column}, {product_column}, {quantity_column}'
+
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            rows = cursor.fetchall() if returning else None
+        if rows is None:
+            return list(self.filter(cart_id=cart_id, product_id__in=quantities).order_by('product_id'))
+        return [
+            self.model.from_db(self.db, ['id', 'cart_id', 'product_id', 'quantity'],
+                               (pk, meta.get_field('cart').to_python(cart_id), product_id, quantity))
+            for pk, product_id, quantity in sorted(rows, key=lambda row: row[1])
+        ]
+
 class CartItem(models.Model):
      cart = models.ForeignKey(Cart, on_delete= models.CASCADE, related_name='items') #Instead  of Cartitem_set
      product = models.ForeignKey(Product, on_delete=models.CASCADE)
      quantity = models.PositiveSmallIntegerField()
 
+     objects = CartItemQuerySet.as_manager()
+
      #Unique Constrait
      #Avoid creating duplicate record
      class Meta:
           unique_together = [['cart', 'product']]
 
+class Reservation(models.Model):
+     # Not a foreign key, the cart may live outside the database (store/carts.py)
+     cart_id = models.UUIDField()
+     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='reservations')
+     quantity = models.PositiveIntegerField()
+     expires_at = models.DateTimeField()
+
+     class Meta:
+          unique_together = [['cart_id', 'product']]
+          indexes = [models.Index(fields=['expires_at'])]
+
 class Review(models.Model):
      product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='reviews')
      name = models.CharField(max_length=255)
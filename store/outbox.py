@@ -0,0 +1,114 @@
+import logging
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from .models import Order, OutboxEvent
+from .signals import order_created
+
+logger = logging.getLogger(__name__)
+
+ORDER_CREATED = 'order_created'
+
+DEFAULT_OUTBOX = {
+    'BATCH_SIZE': 100,
+    'MAX_ATTEMPTS': 10,
+    'RETRY_DELAY': 30,
+    'RETENTION_DAYS': 7,
+}
+
+
+def get_config():
+    config = dict(DEFAULT_OUTBOX)
+    config.update(getattr(settings, 'STORE_OUTBOX', {}))
+    return config
+
+
+def publish(topic, **payload):
+    # Call inside the transaction of the change, the event is only
+    # delivered if that commits
+    return OutboxEvent.objects.create(topic=topic, payload=payload)
+
+
+def load_orders(events):
+    # One query for the orders of a whole batch
+    orders = Order.objects.in_bulk([event.payload['order_id'] for event in events])
+    return {event.pk: {'order': orders.get(event.payload['order_id'])} for event in events}
+
+
+# topic -> (signal whose receivers handle it, loader of the receivers' kwargs)
+TOPICS = {
+    ORDER_CREATED: (order_created, load_orders),
+}
+
+
+def dispatch(events):
+    # Returns {event_id: error} for the events a receiver failed on
+    failed = {}
+    by_topic = {}
+    for event in events:
+        by_topic.setdefault(event.topic, []).append(event)
+    for topic, topic_events in by_topic.items():
+        if topic not in TOPICS:
+            failed.update({event.pk: f'No handler for {topic}' for event in topic_events})
+            continue
+        signal, load = TOPICS[topic]
+        kwargs = load(topic_events)
+        for event in topic_events:
+            responses = signal.send_robust(OutboxEvent, event_id=event.pk, **kwargs[event.pk])
+            errors = [repr(response) for _, response in responses if isinstance(response, Exception)]
+            if errors:
+                failed[event.pk] = '\n'.join(errors)
+    return failed
+
+
+def relay(batch_size=None, max_batches=None):
+    """
+    Delivers pending events in batches, oldest first, and marks them
+    processed. A batch is locked while it's delivered, so several relays
+    can run, and a relay that dies leaves it pending: delivery is at least
+    once and receivers have to be idempotent. Failed events are retried
+    after RETRY_DELAY * 2 ** attempts seconds, up to MAX_ATTEMPTS times.
+    Returns the number of events delivered.
+    """
+    config = get_config()
+    batch_size = batch_size or config['BATCH_SIZE']
+    delivered = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        batches += 1
+        now = timezone.now()
+        with transaction.atomic():
+            events = list(OutboxEvent.objects
+                          .select_for_update(skip_locked=True)
+                          .filter(processed_at=None, available_at__lte=now, attempts__lt=config['MAX_ATTEMPTS'])
+                          .order_by('available_at', 'id')[:batch_size])
+            if not events:
+                break
+            failed = dispatch(events)
+
+            OutboxEvent.objects \
+                .filter(pk__in=[event.pk for event in events if event.pk not in failed]) \
+                .update(processed_at=now)
+            retries = [event for event in events if event.pk in failed]
+            for event in retries:
+                event.attempts += 1
+                event.available_at = now + timedelta(seconds=config['RETRY_DELAY'] * 2 ** (event.attempts - 1))
+                event.last_error = failed[event.pk]
+                logger.warning('Outbox event %s (%s) failed, attempt %s', event.pk, event.topic, event.attempts)
+            if retries:
+                OutboxEvent.objects.bulk_update(retries, ['attempts', 'available_at', 'last_error'])
+        delivered += len(events) - len(retries)
+        if len(events) < batch_size:
+            break
+    return delivered
+
+
+def purge_processed(batch_size=None):
+    # Bounded per call, whatever is left goes on the next run
+    config = get_config()
+    cutoff = timezone.now() - timedelta(days=config['RETENTION_DAYS'])
+    ids = list(OutboxEvent.objects
+               .filter(processed_at__lt=cutoff)
+               .values_list('pk', flat=True)[:batch_size or config['BATCH_SIZE']])
+    return OutboxEvent.objects.filter(pk__in=ids).delete()[0] if ids else 0
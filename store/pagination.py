@@ -1,4 +1,205 @@
-from rest_framework.pagination import PageNumberPagination
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as BinasciiError
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db import DatabaseError, connections
+from django.db.models import Q
+from django.db.models.constants import LOOKUP_SEP
+from rest_framework.exceptions import NotFound
+from rest_framework.filters import OrderingFilter
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 
 class DefaultPagination(PageNumberPagination):
-    page_size = 10
\ No newline at end of file
+    page_size = 10
+
+
+# Row count from the planner statistics instead of a COUNT(*),
+# only meaningful for the whole table so filtered querysets return None
+TABLE_ESTIMATE_SQL = {
+    'mysql': (
+        'SELECT TABLE_ROWS FROM information_schema.TABLES '
+        'WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s'
+    ),
+    'postgresql': 'SELECT reltuples::bigint FROM pg_class WHERE relname = %s',
+    'sqlite': 'SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1',
+}
+
+def estimate_count(queryset):
+    if queryset.query.where:
+        return None
+    connection = connections[queryset.db]
+    sql = TABLE_ESTIMATE_SQL.get(connection.vendor)
+    if sql is None:
+        return None
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [queryset.model._meta.db_table])
+            row = cursor.fetchone()
+    except DatabaseError:
+        # e.g. sqlite_stat1 only exists after ANALYZE
+        return None
+    if row is None or row[0] is None:
+        return None
+    return max(int(str(row[0]).split()[0]), 0)
+
+
+class KeysetPagination(BasePagination):
+    """
+    Seeks to the next page with a WHERE on the last row's sort key
+    instead of COUNT(*) + OFFSET, so every page costs the same.
+    The sort key is the active ordering with the primary key as tiebreaker.
+    """
+    page_size = 10
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    ordering = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.ordering = self.get_ordering(request, queryset, view)
+        cursor = self.decode_cursor(request, queryset)
+        reverse = cursor is not None and cursor['r']
+
+        ordering = [self.flip(field) for field in self.ordering] if reverse else self.ordering
+        page_queryset = queryset.order_by(*ordering)
+        if cursor is not None:
+            page_queryset = page_queryset.filter(self.seek(ordering, cursor['v']))
+
+        results = list(page_queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+            self.has_next = True
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = cursor is not None
+
+        self.count = None
+        if request.query_params.get(self.count_query_param) == 'estimated':
+            self.count = estimate_count(queryset)
+
+        self.page = results
+        return results
+
+    def get_paginated_response(self, data):
+        response = {
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        }
+        if self.count is not None:
+            response = {'count': self.count, **response}
+        return Response(response)
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'count': {'type': 'integer', 'nullable': True},
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_ordering(self, request, queryset, view):
+        ordering = None
+        for backend in getattr(view, 'filter_backends', []):
+            if issubclass(backend, OrderingFilter):
+                ordering = backend().get_ordering(request, queryset, view)
+                break
+        if not ordering:
+            # An ordering set by an earlier filter, e.g. search relevance
+            explicit = [field for field in queryset.query.order_by if isinstance(field, str)]
+            ordering = self.ordering or explicit or queryset.model._meta.ordering
+        ordering = list(ordering)
+
+        pk_name = queryset.model._meta.pk.name
+        if not any(field.lstrip('-') in (pk_name, 'pk') for field in ordering):
+            descending = bool(ordering) and ordering[-1].startswith('-')
+            ordering.append(f'-{pk_name}' if descending else pk_name)
+        return ordering
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def encode_cursor(self, row, reverse):
+        values = [self.get_value(row, field.lstrip('-')) for field in self.ordering]
+        payload = json.dumps({'o': self.ordering, 'v': values, 'r': reverse}, default=str, separators=(',', ':'))
+        token = urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+        url = remove_query_param(self.request.build_absolute_uri(), self.count_query_param)
+        return replace_query_param(url, self.cursor_query_param, token)
+
+    def decode_cursor(self, request, queryset):
+        token = request.query_params.get(self.cursor_query_param)
+        if not token:
+            return None
+        try:
+            payload = urlsafe_b64decode(token + '=' * (-len(token) % 4))
+            cursor = json.loads(payload)
+            ordering, values, reverse = cursor['o'], cursor['v'], bool(cursor['r'])
+        except (BinasciiError, ValueError, TypeError, KeyError):
+            raise NotFound('Invalid cursor')
+        # A link from another ordering, e.g. ?ordering= added to a next link
+        if ordering != self.ordering or not isinstance(values, list) or len(values) != len(self.ordering):
+            raise NotFound('Invalid cursor')
+        try:
+            values = [
+                self.to_python(queryset, field.lstrip('-'), value)
+                for field, value in zip(self.ordering, values)
+            ]
+        except (ValidationError, ValueError, TypeError):
+            raise NotFound('Invalid cursor')
+        return {'v': values, 'r': reverse}
+
+    @staticmethod
+    def to_python(queryset, name, value):
+        # The cursor value as its model field or annotation takes it
+        if name in queryset.query.annotations:
+            field = queryset.query.annotations[name].output_field
+        else:
+            opts = queryset.model._meta
+            parts = name.split(LOOKUP_SEP)
+            try:
+                for part in parts[:-1]:
+                    opts = opts.get_field(part).related_model._meta
+                field = opts.pk if parts[-1] == 'pk' else opts.get_field(parts[-1])
+            except (FieldDoesNotExist, AttributeError):
+                return value
+        return field.to_python(value)
+
+    @staticmethod
+    def get_value(row, field):
+        value = row
+        for attr in field.split('__'):
+            value = getattr(value, attr)
+        return value
+
+    @staticmethod
+    def flip(field):
+        return field[1:] if field.startswith('-') else f'-{field}'
+
+    @staticmethod
+    def seek(ordering, values):
+        # (a, b, c) > (x, y, z) spelled out as
+        # a > x OR (a = x AND b > y) OR (a = x AND b = y AND c > z)
+        condition = Q()
+        equal = Q()
+        for field, value in zip(ordering, values):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition |= equal & Q(**{f'{name}__{lookup}': value})
+            equal &= Q(**{name: value})
+        return condition
@@ -0,0 +1,248 @@
+from decimal import Decimal
+from django.db import transaction
+from django.db.models import DecimalField, F, Max, Sum
+from .models import CollectionSales, Customer, Order, OrderItem, ProductSales
+
+# ProductSales and CollectionSales hold per day and payment_status totals
+# of OrderItem (quantity and quantity * unit_price), Customer.order_count
+# and lifetime_spend the customer's orders that aren't failed and what
+# the completed ones came to. Order.rollup_status records the status an
+# order is counted under, so syncing an order is idempotent: a new order
+# is added once, a status change moves its totals from the old status to
+# the new one, and anything else is a no-op.
+
+REVENUE = DecimalField(max_digits=14, decimal_places=2)
+CENT = Decimal('0.01')
+
+
+def line_totals(items):
+    # One row per day, product, collection and status, summed in the database
+    return items \
+        .values('product_id', day=F('order__placed_at'),
+                collection_id=F('product__collection'), payment_status=F('order__payment_status')) \
+        .order_by() \
+        .annotate(total_quantity=Sum('quantity'),
+                  total_revenue=Sum(F('quantity') * F('unit_price'), output_field=REVENUE))
+
+
+def add_totals(totals):
+    # totals is {(day, product_id, collection_id, status): [quantity, revenue]}
+    by_product, by_collection = {}, {}
+    for (day, product_id, collection_id, status), (quantity, revenue) in totals.items():
+        rows = [(by_product, (day, product_id, status))]
+        if collection_id is not None:
+            rows.append((by_collection, (day, collection_id, status)))
+        for target, key in rows:
+            current = target.setdefault(key, [0, Decimal(0)])
+            current[0] += quantity
+            current[1] += revenue
+    ProductSales.objects.add_sales([
+        {'day': day, 'product_id': product_id, 'payment_status': status, 'quantity': quantity, 'revenue': revenue}
+        for (day, product_id, status), (quantity, revenue) in by_product.items()
+    ])
+    CollectionSales.objects.add_sales([
+        {'day': day, 'collection_id': collection_id, 'payment_status': status, 'quantity': quantity, 'revenue': revenue}
+        for (day, collection_id, status), (quantity, revenue) in by_collection.items()
+    ])
+
+
+def sync_orders(order_ids, deleting=False):
+    """
+    Brings the rollups and the customers' order counters in line with the
+    current payment_status of the given orders, or takes the orders out
+    of them when deleting. Locks the orders, so it serializes with other
+    syncs of the same orders; orders that are already counted under their
+    status cost nothing beyond that lock.
+    """
+    with transaction.atomic():
+        orders = list(Order.objects
+                      .select_for_update()
+                      .filter(pk__in=list(order_ids))
+                      .order_by('pk')
+                      .values_list('pk', 'customer_id', 'placed_at', 'payment_status', 'rollup_status'))
+        changed = {}
+        for pk, customer_id, placed_at, status, previous in orders:
+            target = None if deleting else status
+            if target != previous:
+                changed[pk] = (customer_id, placed_at, target, previous)
+        if not changed:
+            return 0
+
+        totals = {}
+        spend = {pk: Decimal(0) for pk in changed}
+        items = OrderItem.objects \
+            .filter(order_id__in=list(changed)) \
+            .values_list('order_id', 'product_id', 'product__collection_id', 'quantity', 'unit_price')
+        for order_id, product_id, collection_id, quantity, unit_price in items:
+            _, placed_at, target, previous = changed[order_id]
+            spend[order_id] += quantity * unit_price
+            moves = [(target, 1), (previous, -1)]
+            for payment_status, sign in moves:
+                if payment_status is None:
+                    continue
+                current = totals.setdefault((placed_at, product_id, collection_id, payment_status), [0, Decimal(0)])
+                current[0] += sign * quantity
+                current[1] += sign * quantity * unit_price
+        add_totals(totals)
+        add_customer_stats(changed, spend)
+        if not deleting:
+            Order.objects.filter(pk__in=list(changed)).update(rollup_status=F('payment_status'))
+    return len(changed)
+
+
+def counts_toward(status):
+    # (order_count, lifetime_spend) an order under status adds to its customer
+    return (status not in (None, Order.PAYMENT_STATUS_FAILED), status == Order.PAYMENT_STATUS_COMPLETE)
+
+
+def add_customer_stats(changed, spend):
+    deltas = {}
+    for pk, (customer_id, _, target, previous) in changed.items():
+        (counted, paid), (was_counted, was_paid) = counts_toward(target), counts_toward(previous)
+        current = deltas.setdefault(customer_id, [0, Decimal(0)])
+        current[0] += counted - was_counted
+        current[1] += (paid - was_paid) * spend[pk]
+    # Customer order keeps concurrent syncs from deadlocking
+    for customer_id, (order_count, lifetime_spend) in sorted(deltas.items()):
+        if not (order_count or lifetime_spend):
+            continue
+        changes = {'order_count': F('order_count') + order_count,
+                   'lifetime_spend': F('lifetime_spend') + lifetime_spend}
+        # Completed orders are what the membership tiers go by
+        if lifetime_spend:
+            changes['tier_stale'] = True
+        Customer.objects.filter(pk=customer_id).update(**changes)
+
+
+def rebuild(since=None, batch_size=1000):
+    """
+    Recomputes the rollups from the orders, all of them or those placed on
+    or after since, batch_size orders per transaction so the order table
+    is never locked as a whole:
+
+    1. the orders are marked uncounted (rollup_status None)
+    2. in one short transaction, the rollup rows are deleted and the
+       orders a sync counted again meanwhile are marked once more
+    3. the uncounted orders are counted
+
+    The customers' counters are recomputed with each batch. A sync of an
+    order between 2 and its batch counts it like a new order, and the
+    batch skips it. Returns the number of orders counted.
+    """
+    orders = Order.objects.all()
+    rollups = [ProductSales.objects.all(), CollectionSales.objects.all()]
+    if since is not None:
+        orders = orders.filter(placed_at__gte=since)
+        rollups = [queryset.filter(day__gte=since) for queryset in rollups]
+
+    while True:
+        with transaction.atomic():
+            ids = lock_batch(orders.exclude(rollup_status=None), batch_size)
+            uncount_orders(ids)
+        if len(ids) < batch_size:
+            break
+
+    with transaction.atomic():
+        synced = list(orders.select_for_update().exclude(rollup_status=None).values_list('pk', flat=True))
+        for queryset in rollups:
+            queryset.delete()
+        uncount_orders(synced)
+        last_id = orders.aggregate(last_id=Max('pk'))['last_id']
+    if last_id is None:
+        return 0
+
+    counted = 0
+    while True:
+        with transaction.atomic():
+            ids = lock_batch(orders.filter(pk__lte=last_id, rollup_status=None), batch_size)
+            if ids:
+                counted += count_orders(ids)
+        if len(ids) < batch_size:
+            return counted
+
+
+def lock_batch(orders, batch_size):
+    # The first batch_size pks of orders, locked until the transaction ends
+    return list(orders.select_for_update().order_by('pk').values_list('pk', flat=True)[:batch_size])
+
+
+def refresh_customers(ids):
+    # Their customers' counters go by rollup_status
+    Customer.objects.filter(pk__in=Order.objects.filter(pk__in=ids).values('customer_id')).refresh_order_stats()
+
+
+def uncount_orders(ids):
+    # Only rollup_status, rebuild deletes the rollup rows wholesale
+    if ids:
+        Order.objects.filter(pk__in=ids).update(rollup_status=None)
+        refresh_customers(ids)
+
+
+def count_orders(ids):
+    # Adds uncounted orders to the rollups under their current status
+    totals = {
+        (row['day'], row['product_id'], row['collection_id'], row['payment_status']):
+            [row['total_quantity'], row['total_revenue']]
+        for row in line_totals(OrderItem.objects.filter(order_id__in=ids))
+    }
+    add_totals(totals)
+    counted = Order.objects.filter(pk__in=ids).update(rollup_status=F('payment_status'))
+    refresh_customers(ids)
+    return counted
+
+
+def sales_report(start, end, group_by='day', payment_status=None):
+    # Totals for start <= day <= end, by day, product or collection.
+    # Failed payments are left out unless asked for
+    model = CollectionSales if group_by == 'collection' else ProductSales
+    key = {'day': 'day', 'product': 'product_id', 'collection': 'collection_id'}[group_by]
+    rows = model.objects.filter(day__gte=start, day__lte=end)
+    if payment_status:
+        rows = rows.filter(payment_status=payment_status)
+    else:
+        rows = rows.exclude(payment_status=Order.PAYMENT_STATUS_FAILED)
+
+    results = [
+        {group_by: row[key], 'quantity': row['total_quantity'], 'revenue': quantize(row['total_revenue'])}
+        for row in rows.values(key).order_by(key).annotate(total_quantity=Sum('quantity'), total_revenue=Sum('revenue'))
+        if row['total_quantity']
+    ]
+    return {
+        'start': start,
+        'end': end,
+        'group_by': group_by,
+        'quantity': sum(row['quantity'] for row in results),
+        'revenue': sum((row['revenue'] for row in results), Decimal(0)).quantize(CENT),
+        'results': results,
+    }
+
+
+def quantize(value):
+    # SQLite sums decimals as floats
+    return Decimal(str(value or 0)).quantize(CENT)
+
+
+def reconcile_customers(batch_size=1000):
+    """
+    Recomputes Customer.order_count and lifetime_spend from the orders,
+    batch_size customers per transaction, and returns how many had
+    drifted. A batch's customers are locked first, so syncs running
+    meanwhile either land before the recount or wait for it.
+    """
+    repaired = 0
+    last_id = 0
+    while True:
+        with transaction.atomic():
+            ids = list(Customer.objects
+                       .select_for_update()
+                       .filter(pk__gt=last_id)
+                       .order_by('pk')
+                       .values_list('pk', flat=True)[:batch_size])
+            if not ids:
+                return repaired
+            drifted = list(Customer.objects.filter(pk__in=ids).drifted().values_list('pk', flat=True))
+            if drifted:
+                repaired += Customer.objects.filter(pk__in=drifted).refresh_order_stats()
+        last_id = ids[-1]
+        if len(ids) < batch_size:
+            return repaired
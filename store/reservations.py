@@ -0,0 +1,95 @@
+from datetime import timedelta
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from .models import Product, Reservation
+
+DEFAULT_RESERVATIONS = {
+    'ENABLED': False,
+    'TTL': 15 * 60,
+    'BATCH_SIZE': 1000,
+}
+
+# Adding to a cart sets stock aside for TTL seconds, checkout turns the
+# cart's reservations into the inventory decrement. Product.reserved is
+# the running total, moved by the same transactions as the rows.
+
+
+def get_config():
+    config = dict(DEFAULT_RESERVATIONS)
+    config.update(getattr(settings, 'STORE_RESERVATIONS', {}))
+    return config
+
+
+def is_enabled():
+    return get_config()['ENABLED']
+
+
+def reserve(cart_id, quantities):
+    # Raises InsufficientStock, and then reserves nothing
+    expires_at = timezone.now() + timedelta(seconds=get_config()['TTL'])
+    upsert = {'update_conflicts': True, 'update_fields': ['quantity', 'expires_at']}
+    if connection.features.supports_update_conflicts_with_target:
+        upsert['unique_fields'] = ['cart_id', 'product']
+
+    with transaction.atomic():
+        Product.objects.reserve_inventory(quantities)
+        held = get_held(cart_id, quantities)
+        Reservation.objects.bulk_create([
+            Reservation(cart_id=cart_id, product_id=product_id,
+                        quantity=held.get(product_id, 0) + quantity, expires_at=expires_at)
+            for product_id, quantity in sorted(quantities.items())
+        ], **upsert)
+
+
+def get_held(cart_id, product_ids=None):
+    # {product_id: quantity} the cart has reserved, locked for the
+    # rest of the transaction. Expired rows count until they're released
+    reservations = Reservation.objects.select_for_update().filter(cart_id=cart_id)
+    if product_ids is not None:
+        reservations = reservations.filter(product_id__in=list(product_ids))
+    return dict(reservations.order_by('product_id').values_list('product_id', 'quantity'))
+
+
+def consume(cart_id, held, taken):
+    # For checkout: the decrement already took the held quantities of the
+    # products it took (taken) off Product.reserved. What the cart held for
+    # other products, e.g. a line set to 0 after reserving, goes back
+    Product.objects.release_reserved({
+        product_id: quantity for product_id, quantity in held.items() if product_id not in taken
+    })
+    Reservation.objects.filter(cart_id=cart_id).delete()
+
+
+def release(cart_id, product_ids=None):
+    with transaction.atomic():
+        held = get_held(cart_id, product_ids)
+        if held:
+            Product.objects.release_reserved(held)
+            Reservation.objects.filter(cart_id=cart_id, product_id__in=list(held)).delete()
+
+
+def release_expired(batch_size=None):
+    """
+    Gives expired reservations back to the available stock, batch_size
+    rows per transaction: one UPDATE on the products and one DELETE per batch.
+    Rows a checkout has locked are skipped. Returns the number released.
+    """
+    batch_size = batch_size or get_config()['BATCH_SIZE']
+    released = 0
+    while True:
+        with transaction.atomic():
+            rows = list(Reservation.objects
+                        .select_for_update(skip_locked=True)
+                        .filter(expires_at__lte=timezone.now())
+                        .values_list('pk', 'product_id', 'quantity')[:batch_size])
+            if not rows:
+                return released
+            quantities = {}
+            for _, product_id, quantity in rows:
+                quantities[product_id] = quantities.get(product_id, 0) + quantity
+            Product.objects.release_reserved(quantities)
+            Reservation.objects.filter(pk__in=[pk for pk, _, _ in rows]).delete()
+        released += len(rows)
+        if len(rows) < batch_size:
+            return released
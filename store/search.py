@@ -0,0 +1,161 @@
+import re
+from django.conf import settings
+from django.db import connections, models
+from django.db.models import F, Q
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+from rest_framework.filters import SearchFilter
+
+FTS_TABLE = 'store_product_fts'
+
+# Only word characters reach the index, the operators of each
+# engine's query syntax are never taken from user input
+TOKEN = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(terms):
+    return [token for term in terms for token in TOKEN.findall(term)]
+
+
+class LikeSearchBackend:
+    # Fallback for databases without a full-text index: LIKE '%term%'
+    def search(self, queryset, terms, fields):
+        for term in terms:
+            condition = Q()
+            for field in fields:
+                condition |= Q(**{f'{field}__icontains': term})
+            queryset = queryset.filter(condition)
+        return queryset
+
+
+class SearchDocumentField(models.TextField):
+    # The hidden column named after an FTS5 table, MATCH on it searches every column
+    pass
+
+
+@SearchDocumentField.register_lookup
+class Match(models.Lookup):
+    lookup_name = 'match'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs} MATCH {rhs}', lhs_params + rhs_params
+
+
+class SQLiteSearchBackend:
+    # Joins the FTS5 table through ProductSearchEntry, see install()
+    def search(self, queryset, terms, fields):
+        tokens = tokenize(terms)
+        if not tokens:
+            return queryset
+        # Every token must match, the last one as a prefix
+        query = ' '.join(f'"{token}"' for token in tokens) + '*'
+        # bm25 is lower for better matches, negate it so higher ranks first
+        return queryset \
+            .filter(search_entry__document__match=query) \
+            .annotate(search_rank=-F('search_entry__rank')) \
+            .order_by('-search_rank')
+
+
+class MySQLSearchBackend:
+    # FULLTEXT index on (title, description), InnoDB keeps it up to date
+    def search(self, queryset, terms, fields):
+        tokens = tokenize(terms)
+        if not tokens:
+            return queryset
+        query = ' '.join(f'+{token}' for token in tokens) + '*'
+        rank = RawSQL('MATCH (title, description) AGAINST (%s IN BOOLEAN MODE)', [query])
+        return queryset.annotate(search_rank=rank).filter(search_rank__gt=0).order_by('-search_rank')
+
+
+VENDOR_BACKENDS = {
+    'sqlite': 'store.search.SQLiteSearchBackend',
+    'mysql': 'store.search.MySQLSearchBackend',
+}
+
+
+def get_backend(using='default'):
+    path = getattr(settings, 'STORE_SEARCH_BACKEND', None)
+    if path is None:
+        path = VENDOR_BACKENDS.get(connections[using].vendor, 'store.search.LikeSearchBackend')
+    return import_string(path)()
+
+
+class ProductSearchFilter(SearchFilter):
+    # Same ?search= parameter as SearchFilter, answered from the index
+    def filter_queryset(self, request, queryset, view):
+        fields = self.get_search_fields(view, request)
+        terms = self.get_search_terms(request)
+        if not fields or not terms:
+            return queryset
+        return get_backend(queryset.db).search(queryset, terms, fields)
+
+
+# Index DDL, run from migrations and the rebuild_search_index command.
+# SQLite drops triggers whenever a migration rebuilds store_product,
+# so migrations that alter the table call install() again.
+SQLITE_INSTALL = [
+    f'DROP TRIGGER IF EXISTS {FTS_TABLE}_ai',
+    f'DROP TRIGGER IF EXISTS {FTS_TABLE}_ad',
+    f'DROP TRIGGER IF EXISTS {FTS_TABLE}_au',
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+    f"title, description, content='store_product', content_rowid='id')",
+    f'CREATE TRIGGER {FTS_TABLE}_ai AFTER INSERT ON store_product BEGIN '
+    f'INSERT INTO {FTS_TABLE}(rowid, title, description) '
+    f'VALUES (new.id, new.title, new.description); END',
+    f'CREATE TRIGGER {FTS_TABLE}_ad AFTER DELETE ON store_product BEGIN '
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, description) "
+    f"VALUES ('delete', old.id, old.title, old.description); END",
+    f'CREATE TRIGGER {FTS_TABLE}_au AFTER UPDATE ON store_product BEGIN '
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, description) "
+    f"VALUES ('delete', old.id, old.title, old.description); "
+    f'INSERT INTO {FTS_TABLE}(rowid, title, description) '
+    f'VALUES (new.id, new.title, new.description); END',
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')",
+]
+
+SQLITE_UNINSTALL = [
+    f'DROP TRIGGER IF EXISTS {FTS_TABLE}_ai',
+    f'DROP TRIGGER IF EXISTS {FTS_TABLE}_ad',
+    f'DROP TRIGGER IF EXISTS {FTS_TABLE}_au',
+    f'DROP TABLE IF EXISTS {FTS_TABLE}',
+]
+
+MYSQL_INDEX = 'store_product_title_description_ft'
+
+MYSQL_INSTALL = [
+    f'CREATE FULLTEXT INDEX {MYSQL_INDEX} ON store_product (title, description)',
+]
+
+MYSQL_UNINSTALL = [
+    f'DROP INDEX {MYSQL_INDEX} ON store_product',
+]
+
+
+def _has_mysql_index(cursor):
+    cursor.execute(
+        'SELECT 1 FROM information_schema.STATISTICS '
+        'WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s',
+        ['store_product', MYSQL_INDEX])
+    return cursor.fetchone() is not None
+
+
+def install(connection):
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            for sql in SQLITE_INSTALL:
+                cursor.execute(sql)
+        elif connection.vendor == 'mysql' and not _has_mysql_index(cursor):
+            for sql in MYSQL_INSTALL:
+                cursor.execute(sql)
+
+
+def uninstall(connection):
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            for sql in SQLITE_UNINSTALL:
+                cursor.execute(sql)
+        elif connection.vendor == 'mysql' and _has_mysql_index(cursor):
+            for sql in MYSQL_UNINSTALL:
+                cursor.execute(sql)
@@ -1,8 +1,16 @@
 from rest_framework import serializers
 from django.db import transaction
-from .signals import order_created
+from .images import variant_urls
+from .carts import CartNotFound, get_cart_store
+from . import outbox, reservations
+from django.db.models import F
 from decimal import Decimal
 from store.models import Product, Collection, Review, Cart, CartItem, Customer, Order, OrderItem, ProductImage
+from store.models import InsufficientStock, MAX_CART_QUANTITY, Reservation
+
+# Built from strings, Decimal(1.1) would carry the float's binary error
+TAX_RATE = Decimal('1.1')
+CENT = Decimal('0.01')
 
 class ProductImageSerializer(serializers.ModelSerializer):
     # def create(self, validated_data):
@@ -22,28 +30,36 @@ class ProductImageSerializer(serializers.ModelSerializer):
         return product_image
 
 
+    # Empty until the worker has processed the upload
+    variants = serializers.SerializerMethodField()
+
+    def get_variants(self, product_image:ProductImage):
+        return variant_urls(product_image.variants)
+
     class Meta:
         model = ProductImage
-        fields = ['id', 'image']
+        fields = ['id', 'image', 'variants']
 
 class ProductSerializer(serializers.ModelSerializer):
     images = ProductImageSerializer(many=True, read_only=True)
 
+    # The stock is served by /store/products/stock/, see ProductViewSet
     class Meta:
         model = Product
-        fields = ['id','title','unit_price','price_with_tax', 'images']
+        fields = ['id','title','unit_price','price_with_tax', 'collection', 'images']
         
 
     price_with_tax = serializers.SerializerMethodField(method_name='calculate_tax')
 
     def calculate_tax(self,product:Product):
-        return product.unit_price * Decimal(1.1)
+        return (product.unit_price * TAX_RATE).quantize(CENT)
     
 
 class CollectionSerializer(serializers.ModelSerializer):
     class Meta:
         model = Collection
-        fields = ['title','id','featured_product']
+        fields = ['title','id','featured_product', 'products_count']
+        read_only_fields = ['products_count']
 
 class ReviewSerializer(serializers.ModelSerializer):
     class Meta:
@@ -60,8 +76,11 @@ class CartItemSerializer(serializers.ModelSerializer):
     # Set Total_price
     total_price = serializers.SerializerMethodField()
 
-    #Define a method for total_price
+    #Define a method for total_price, annotated by CartItem.objects.with_totals()
     def get_total_price(self, cart_item:CartItem):
+        if hasattr(cart_item, 'total_price'):
+            # SQLite hands back the product as a float
+            return cart_item.total_price.quantize(CENT)
         return cart_item.quantity * cart_item.product.unit_price
 
     class Meta:
@@ -77,36 +96,96 @@ class CartSerializer(serializers.ModelSerializer):
     #Set Total_price for cart
     total_price = serializers.SerializerMethodField()
 
-    #Define a Total_price method
+    #Define a Total_price method, annotated by Cart.objects.with_totals()
     def get_total_price(self, cart:Cart):
+        if hasattr(cart, 'total_price'):
+            return cart.total_price.quantize(CENT)
         return sum([item.quantity * item.product.unit_price for item in cart.items.all()])
 
     class Meta:
         model = Cart
         fields = ['id', 'items', 'total_price']
 
+def validate_product_ids(product_ids):
+    # One query for however many lines are being added
+    found = set(Product.objects.filter(pk__in=product_ids).values_list('pk', flat=True))
+    missing = sorted(set(product_ids) - found)
+    if missing:
+        raise serializers.ValidationError(f'No product with the given ID was found: {missing}')
+
+def stock_errors(quantities, held=None):
+    # Per-product messages once a conditional stock UPDATE came up short,
+    # read afterwards so they show the stock as it stands
+    held = held or {}
+    available = dict(Product.objects
+                     .filter(pk__in=list(quantities))
+                     .values_list('pk', F('inventory') - F('reserved')))
+    errors = {}
+    for product_id, quantity in sorted(quantities.items()):
+        left = available.get(product_id, 0) + held.get(product_id, 0)
+        if left < quantity:
+            errors[str(product_id)] = [f'Only {max(left, 0)} left in stock']
+    # Restocked in the meantime, a retry may go through
+    return {'items': errors or ['Stock changed, try again']}
+
+def add_to_cart(cart_id, quantities):
+    if not reservations.is_enabled():
+        return get_cart_store().add(cart_id, quantities)
+    # Stock is set aside before the lines are added, and handed
+    # back if the cart turns out not to exist
+    try:
+        reservations.reserve(cart_id, quantities)
+    except InsufficientStock:
+        raise serializers.ValidationError(stock_errors(quantities))
+    try:
+        return get_cart_store().add(cart_id, quantities)
+    except CartNotFound:
+        reservations.release(cart_id, quantities)
+        raise
+
 class AddCartItemSerializer(serializers.ModelSerializer):
     product_id = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=1, max_value=MAX_CART_QUANTITY)
+
+    def validate_product_id(self, product_id):
+        validate_product_ids([product_id])
+        return product_id
 
     def save(self, **kwargs):
         cart_id = self.context['cart_id']
         product_id = self.validated_data['product_id']
         quantity = self.validated_data['quantity']
 
-        try:
-            cart_item = CartItem.objects.get(cart_id=cart_id, product_id=product_id)
-            cart_item.quantity += quantity
-            cart_item.save()
-            self.instance = cart_item
-        except CartItem.DoesNotExist:
-            self.instance = CartItem.objects.create(cart_id=cart_id, **self.validated_data)
-
+        [self.instance] = add_to_cart(cart_id, {product_id: quantity})
         return self.instance
 
     class Meta:
         model = CartItem
         fields = ['id', 'product_id', 'quantity']
 
+class CartLineSerializer(serializers.Serializer):
+    product_id = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=1, max_value=MAX_CART_QUANTITY)
+
+class BulkAddCartItemSerializer(serializers.Serializer):
+    # Products are checked together in validate_items, not per line
+    items = CartLineSerializer(many=True, allow_empty=False)
+
+    def validate_items(self, items):
+        validate_product_ids([item['product_id'] for item in items])
+        return items
+
+    def save(self, **kwargs):
+        # Repeated products are merged into one line
+        quantities = {}
+        for item in self.validated_data['items']:
+            quantities[item['product_id']] = quantities.get(item['product_id'], 0) + item['quantity']
+        self.instance = add_to_cart(self.context['cart_id'], quantities)
+        return self.instance
+
+    def to_representation(self, instance):
+        return {'items': AddCartItemSerializer(instance, many=True).data}
+
 class UpdateCartItemSerializer(serializers.ModelSerializer):
     class Meta:
         model = CartItem
@@ -117,7 +196,9 @@ class CustomerSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Customer
-        fields = ['id', 'user_id', 'phone', 'birth_date', 'membership' ]
+        fields = ['id', 'user_id', 'first_name', 'last_name', 'phone', 'birth_date', 'membership', 'order_count', 'lifetime_spend']
+        # Computed from the spend by store.membership
+        read_only_fields = ['membership']
 
 class OrderItemSerializer(serializers.ModelSerializer):
     product = SimpleProductSerializer()
@@ -141,36 +222,84 @@ class UpdateOrderSerializer(serializers.ModelSerializer):
 class CreateOrderSerializer(serializers.Serializer):
     cart_id = serializers.UUIDField()
 
-    def validate_cart_id(self, cart_id):
-        if not Cart.objects.filter(pk=cart_id).exists():
-            raise serializers.ValidationError('No cart with the given id found')
-        if CartItem.objects.filter(cart_id=cart_id).count() == 0:
-            raise serializers.ValidationError('The cart is Empty')
-        return cart_id
-
+    # The cart is checked while it's loaded and locked in save(),
+    # a separate check here would be another query and could go stale
     def save(self, **kwargs):
-        with transaction.atomic():
-
-            cart_id=self.validated_data['cart_id']
+        cart_id = self.validated_data['cart_id']
+        store = get_cart_store()
 
-            customer = Customer.objects.get(user_id=self.context['user_id'])
-            order = Order.objects.create(customer=customer)
+        try:
+            order, order_items = self.place_order(cart_id, store)
+        except InsufficientStock as error:
+            held = None
+            if reservations.is_enabled():
+                held = dict(Reservation.objects.filter(cart_id=cart_id).values_list('product_id', 'quantity'))
+            raise serializers.ValidationError(stock_errors(error.args[0], held))
+
+        # Attached like a prefetch, so serializing the order runs no queries
+        order._prefetched_objects_cache = {'items': order_items}
+        self.instance = order
+        return order
+
+    def place_order(self, cart_id, store):
+        try:
+            return self.write_order(cart_id, store)
+        except Exception:
+            # A cart the store claimed for the checkout goes back
+            store.release_checkout(cart_id)
+            raise
 
-            cart_items = CartItem.objects\
-                    .select_related('product')\
-                    .filter(cart_id=cart_id)
+    def write_order(self, cart_id, store):
+        with transaction.atomic():
+            # Resolved from the token by the view
+            customer_id = self.context['customer_id']
+
+            # Read through the configured store, from the cart tables or from Redis
+            lines = store.get_checkout_lines(cart_id)
+            if lines is None:
+                raise serializers.ValidationError({'cart_id': ['No cart with the given id found']})
+            if not lines:
+                raise serializers.ValidationError({'cart_id': ['The cart is Empty']})
+
+            # Every line or none, a short product fails the whole order.
+            # What the cart has reserved is its own to take
+            held = reservations.get_held(cart_id) if reservations.is_enabled() else None
+            quantities = {line.product_id: line.quantity for line in lines}
+            Product.objects.decrement_inventory(quantities, held)
+            if held is not None:
+                reservations.consume(cart_id, held, quantities)
+
+            order = Order.objects.create(customer_id=customer_id)
             order_items = [
                 OrderItem(
                 order=order,
-                product=item.product,
-                unit_price=item.product.unit_price,
-                quantity=item.quantity
-            )for item in cart_items
+                product=line.product,
+                unit_price=line.product.unit_price,
+                quantity=line.quantity
+            )for line in lines
             ]
             OrderItem.objects.bulk_create(order_items)
-            Cart.objects.filter(pk=cart_id).delete()
-            
-            order_created.send_robust(self.__class__, order=order)
-
-            return 
-            
\ No newline at end of file
+            # MySQL doesn't hand back the ids of bulk inserted rows
+            if order_items[0].pk is None:
+                ids = dict(OrderItem.objects.filter(order=order).values_list('product_id', 'pk'))
+                for item in order_items:
+                    item.pk = ids[item.product_id]
+            # Gone when another checkout of the cart got there first
+            if not store.delete(cart_id):
+                raise serializers.ValidationError({'cart_id': ['No cart with the given id found']})
+
+            # Receivers run from the outbox relay once this commits
+            outbox.publish(outbox.ORDER_CREATED, order_id=order.id)
+        return order, order_items
+
+class SalesReportQuerySerializer(serializers.Serializer):
+    # Query parameters of the sales report, dates are inclusive
+    start = serializers.DateField()
+    end = serializers.DateField()
+    group_by = serializers.ChoiceField(choices=['day', 'product', 'collection'], default='day')
+    payment_status = serializers.ChoiceField(choices=Order.PAYMENT_STATUS_CHIOCE, required=False)
+
+    def validate(self, data):
+        if data['start'] > data['end']:
+            raise serializers.ValidationError({'end': ['end is before start']})
+        return data
@@ -1,9 +1,121 @@
-from store.models import Customer
+from store import reports
+from store.authentication import forget_principal
+from store.models import Collection, Customer, Order, Product, ProductImage, Promotion
+from store.signals import order_created
+from store.caching import bump_version, COLLECTIONS, PRODUCTS
+from store.tasks import process_product_image
 from django.conf import settings
+from django.db import transaction
 from django.dispatch import receiver
-from django.db.models.signals import post_save
+from django.db.models import F
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete, m2m_changed
 
 @receiver(post_save, sender=settings.AUTH_USER_MODEL)
 def create_customer_for_new_user(sender, **kwargs):
     if kwargs['created']:
-        Customer.objects.create(user=kwargs['instance'])
\ No newline at end of file
+        Customer.objects.create(user=kwargs['instance'])
+
+# Customer.first_name and last_name are copies of the user's
+@receiver(pre_save, sender=Customer)
+def copy_names_to_new_customer(sender, instance, raw, **kwargs):
+    if instance._state.adding and not raw and not (instance.first_name or instance.last_name):
+        instance.first_name = instance.user.first_name
+        instance.last_name = instance.user.last_name
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def copy_names_to_customer(sender, instance, created, update_fields, **kwargs):
+    # Logins only save last_login
+    if created or (update_fields is not None and not {'first_name', 'last_name'} & set(update_fields)):
+        return
+    Customer.objects \
+        .filter(user_id=instance.pk) \
+        .exclude(first_name=instance.first_name, last_name=instance.last_name) \
+        .update(first_name=instance.first_name, last_name=instance.last_name)
+
+# Cached principals of store.authentication go stale with either row
+@receiver([post_save, post_delete], sender=settings.AUTH_USER_MODEL)
+def forget_cached_user(sender, instance, **kwargs):
+    forget_principal(instance.pk)
+
+@receiver([post_save, post_delete], sender=Customer)
+def forget_cached_customer(sender, instance, **kwargs):
+    forget_principal(instance.user_id)
+
+# Any catalog write starts a new cache generation for product responses
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=ProductImage)
+@receiver([post_save, post_delete], sender=Promotion)
+@receiver(m2m_changed, sender=Product.promotion.through)
+def invalidate_product_responses(sender, **kwargs):
+    bump_version(PRODUCTS)
+
+
+# Collection.products_count follows every product that is created,
+# deleted or moved to another collection
+NEW_PRODUCT = object()
+
+@receiver(pre_save, sender=Product)
+def remember_previous_collection(sender, instance, raw, **kwargs):
+    # Loaded with the instance (Product.from_db), looked up only when it
+    # was deferred
+    if instance._state.adding:
+        instance._previous_collection_id = NEW_PRODUCT
+    elif hasattr(instance, '_loaded_collection_id'):
+        instance._previous_collection_id = instance._loaded_collection_id
+    else:
+        instance._previous_collection_id = Product.objects \
+            .filter(pk=instance.pk) \
+            .values_list('collection_id', flat=True) \
+            .first()
+
+@receiver(post_save, sender=Product)
+def update_products_count_on_save(sender, instance, created, **kwargs):
+    previous = getattr(instance, '_previous_collection_id', None)
+    instance._loaded_collection_id = instance.collection_id
+    if previous is NEW_PRODUCT:
+        if not created:
+            # A new instance saved over an existing row, its old
+            # collection is unknown
+            Collection.objects.refresh_products_count()
+            return
+        previous = None
+    if previous != instance.collection_id:
+        if previous is not None:
+            Collection.objects.filter(pk=previous).update(products_count=F('products_count') - 1)
+        if instance.collection_id is not None:
+            Collection.objects.filter(pk=instance.collection_id).update(products_count=F('products_count') + 1)
+        bump_version(COLLECTIONS)
+
+@receiver(post_delete, sender=Product)
+def update_products_count_on_delete(sender, instance, **kwargs):
+    if instance.collection_id is not None:
+        Collection.objects.filter(pk=instance.collection_id).update(products_count=F('products_count') - 1)
+        bump_version(COLLECTIONS)
+
+@receiver([post_save, post_delete], sender=Collection)
+def invalidate_collection_responses(sender, **kwargs):
+    bump_version(COLLECTIONS)
+
+# Variants are generated by a worker once the upload is committed
+@receiver(post_save, sender=ProductImage)
+def queue_image_processing(sender, instance, raw, update_fields, **kwargs):
+    if raw or (update_fields is not None and 'image' not in update_fields):
+        return
+    transaction.on_commit(lambda: process_product_image.delay(instance.pk))
+
+# Sales rollups and customer counters: new orders are counted when
+# order_created is relayed, off the checkout transaction; status changes
+# and deletions move them right away
+@receiver(order_created)
+def count_new_order(sender, order, **kwargs):
+    if order is not None:
+        reports.sync_orders([order.pk])
+
+@receiver(post_save, sender=Order)
+def recount_changed_order(sender, instance, created, raw, **kwargs):
+    if not created and not raw:
+        reports.sync_orders([instance.pk])
+
+@receiver(pre_delete, sender=Order)
+def uncount_deleted_order(sender, instance, **kwargs):
+    reports.sync_orders([instance.pk], deleting=True)
@@ -0,0 +1,66 @@
+import logging
+from celery import shared_task
+from .caching import bump_version, PRODUCTS
+from .carts import get_cart_store, purge_expired_carts
+from .images import generate_variants
+from .models import ProductImage
+from . import idempotency, membership, outbox, reservations
+
+logger = logging.getLogger(__name__)
+
+@shared_task
+def process_product_image(image_id):
+    try:
+        product_image = ProductImage.objects.get(pk=image_id)
+    except ProductImage.DoesNotExist:
+        return
+    if not product_image.image:
+        return
+
+    variants = generate_variants(product_image.image)
+    # update() rather than save(), so the post_save handler doesn't queue us again
+    ProductImage.objects.filter(pk=image_id, image=product_image.image.name).update(variants=variants)
+    bump_version(PRODUCTS)
+
+
+# Run by celery beat, a no-op unless carts are kept in Redis
+@shared_task
+def flush_idle_carts():
+    return get_cart_store().flush_idle()
+
+
+# Bounded by STORE_CART_PURGE['MAX_RUNTIME'], the next run picks up the rest
+@shared_task
+def purge_carts():
+    result = purge_expired_carts()
+    logger.info('Purged %d carts and %d items (%.0f rows/s)',
+                result.carts, result.items, result.rows_per_second)
+    return result.as_dict()
+
+
+# Frees the stock of reservations whose TTL ran out
+@shared_task
+def release_expired_reservations():
+    return reservations.release_expired()
+
+
+# Delivers order_created and other outbox events to their receivers
+@shared_task
+def relay_outbox():
+    delivered = outbox.relay()
+    outbox.purge_processed()
+    return delivered
+
+
+@shared_task
+def purge_idempotency_keys():
+    return idempotency.get_backend().purge_expired()
+
+
+# Membership tiers of the customers whose completed orders changed or
+# left the spend window since the last run
+@shared_task
+def update_membership_tiers():
+    checked, changed = membership.update_stale_tiers()
+    logger.info('Checked the tiers of %d customers, %d changed', checked, changed)
+    return changed
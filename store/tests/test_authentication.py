@@ -0,0 +1,66 @@
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from rest_framework.test import APIClient
+from rest_framework import status
+from store.models import Cart, CartItem, Product
+import pytest
+
+
+@pytest.fixture
+def cached(settings):
+    cache.clear()
+    settings.STORE_AUTH = {'CACHE_TIMEOUT': 60}
+
+
+@pytest.fixture
+def user():
+    return User.objects.create_user('buyer', password='secret-pass')
+
+
+def login(user, password='secret-pass'):
+    client = APIClient()
+    tokens = client.post('/auth/jwt/create/', {'username': user.username, 'password': password}).data
+    client.credentials(HTTP_AUTHORIZATION=f"JWT {tokens['access']}")
+    return client, tokens
+
+
+@pytest.mark.django_db
+class TestJWTAuthentication:
+    def test_tokens_carry_the_customer_id(self, user):
+        client, tokens = login(user)
+        refreshed = APIClient().post('/auth/jwt/refresh/', {'refresh': tokens['refresh']}).data
+        client.credentials(HTTP_AUTHORIZATION=f"JWT {refreshed['access']}")
+
+        response = client.get('/store/customers/me/')
+
+        assert response.data['id'] == user.customer.id
+
+    def test_cached_user_needs_no_queries(self, cached, user, django_assert_num_queries):
+        client, _ = login(user)
+        client.get('/store/customers/me/')
+
+        # Only the customer row the view returns
+        with django_assert_num_queries(1):
+            response = client.get('/store/customers/me/')
+
+        assert response.status_code == status.HTTP_200_OK
+
+    def test_saving_the_user_drops_the_cached_copy(self, cached, user):
+        client, _ = login(user)
+        client.get('/store/customers/me/')
+
+        user.is_active = False
+        user.save()
+
+        assert client.get('/store/customers/me/').status_code == status.HTTP_401_UNAUTHORIZED
+
+    def test_checkout_takes_the_customer_from_the_token(self, user):
+        Product.objects.create(id=1, title='a', slug='a', unit_price=10, inventory=5)
+        cart = Cart.objects.create()
+        CartItem.objects.create(cart=cart, product_id=1, quantity=1)
+        client, _ = login(user)
+
+        response = client.post('/store/orders/', {'cart_id': str(cart.id)})
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['customer'] == user.customer.id
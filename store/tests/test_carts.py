@@ -0,0 +1,366 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from decimal import Decimal
+from io import StringIO
+from uuid import UUID
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from rest_framework.test import APIClient
+from rest_framework import status
+from store.carts import get_cart_store, purge_expired_carts
+from store.models import Cart, CartItem, Order, Product
+import pytest
+
+
+@pytest.fixture
+def cart():
+    Product.objects.bulk_create([
+        Product(id=i, title=f'p{i}', slug='-', unit_price=10, inventory=100)
+        for i in range(1, 6)
+    ])
+    return Cart.objects.create()
+
+
+@pytest.fixture
+def key_value_store(settings):
+    settings.STORE_CART_BACKEND = {
+        'BACKEND': 'store.carts.KeyValueCartStore',
+        'OPTIONS': {'location': 'memory://'},
+    }
+    return get_cart_store()
+
+
+def checkout(cart_id):
+    client = APIClient()
+    client.force_authenticate(user=User.objects.create_user('buyer'))
+    return client.post('/store/orders/', {'cart_id': str(cart_id)})
+
+
+@pytest.mark.django_db
+class TestAddCartItem:
+    def test_adding_existing_product_increments_quantity(self, cart):
+        client = APIClient()
+        client.post(f'/store/carts/{cart.id}/items/', {'product_id': 1, 'quantity': 2})
+
+        response = client.post(f'/store/carts/{cart.id}/items/', {'product_id': 1, 'quantity': 3})
+
+        assert response.status_code == status.HTTP_201_CREATED
+        assert response.data['quantity'] == 5
+        assert CartItem.objects.get().quantity == 5
+
+    @pytest.mark.parametrize('backend', ['orm', 'key_value'])
+    def test_repeated_adds_stop_at_the_maximum_quantity(self, cart, settings, backend):
+        client = APIClient()
+        cart_id = cart.id
+        if backend == 'key_value':
+            settings.STORE_CART_BACKEND = {
+                'BACKEND': 'store.carts.KeyValueCartStore',
+                'OPTIONS': {'location': 'memory://'},
+            }
+            cart_id = client.post('/store/carts/').data['id']
+        client.post(f'/store/carts/{cart_id}/items/', {'product_id': 1, 'quantity': 30000})
+
+        response = client.post(f'/store/carts/{cart_id}/items/', {'product_id': 1, 'quantity': 30000})
+
+        assert response.status_code == status.HTTP_201_CREATED
+        assert response.data['quantity'] == 32767
+        assert client.get(f'/store/carts/{cart_id}/items/{response.data["id"]}/').data['quantity'] == 32767
+
+    def test_unknown_product_returns_400(self, cart):
+        response = APIClient().post(f'/store/carts/{cart.id}/items/', {'product_id': 99, 'quantity': 1})
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    def test_bulk_add_merges_lines_in_one_write(self, cart, django_assert_num_queries):
+        CartItem.objects.create(cart=cart, product_id=1, quantity=1)
+        items = [
+            {'product_id': 1, 'quantity': 1},
+            {'product_id': 2, 'quantity': 2},
+            {'product_id': 2, 'quantity': 2},
+            {'product_id': 3, 'quantity': 1},
+        ]
+
+        # products check + upsert
+        with django_assert_num_queries(2):
+            response = APIClient().post(f'/store/carts/{cart.id}/items/bulk/', {'items': items}, format='json')
+
+        assert response.status_code == status.HTTP_201_CREATED
+        assert dict(CartItem.objects.values_list('product_id', 'quantity')) == {1: 2, 2: 4, 3: 1}
+
+    def test_bulk_add_rejects_unknown_products(self, cart):
+        items = [{'product_id': 1, 'quantity': 1}, {'product_id': 99, 'quantity': 1}]
+
+        response = APIClient().post(f'/store/carts/{cart.id}/items/bulk/', {'items': items}, format='json')
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert not CartItem.objects.exists()
+
+
+@pytest.mark.django_db
+class TestRetrieveCart:
+    @pytest.mark.parametrize('lines', [1, 5])
+    def test_totals_come_from_the_database(self, cart, lines, django_assert_num_queries):
+        Product.objects.filter(pk=1).update(unit_price='19.99')
+        CartItem.objects.bulk_create([
+            CartItem(cart=cart, product_id=i, quantity=3) for i in range(1, lines + 1)
+        ])
+
+        # cart with its total + lines with their products
+        with django_assert_num_queries(2):
+            response = APIClient().get(f'/store/carts/{cart.id}/')
+
+        assert str(response.data['items'][0]['total_price']) == '59.97'
+        assert str(response.data['total_price']) == str(Decimal('59.97') + 30 * (lines - 1))
+
+    def test_empty_cart_total_is_zero(self, cart):
+        response = APIClient().get(f'/store/carts/{cart.id}/')
+
+        assert response.data['total_price'] == 0
+
+
+@pytest.mark.django_db
+class TestKeyValueCartStore:
+    def test_live_carts_stay_out_of_the_database(self, cart, key_value_store):
+        client = APIClient()
+        cart_id = client.post('/store/carts/').data['id']
+        client.post(f'/store/carts/{cart_id}/items/', {'product_id': 1, 'quantity': 2})
+        client.post(f'/store/carts/{cart_id}/items/bulk/',
+                    {'items': [{'product_id': 1, 'quantity': 1}, {'product_id': 2, 'quantity': 1}]}, format='json')
+
+        response = client.get(f'/store/carts/{cart_id}/')
+
+        assert [(item['id'], item['quantity']) for item in response.data['items']] == [(1, 3), (2, 1)]
+        assert response.data['total_price'] == 40
+        assert not Cart.objects.filter(pk=cart_id).exists()
+        assert not CartItem.objects.exists()
+
+    def test_lines_are_updated_and_removed_by_product(self, cart, key_value_store):
+        client = APIClient()
+        cart_id = client.post('/store/carts/').data['id']
+        client.post(f'/store/carts/{cart_id}/items/', {'product_id': 1, 'quantity': 2})
+
+        client.patch(f'/store/carts/{cart_id}/items/1/', {'quantity': 7})
+        assert client.get(f'/store/carts/{cart_id}/items/1/').data['quantity'] == 7
+
+        client.delete(f'/store/carts/{cart_id}/items/1/')
+        assert client.get(f'/store/carts/{cart_id}/items/').data == []
+
+    def test_unknown_cart_returns_404(self, cart, key_value_store):
+        response = APIClient().post(f'/store/carts/{cart.id}0/items/', {'product_id': 1, 'quantity': 1})
+
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+    def test_idle_carts_are_flushed_and_restored_on_write(self, cart, key_value_store):
+        client = APIClient()
+        cart_id = client.post('/store/carts/').data['id']
+        client.post(f'/store/carts/{cart_id}/items/', {'product_id': 3, 'quantity': 2})
+
+        assert key_value_store.flush_idle(idle_timeout=0) == 1
+        assert dict(CartItem.objects.filter(cart_id=cart_id).values_list('product_id', 'quantity')) == {3: 2}
+        assert client.get(f'/store/carts/{cart_id}/items/3/').data['quantity'] == 2
+
+        client.post(f'/store/carts/{cart_id}/items/', {'product_id': 3, 'quantity': 1})
+
+        assert not Cart.objects.filter(pk=cart_id).exists()
+        assert client.get(f'/store/carts/{cart_id}/').data['items'][0]['quantity'] == 3
+
+    def test_a_write_during_the_flush_keeps_the_cart_live(self, cart, key_value_store, monkeypatch):
+        client = APIClient()
+        cart_id = client.post('/store/carts/').data['id']
+        client.post(f'/store/carts/{cart_id}/items/', {'product_id': 3, 'quantity': 2})
+        read = key_value_store.read
+
+        def read_then_write(cart_id):
+            result = read(cart_id)
+            monkeypatch.undo()
+            client.post(f'/store/carts/{cart_id}/items/', {'product_id': 3, 'quantity': 1})
+            return result
+        monkeypatch.setattr(key_value_store, 'read', read_then_write)
+
+        assert key_value_store.flush_idle(idle_timeout=0) == 0
+        assert not Cart.objects.filter(pk=cart_id).exists()
+
+        assert key_value_store.flush_idle(idle_timeout=0) == 1
+        assert dict(CartItem.objects.filter(cart_id=cart_id).values_list('product_id', 'quantity')) == {3: 3}
+
+
+@pytest.mark.django_db
+class TestCheckout:
+    def test_checkout_reads_the_cart_tables(self, cart):
+        CartItem.objects.create(cart=cart, product_id=1, quantity=2)
+
+        response = checkout(cart.id)
+
+        assert response.status_code == status.HTTP_200_OK
+        assert list(Order.objects.get().items.values_list('product_id', 'quantity')) == [(1, 2)]
+        assert not Cart.objects.exists()
+
+    def test_checkout_of_20_lines_runs_a_fixed_number_of_queries(self, cart, django_assert_num_queries):
+        Product.objects.bulk_create([
+            Product(id=i, title=f'p{i}', slug='-', unit_price=10, inventory=100) for i in range(6, 21)
+        ])
+        CartItem.objects.bulk_create([CartItem(cart=cart, product_id=i, quantity=2) for i in range(1, 21)])
+        user = User.objects.create_user('buyer')
+        client = APIClient()
+        client.force_authenticate(user=user)
+
+        # customer id, locked lines with their products, stock decrement,
+        # order, items, the cart lookup and the cart items and cart deletes,
+        # outbox event, and the test's savepoint pair
+        with django_assert_num_queries(11):
+            response = client.post('/store/orders/', {'cart_id': str(cart.id)})
+
+        assert len(response.data['items']) == 20
+        assert response.data['items'][0]['product'] == {'id': 1, 'title': 'p1', 'unit_price': 10}
+        assert response.data['items'][0]['id'] is not None
+        assert Order.objects.get().items.count() == 20
+        assert set(Product.objects.values_list('inventory', flat=True)) == {98}
+
+    def test_short_product_fails_the_whole_order(self, cart):
+        Product.objects.filter(pk=2).update(inventory=1)
+        CartItem.objects.bulk_create([
+            CartItem(cart=cart, product_id=1, quantity=5),
+            CartItem(cart=cart, product_id=2, quantity=3),
+        ])
+
+        response = checkout(cart.id)
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert response.data == {'items': {'2': ['Only 1 left in stock']}}
+        assert dict(Product.objects.filter(pk__in=[1, 2]).values_list('pk', 'inventory')) == {1: 100, 2: 1}
+        assert not Order.objects.exists()
+        assert CartItem.objects.filter(cart=cart).count() == 2
+
+    def test_empty_cart_is_rejected(self, cart):
+        response = checkout(cart.id)
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert not Order.objects.exists()
+
+    @pytest.mark.parametrize('flushed', [False, True])
+    def test_checkout_reads_the_key_value_store(self, cart, key_value_store, flushed):
+        client = APIClient()
+        cart_id = client.post('/store/carts/').data['id']
+        client.post(f'/store/carts/{cart_id}/items/', {'product_id': 2, 'quantity': 4})
+        if flushed:
+            key_value_store.flush_idle(idle_timeout=0)
+
+        response = checkout(cart_id)
+
+        assert response.status_code == status.HTTP_200_OK
+        assert list(Order.objects.get().items.values_list('product_id', 'quantity')) == [(2, 4)]
+        assert client.get(f'/store/carts/{cart_id}/').status_code == status.HTTP_404_NOT_FOUND
+
+    def test_a_cart_is_checked_out_once(self, cart, key_value_store):
+        client = APIClient()
+        cart_id = client.post('/store/carts/').data['id']
+        client.post(f'/store/carts/{cart_id}/items/', {'product_id': 2, 'quantity': 2})
+        # Another checkout of the cart in progress
+        assert len(key_value_store.get_checkout_lines(UUID(cart_id))) == 1
+
+        response = checkout(cart_id)
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert response.data == {'cart_id': ['No cart with the given id found']}
+        assert not Order.objects.exists()
+        assert Product.objects.get(pk=2).inventory == 100
+
+    def test_a_failed_checkout_gives_the_cart_back(self, cart, key_value_store):
+        client = APIClient()
+        cart_id = client.post('/store/carts/').data['id']
+        client.post(f'/store/carts/{cart_id}/items/', {'product_id': 2, 'quantity': 4})
+        Product.objects.filter(pk=2).update(inventory=3)
+
+        response = checkout(cart_id)
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert client.get(f'/store/carts/{cart_id}/items/2/').data['quantity'] == 4
+        assert client.post(f'/store/carts/{cart_id}/items/', {'product_id': 2, 'quantity': 1}).data['quantity'] == 5
+
+
+@pytest.mark.django_db
+class TestPurgeCarts:
+    def make_carts(self, count, age_days):
+        carts = Cart.objects.bulk_create([Cart() for _ in range(count)])
+        Cart.objects.filter(pk__in=[cart.pk for cart in carts]) \
+            .update(created_at=date.today() - timedelta(days=age_days))
+        CartItem.objects.bulk_create([CartItem(cart=cart, product_id=1, quantity=1) for cart in carts])
+        return carts
+
+    def test_expired_carts_are_deleted_in_batches(self, cart, django_assert_num_queries):
+        self.make_carts(5, age_days=31)
+        kept = self.make_carts(2, age_days=29)
+
+        # Per batch: select ids, then the collector's cart lookup, items
+        # delete and carts delete
+        with django_assert_num_queries(3 * 4):
+            result = purge_expired_carts(max_age_days=30, batch_size=2, pause=0)
+
+        assert (result.carts, result.items, result.batches, result.finished) == (5, 5, 3, True)
+        assert set(Cart.objects.values_list('pk', flat=True)) == {cart.pk} | {c.pk for c in kept}
+        assert CartItem.objects.count() == 2
+
+    def test_runtime_cap_stops_early(self, cart):
+        self.make_carts(5, age_days=31)
+
+        result = purge_expired_carts(max_age_days=30, batch_size=2, pause=0, max_runtime=0)
+
+        assert (result.carts, result.finished) == (2, False)
+
+    def test_command_reports_rate(self, cart):
+        self.make_carts(3, age_days=60)
+        out = StringIO()
+
+        call_command('purge_carts', max_age_days=30, pause=0, stdout=out)
+
+        assert out.getvalue().startswith('3 carts and 3 items purged in 1 batches')
+        assert 'rows/s' in out.getvalue()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_concurrent_adds_are_not_lost(cart):
+    if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+        pytest.skip('shared-cache in-memory SQLite fails concurrent writers instead of waiting')
+
+    def add(_):
+        try:
+            return APIClient().post(f'/store/carts/{cart.id}/items/', {'product_id': 1, 'quantity': 1}).status_code
+        finally:
+            connection.close()
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        statuses = list(pool.map(add, range(40)))
+
+    assert statuses == [status.HTTP_201_CREATED] * 40
+    assert CartItem.objects.get(cart=cart, product_id=1).quantity == 40
+
+
+@pytest.mark.django_db(transaction=True)
+def test_concurrent_checkouts_never_oversell(cart):
+    if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+        pytest.skip('shared-cache in-memory SQLite fails concurrent writers instead of waiting')
+    if connection.vendor == 'sqlite' and connection.settings_dict['OPTIONS'].get('transaction_mode') != 'IMMEDIATE':
+        pytest.skip("deferred SQLite transactions can't wait to upgrade their lock")
+    Product.objects.filter(pk__in=[1, 2]).update(inventory=7)
+    carts = Cart.objects.bulk_create([Cart() for _ in range(12)])
+    CartItem.objects.bulk_create([
+        CartItem(cart=cart, product_id=product_id, quantity=1) for cart in carts for product_id in (2, 1)
+    ])
+    users = [User.objects.create_user(f'buyer{i}') for i in range(len(carts))]
+
+    def place(args):
+        user, cart = args
+        try:
+            client = APIClient()
+            client.force_authenticate(user=user)
+            return client.post('/store/orders/', {'cart_id': str(cart.id)}).status_code
+        finally:
+            connection.close()
+
+    with ThreadPoolExecutor(max_workers=6) as pool:
+        statuses = list(pool.map(place, zip(users, carts)))
+
+    assert sorted(statuses) == [status.HTTP_200_OK] * 7 + [status.HTTP_400_BAD_REQUEST] * 5
+    assert dict(Product.objects.filter(pk__in=[1, 2]).values_list('pk', 'inventory')) == {1: 0, 2: 0}
+    assert Order.objects.count() == 7
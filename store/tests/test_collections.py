@@ -1,4 +1,7 @@
+from datetime import date
 from django.contrib.auth.models import User
+from django.core.cache import cache
+from store.models import Collection, Product
 from rest_framework.test import APIClient
 from rest_framework import status
 import pytest
@@ -41,3 +44,78 @@ class TestCreateCollection:
         assert response.data['id'] > 0
 
 
+@pytest.mark.django_db
+class TestCollectionProductsCount:
+    def test_count_follows_product_create_move_and_delete(self):
+        first = Collection.objects.create(id=1, title='a')
+        second = Collection.objects.create(id=2, title='b')
+        product = Product.objects.create(id=1, title='a', slug='a', unit_price=10, inventory=10, collection=first)
+        Product.objects.create(id=2, title='b', slug='b', unit_price=10, inventory=10, collection=first)
+
+        product.collection = second
+        product.save()
+        assert counts() == {1: 1, 2: 1}
+
+        product.delete()
+        assert counts() == {1: 1, 2: 0}
+
+    def test_saves_dont_look_up_the_previous_collection(self, django_assert_num_queries):
+        Collection.objects.bulk_create([Collection(id=1, title='a'), Collection(id=2, title='b')])
+        # Insert and count
+        with django_assert_num_queries(2):
+            Product.objects.create(id=1, title='a', slug='a', unit_price=10, inventory=10, collection_id=1)
+        product = Product.objects.get()
+
+        product.collection_id = 2
+        # Update, and the two counts
+        with django_assert_num_queries(3):
+            product.save()
+
+        assert counts() == {1: 0, 2: 1}
+
+    def test_new_instance_saved_over_a_product_keeps_counts(self):
+        Collection.objects.bulk_create([Collection(id=1, title='a'), Collection(id=2, title='b')])
+        Product.objects.create(id=1, title='a', slug='a', unit_price=10, inventory=10, collection_id=1)
+
+        Product(id=1, title='a', slug='a', unit_price=10, inventory=10, collection_id=2,
+                last_update=date.today()).save()
+
+        assert counts() == {1: 0, 2: 1}
+
+    def test_refresh_recomputes_counts(self):
+        collection = Collection.objects.create(id=1, title='a')
+        Product.objects.bulk_create([
+            Product(id=i, title='a', slug='a', unit_price=10, inventory=10, collection=collection)
+            for i in range(1, 4)
+        ])
+
+        Collection.objects.refresh_products_count()
+
+        assert counts() == {1: 3}
+
+    def test_list_reads_count_without_aggregating(self, django_assert_num_queries):
+        collection = Collection.objects.create(id=1, title='a')
+        Product.objects.create(id=1, title='a', slug='a', unit_price=10, inventory=10, collection=collection)
+
+        with django_assert_num_queries(1):
+            response = APIClient().get('/store/collections/')
+
+        assert response.data[0]['products_count'] == 1
+
+
+@pytest.mark.django_db
+class TestFilterProductsByCollection:
+    def test_returns_only_products_of_collection(self):
+        cache.clear()
+        first = Collection.objects.create(id=1, title='a')
+        second = Collection.objects.create(id=2, title='b')
+        Product.objects.create(id=1, title='a', slug='a', unit_price=10, inventory=10, collection=first)
+        Product.objects.create(id=2, title='b', slug='b', unit_price=10, inventory=10, collection=second)
+
+        response = APIClient().get('/store/products/', {'collection_id': 2})
+
+        assert [product['id'] for product in response.data['results']] == [2]
+
+
+def counts():
+    return dict(Collection.objects.values_list('id', 'products_count'))
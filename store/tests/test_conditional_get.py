@@ -0,0 +1,122 @@
+from django.core.cache import cache
+from rest_framework.test import APIClient
+from rest_framework import status
+from store.caching import check_version_cache
+from store.models import Cart, Collection, Product
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    cache.clear()
+
+
+@pytest.fixture
+def product():
+    return Product.objects.create(id=1, title='a', slug='a', unit_price=10, inventory=10)
+
+
+@pytest.mark.django_db
+class TestConditionalGet:
+    def test_matching_etag_returns_304_without_queries(self, product, django_assert_num_queries):
+        client = APIClient()
+        etag = client.get('/store/products/')['ETag']
+
+        with django_assert_num_queries(0):
+            response = client.get('/store/products/', HTTP_IF_NONE_MATCH=etag)
+
+        assert response.status_code == status.HTTP_304_NOT_MODIFIED
+        assert response['ETag'] == etag
+
+    def test_product_write_changes_etag(self, product):
+        client = APIClient()
+        etag = client.get('/store/products/1/')['ETag']
+
+        product.unit_price = 20
+        product.save()
+        response = client.get('/store/products/1/', HTTP_IF_NONE_MATCH=etag)
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response['ETag'] != etag
+
+    def test_stock_changes_keep_the_product_validators(self, product, django_assert_num_queries):
+        client = APIClient()
+        first = client.get('/store/products/1/')
+        stock_etag = client.get('/store/products/stock/', {'id': 1})['ETag']
+
+        Product.objects.reserve_inventory({1: 4})
+        with django_assert_num_queries(0):
+            response = client.get('/store/products/1/', HTTP_IF_NONE_MATCH=first['ETag'])
+        stock = client.get('/store/products/stock/', {'id': 1}, HTTP_IF_NONE_MATCH=stock_etag)
+
+        assert response.status_code == status.HTTP_304_NOT_MODIFIED
+        assert response['Last-Modified'] == first['Last-Modified']
+        assert stock.status_code == status.HTTP_200_OK
+        assert stock.data == [{'id': 1, 'available_inventory': 6}]
+
+    def test_stock_needs_product_ids(self):
+        response = APIClient().get('/store/products/stock/', {'id': 'a'})
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    def test_etag_depends_on_query(self, product):
+        client = APIClient()
+
+        first = client.get('/store/products/', {'ordering': 'unit_price'})
+        second = client.get('/store/products/', {'ordering': '-unit_price'})
+
+        assert first['ETag'] != second['ETag']
+
+    def test_if_modified_since_returns_304(self, product):
+        client = APIClient()
+        last_modified = client.get('/store/collections/')['Last-Modified']
+
+        response = client.get('/store/collections/', HTTP_IF_MODIFIED_SINCE=last_modified)
+
+        assert response.status_code == status.HTTP_304_NOT_MODIFIED
+
+    def test_collection_count_change_changes_etag(self, product):
+        Collection.objects.create(id=1, title='a')
+        client = APIClient()
+        etag = client.get('/store/collections/')['ETag']
+
+        product.collection_id = 1
+        product.save()
+        response = client.get('/store/collections/', HTTP_IF_NONE_MATCH=etag)
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data[0]['products_count'] == 1
+
+    def test_adding_cart_item_changes_cart_etag(self, product):
+        cart = Cart.objects.create()
+        client = APIClient()
+        etag = client.get(f'/store/carts/{cart.id}/')['ETag']
+
+        client.post(f'/store/carts/{cart.id}/items/', {'product_id': 1, 'quantity': 1})
+        response = client.get(f'/store/carts/{cart.id}/', HTTP_IF_NONE_MATCH=etag)
+
+        assert response.status_code == status.HTTP_200_OK
+        assert len(response.data['items']) == 1
+
+    def test_deleted_cart_is_not_reported_unmodified(self):
+        cart = Cart.objects.create()
+        client = APIClient()
+        etag = client.get(f'/store/carts/{cart.id}/')['ETag']
+
+        cart.delete()
+        response = client.get(f'/store/carts/{cart.id}/', HTTP_IF_NONE_MATCH=etag)
+
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+class TestVersionCacheCheck:
+    def test_warns_about_a_per_process_cache(self, settings):
+        settings.CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+        assert [warning.id for warning in check_version_cache(None)] == ['store.W001']
+
+    def test_accepts_a_shared_cache(self, settings):
+        settings.CACHES = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+                                       'LOCATION': 'redis://localhost:6379/3'}}
+
+        assert check_version_cache(None) == []
@@ -0,0 +1,68 @@
+from django.contrib.auth.models import User
+from rest_framework.test import APIClient
+from store.models import Customer
+import pytest
+
+
+def create_users(count):
+    # Through the ORM, so the signals create the customers
+    return [User.objects.create_user(f'u{i:03}', first_name=f'First{i % 7}', last_name=f'Last{i:03}')
+            for i in range(count)]
+
+
+@pytest.mark.django_db
+class TestCustomerNames:
+    def test_new_customers_copy_the_user_names(self):
+        [user] = create_users(1)
+
+        assert (user.customer.first_name, user.customer.last_name) == ('First0', 'Last000')
+        assert str(Customer.objects.get()) == 'First0 Last000'
+
+    def test_renaming_the_user_renames_the_customer(self):
+        [user] = create_users(1)
+
+        user.last_name = 'Renamed'
+        user.save()
+
+        assert Customer.objects.get().last_name == 'Renamed'
+
+    def test_saves_that_skip_the_names_leave_the_customer_alone(self, django_assert_num_queries):
+        [user] = create_users(1)
+
+        with django_assert_num_queries(1):
+            user.save(update_fields=['last_login'])
+
+
+@pytest.mark.django_db
+class TestListCustomers:
+    @pytest.mark.parametrize('count', [10, 100])
+    def test_queries_are_constant(self, count, django_assert_num_queries):
+        create_users(count)
+        client = APIClient()
+        names = []
+        url = '/store/customers/'
+
+        while url:
+            # One query per page, read off the name index
+            with django_assert_num_queries(1):
+                response = client.get(url)
+            names += [(row['first_name'], row['last_name']) for row in response.data['results']]
+            url = response.data['next']
+
+        assert len(names) == count
+        assert names == sorted(names)
+
+
+@pytest.mark.django_db
+class TestCustomerAdmin:
+    def test_changelist_reads_the_counters(self, client, django_assert_max_num_queries):
+        create_users(30)
+        Customer.objects.filter(user__username='u001').update(order_count=4)
+        client.force_login(User.objects.create_superuser('admin'))
+
+        # Session, user, the two counts and the page; no aggregate over the orders
+        with django_assert_max_num_queries(5):
+            response = client.get('/admin/store/customer/')
+
+        assert response.status_code == 200
+        assert b'?customer__id=' in response.content and b'>4</a>' in response.content
@@ -0,0 +1,64 @@
+from django.core.cache import cache
+from rest_framework.test import APIClient
+from rest_framework import status
+from store.models import Collection, Product
+import pytest
+
+
+@pytest.fixture
+def products():
+    cache.clear()
+    Collection.objects.create(id=1, title='a')
+    Collection.objects.create(id=2, title='b')
+    return Product.objects.bulk_create([
+        Product(id=1, title='a', slug='-', unit_price='5.00', inventory=50, collection_id=1),
+        Product(id=2, title='b', slug='-', unit_price='9.99', inventory=3, collection_id=1),
+        Product(id=3, title='c', slug='-', unit_price='25.00', inventory=0, collection_id=2),
+        Product(id=4, title='d', slug='-', unit_price='31.00', inventory=20),
+    ])
+
+
+@pytest.mark.django_db
+class TestProductFacets:
+    def test_returns_histogram_inventory_and_collections_in_one_query(self, products, django_assert_num_queries):
+        with django_assert_num_queries(1):
+            response = APIClient().get('/store/products/facets/')
+
+        assert response.data['count'] == 4
+        assert [(bucket['min'], bucket['count']) for bucket in response.data['price']['buckets']] == [
+            (0, 2), (20, 1), (30, 1)]
+        assert response.data['inventory'] == {'in_stock': 2, 'low_stock': 1, 'out_of_stock': 1}
+        assert response.data['collections'] == [
+            {'collection_id': None, 'count': 1},
+            {'collection_id': 1, 'count': 2},
+            {'collection_id': 2, 'count': 1},
+        ]
+
+    def test_respects_listing_filters_and_bucket_width(self, products):
+        response = APIClient().get('/store/products/facets/', {'collection_id': 1, 'bucket_width': 5})
+
+        assert [(bucket['min'], bucket['count']) for bucket in response.data['price']['buckets']] == [
+            (5, 2)]
+
+    def test_repeated_request_is_served_from_cache(self, products, django_assert_num_queries):
+        client = APIClient()
+        client.get('/store/products/facets/', {'unit_price__gt': 6})
+
+        with django_assert_num_queries(0):
+            response = client.get('/store/products/facets/', {'unit_price__gt': 6})
+
+        assert response.data['count'] == 3
+
+    def test_invalid_bucket_width_returns_400(self, products):
+        response = APIClient().get('/store/products/facets/', {'bucket_width': '0'})
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    def test_stock_levels_follow_inventory_decrements(self, products):
+        client = APIClient()
+        client.get('/store/products/facets/')
+
+        Product.objects.decrement_inventory({2: 3})
+        response = client.get('/store/products/facets/')
+
+        assert response.data['inventory'] == {'in_stock': 2, 'low_stock': 0, 'out_of_stock': 2}
@@ -0,0 +1,84 @@
+from concurrent.futures import ThreadPoolExecutor
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from rest_framework.test import APIClient
+from rest_framework import status
+from store.models import Cart, CartItem, Order, Product
+import pytest
+
+
+@pytest.fixture(params=['store.idempotency.DatabaseBackend', 'store.idempotency.CacheBackend'])
+def backend(request, settings):
+    cache.clear()
+    settings.STORE_IDEMPOTENCY = {'BACKEND': request.param, 'WAIT_TIMEOUT': 10}
+
+
+@pytest.fixture
+def cart():
+    Product.objects.create(id=1, title='a', slug='a', unit_price=10, inventory=100)
+    return Cart.objects.create()
+
+
+def add_item(cart, key, quantity=1):
+    return APIClient().post(f'/store/carts/{cart.id}/items/', {'product_id': 1, 'quantity': quantity},
+                            HTTP_IDEMPOTENCY_KEY=key)
+
+
+@pytest.mark.django_db
+class TestIdempotency:
+    def test_retry_replays_the_first_response(self, backend, cart):
+        first = add_item(cart, 'abc')
+
+        retry = add_item(cart, 'abc')
+
+        assert retry.status_code == first.status_code == status.HTTP_201_CREATED
+        assert retry.data == first.data
+        assert retry['Idempotent-Replayed'] == 'true'
+        assert CartItem.objects.get().quantity == 1
+
+    def test_other_keys_and_no_key_run_again(self, backend, cart):
+        add_item(cart, 'abc')
+        add_item(cart, 'def')
+        add_item(cart, '')
+
+        assert CartItem.objects.get().quantity == 3
+
+    def test_key_reused_for_another_body_returns_422(self, backend, cart):
+        add_item(cart, 'abc')
+
+        response = add_item(cart, 'abc', quantity=2)
+
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+    def test_order_is_placed_once(self, backend, cart):
+        CartItem.objects.create(cart=cart, product_id=1, quantity=1)
+        client = APIClient()
+        client.force_authenticate(user=User.objects.create_user('buyer'))
+
+        responses = [client.post('/store/orders/', {'cart_id': str(cart.id)}, HTTP_IDEMPOTENCY_KEY='k')
+                     for _ in range(2)]
+
+        assert [response.status_code for response in responses] == [status.HTTP_200_OK] * 2
+        assert responses[0].data == responses[1].data
+        assert Order.objects.count() == 1
+
+
+@pytest.mark.django_db(transaction=True)
+def test_concurrent_duplicates_wait_for_the_first(settings, cart):
+    if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+        pytest.skip('shared-cache in-memory SQLite fails concurrent writers instead of waiting')
+    settings.STORE_IDEMPOTENCY = {'BACKEND': 'store.idempotency.DatabaseBackend', 'WAIT_TIMEOUT': 30}
+
+    def add(_):
+        try:
+            response = add_item(cart, 'same')
+            return response.status_code, response.data['quantity']
+        finally:
+            connection.close()
+
+    with ThreadPoolExecutor(max_workers=6) as pool:
+        results = list(pool.map(add, range(12)))
+
+    assert results == [(status.HTTP_201_CREATED, 1)] * 12
+    assert CartItem.objects.get().quantity == 1
@@ -0,0 +1,65 @@
+from io import BytesIO
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.contrib.auth.models import User
+from PIL import Image
+from rest_framework.test import APIClient
+from rest_framework import status
+from storefront.celery import celery
+from store.models import Product, ProductImage
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def eager_celery(settings, tmp_path):
+    settings.MEDIA_ROOT = str(tmp_path)
+    cache.clear()
+    celery.conf.task_always_eager = True
+    yield
+    celery.conf.task_always_eager = False
+
+
+def upload(width=800, height=400):
+    buffer = BytesIO()
+    Image.new('RGB', (width, height), 'red').save(buffer, 'JPEG')
+    return SimpleUploadedFile('photo.jpg', buffer.getvalue(), content_type='image/jpeg')
+
+
+@pytest.mark.django_db
+class TestProductImageVariants:
+    def test_upload_generates_variants_after_commit(self, tmp_path, django_capture_on_commit_callbacks):
+        Product.objects.create(id=1, title='a', slug='a', unit_price=10, inventory=10)
+        client = APIClient()
+        client.force_authenticate(user=User(is_staff=True))
+
+        with django_capture_on_commit_callbacks(execute=True):
+            response = client.post('/store/products/1/images/', {'image': upload()}, format='multipart')
+
+        assert response.status_code == status.HTTP_201_CREATED
+        variants = ProductImage.objects.get().variants
+        assert (variants['thumbnail']['width'], variants['thumbnail']['height']) == (150, 75)
+        assert (variants['large']['width'], variants['large']['height']) == (800, 400)
+        for variant in variants.values():
+            assert (tmp_path / variant['webp']).exists()
+            assert (tmp_path / variant['jpeg']).exists()
+
+    def test_product_payload_exposes_variant_urls(self, django_capture_on_commit_callbacks):
+        product = Product.objects.create(id=1, title='a', slug='a', unit_price=10, inventory=10)
+        with django_capture_on_commit_callbacks(execute=True):
+            ProductImage.objects.create(product=product, image=upload())
+
+        response = APIClient().get('/store/products/1/')
+
+        thumbnail = response.data['images'][0]['variants']['thumbnail']
+        assert thumbnail['webp'].startswith('/media/store/images/variants/')
+        assert thumbnail['webp'].endswith('-thumbnail.webp')
+
+    def test_identical_uploads_share_variant_files(self, django_capture_on_commit_callbacks):
+        product = Product.objects.create(id=1, title='a', slug='a', unit_price=10, inventory=10)
+        with django_capture_on_commit_callbacks(execute=True):
+            first = ProductImage.objects.create(product=product, image=upload())
+            second = ProductImage.objects.create(product=product, image=upload())
+
+        first.refresh_from_db()
+        second.refresh_from_db()
+        assert first.variants == second.variants
@@ -0,0 +1,106 @@
+import json
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from rest_framework.test import APIClient
+from rest_framework import status
+from store.importers import import_users
+from store.models import Collection, Customer, Product, Promotion
+import pytest
+
+
+def ndjson(*rows):
+    return '\n'.join(json.dumps(row) for row in rows)
+
+
+def post_import(body, content_type, user=None):
+    client = APIClient()
+    client.force_authenticate(user=user or User(is_staff=True))
+    return client.post('/store/products/import/', body, content_type=content_type)
+
+
+@pytest.mark.django_db
+class TestImportProducts:
+    def test_if_user_is_not_admin_returns_403(self):
+        response = post_import(ndjson({'id': 1}), 'application/x-ndjson', user=User())
+
+        assert response.status_code == status.HTTP_403_FORBIDDEN
+
+    def test_ndjson_rows_are_upserted(self):
+        Collection.objects.create(id=1, title='a')
+        Promotion.objects.create(id=1, discription='a', discount=10)
+        Product.objects.create(id=1, title='old', slug='old', unit_price=10, inventory=10)
+
+        response = post_import(ndjson(
+            {'id': 1, 'title': 'New Title', 'unit_price': '12.50', 'inventory': 5, 'collection_id': 1},
+            {'id': 2, 'title': 'Other', 'unit_price': '3', 'inventory': 7, 'promotion_ids': [1]},
+        ), 'application/x-ndjson')
+
+        assert response.data == {'imported': 2, 'failed': 0, 'errors': []}
+        product = Product.objects.get(pk=1)
+        assert (product.title, product.slug, product.collection_id) == ('New Title', 'new-title', 1)
+        assert list(Product.objects.get(pk=2).promotion.values_list('pk', flat=True)) == [1]
+        assert Collection.objects.get(pk=1).products_count == 1
+
+    def test_invalid_rows_are_reported_and_skipped(self):
+        response = post_import(
+            'id,title,unit_price,inventory,collection_id\n'
+            '1,a,10,1,\n'
+            '2,b,0,1,\n'
+            '3,c,10,1,99\n',
+            'text/csv')
+
+        assert response.data['imported'] == 1
+        assert [error['row'] for error in response.data['errors']] == [2, 3]
+        assert 'unit_price' in response.data['errors'][0]['errors']
+        assert list(Product.objects.values_list('pk', flat=True)) == [1]
+
+    def test_unknown_content_type_returns_415(self):
+        response = post_import('{}', 'application/json')
+
+        assert response.status_code == status.HTTP_415_UNSUPPORTED_MEDIA_TYPE
+
+    def test_command_imports_in_chunks(self, tmp_path, django_assert_max_num_queries):
+        path = tmp_path / 'products.jsonl'
+        path.write_text(ndjson(*[
+            {'id': i, 'title': f'p{i}', 'unit_price': '10', 'inventory': 1}
+            for i in range(1, 101)
+        ]))
+
+        with django_assert_max_num_queries(60):
+            call_command('import_products', str(path), chunk_size=25)
+
+        assert Product.objects.count() == 100
+
+
+@pytest.mark.django_db
+class TestImportUsers:
+    def test_users_and_customers_are_created_per_chunk(self, tmp_path, django_assert_num_queries):
+        hashed = make_password('secret-pass')
+        path = tmp_path / 'users.csv'
+        path.write_text('username,email,password,phone,membership\n' + ''.join(
+            f'user{i},user{i}@example.com,{hashed},555-{i},G\n' for i in range(50)))
+
+        # Per chunk of 25: existing usernames, the savepoint pair and the two INSERTs
+        with django_assert_num_queries(2 * 5):
+            call_command('import_users', str(path), chunk_size=25)
+
+        assert Customer.objects.count() == User.objects.count() == 50
+        user = User.objects.select_related('customer').get(username='user7')
+        assert user.check_password('secret-pass')
+        assert (user.customer.phone, user.customer.membership) == ('555-7', 'G')
+
+    def test_invalid_and_existing_users_are_rejected(self):
+        User.objects.create_user('taken')
+
+        result = import_users([
+            {'username': 'taken'},
+            {'username': 'plain', 'password': 'not-a-hash'},
+            {'username': 'bad name!'},
+            {'username': 'fresh'},
+        ])
+
+        assert (result.imported, result.failed) == (1, 3)
+        assert [error['row'] for error in result.errors] == [2, 3, 1]
+        assert not User.objects.get(username='fresh').has_usable_password()
+        assert Customer.objects.filter(user__username='fresh').exists()
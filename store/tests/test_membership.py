@@ -0,0 +1,80 @@
+from datetime import date, timedelta
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from store import membership, reports
+from store.models import Customer, Order, OrderItem, Product
+from store.tasks import update_membership_tiers
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def tiers(settings):
+    settings.STORE_MEMBERSHIP = {'WINDOW_DAYS': 30, 'TIERS': [('G', 100), ('S', 20)], 'EXPIRY_LOOKBACK_DAYS': 2}
+    Product.objects.create(id=1, title='a', slug='a', unit_price=10, inventory=100)
+
+
+def customer(name):
+    return User.objects.create_user(name).customer
+
+
+def place_order(customer, amount, payment_status='C', placed_at=None):
+    # Counted the way the outbox relay and status changes count orders
+    order = Order.objects.create(customer=customer, payment_status=payment_status)
+    OrderItem.objects.create(order=order, product_id=1, quantity=1, unit_price=amount)
+    if placed_at:
+        Order.objects.filter(pk=order.pk).update(placed_at=placed_at)
+    reports.sync_orders([order.pk])
+    return order
+
+
+def memberships():
+    return dict(Customer.objects.values_list('user__username', 'membership'))
+
+
+@pytest.mark.django_db
+class TestMembershipTiers:
+    def test_completed_orders_flag_and_promote_the_customer(self):
+        gold, silver, pending = customer('gold'), customer('silver'), customer('pending')
+        place_order(gold, 60)
+        place_order(gold, 50)
+        place_order(silver, 25)
+        place_order(pending, 500, payment_status='P')
+        assert set(Customer.objects.filter(tier_stale=True).values_list('user__username', flat=True)) == {'gold', 'silver'}
+
+        assert update_membership_tiers() == 2
+
+        assert memberships() == {'gold': 'G', 'silver': 'S', 'pending': 'B'}
+        assert not Customer.objects.filter(tier_stale=True).exists()
+
+    def test_only_flagged_customers_are_recomputed(self):
+        untouched = customer('untouched')
+        Customer.objects.filter(pk=untouched.pk).update(membership='G')
+        place_order(customer('buyer'), 30)
+
+        assert membership.update_stale_tiers() == (1, 1)
+        assert memberships() == {'untouched': 'G', 'buyer': 'S'}
+
+        call_command('update_membership_tiers', '--all')
+
+        assert memberships() == {'untouched': 'B', 'buyer': 'S'}
+
+    def test_spend_leaving_the_window_demotes(self):
+        lapsed = customer('lapsed')
+        place_order(lapsed, 200, placed_at=date.today() - timedelta(days=31))
+        Customer.objects.filter(pk=lapsed.pk).update(membership='G', tier_stale=False)
+
+        assert membership.update_stale_tiers() == (1, 1)
+
+        assert memberships() == {'lapsed': 'B'}
+
+    def test_full_recompute_costs_the_same_per_batch(self, django_assert_num_queries):
+        for i in range(20):
+            place_order(customer(f'c{i}'), 5 * i)
+
+        # Per batch of 10: the savepoint pair, the customers, their spend,
+        # an UPDATE per tier in the batch (Bronze and Silver, then only
+        # Silver) and clearing the flags; then an empty batch
+        with django_assert_num_queries(7 + 6 + 3):
+            checked, changed = membership.recompute_all_tiers(batch_size=10)
+
+        assert (checked, changed) == (20, 16)
@@ -0,0 +1,70 @@
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from rest_framework.test import APIClient
+from rest_framework import status
+from store.authentication import TokenObtainPairSerializer
+from store.models import Order, OrderItem, Product
+import pytest
+
+
+@pytest.fixture
+def products():
+    return Product.objects.bulk_create([
+        Product(id=i, title=f'p{i}', slug='-', unit_price=10, inventory=100) for i in range(1, 4)
+    ])
+
+
+def place_orders(user, count):
+    orders = Order.objects.bulk_create([Order(customer=user.customer) for _ in range(count)])
+    OrderItem.objects.bulk_create([
+        OrderItem(order=order, product_id=product_id, quantity=1, unit_price=10)
+        for order in orders for product_id in (1, 2, 3)
+    ])
+    return orders
+
+
+def client_for(user):
+    client = APIClient()
+    client.force_authenticate(user=user)
+    return client
+
+
+@pytest.mark.django_db
+class TestListOrders:
+    def test_customers_only_see_their_own_orders(self, products):
+        user, other = User.objects.create_user('a'), User.objects.create_user('b')
+        [own] = place_orders(user, 1)
+        [foreign] = place_orders(other, 1)
+        client = client_for(user)
+
+        response = client.get('/store/orders/')
+
+        assert [order['id'] for order in response.data['results']] == [own.id]
+        assert client.get(f'/store/orders/{foreign.id}/').status_code == status.HTTP_404_NOT_FOUND
+
+    def test_staff_see_every_order(self, products):
+        place_orders(User.objects.create_user('a'), 1)
+        place_orders(User.objects.create_user('b'), 1)
+
+        response = client_for(User.objects.create_user('staff', is_staff=True)).get('/store/orders/')
+
+        assert len(response.data['results']) == 2
+
+    @pytest.mark.parametrize('count', [2, 10])
+    def test_queries_per_page_are_constant(self, products, count, settings, django_assert_num_queries):
+        settings.STORE_AUTH = {'CACHE_TIMEOUT': 60}
+        cache.clear()
+        user = User.objects.create_user('a')
+        orders = place_orders(user, count)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'JWT {TokenObtainPairSerializer.get_token(user).access_token}')
+        client.get('/store/orders/')
+
+        # orders, then their items with the products; the user is cached
+        # and the customer id comes from the token
+        with django_assert_num_queries(2):
+            response = client.get('/store/orders/')
+
+        assert [order['id'] for order in response.data['results']] == sorted(
+            [order.id for order in orders], reverse=True)
+        assert response.data['results'][0]['items'][0]['product'] == {'id': 1, 'title': 'p1', 'unit_price': 10}
@@ -0,0 +1,73 @@
+from django.contrib.auth.models import User
+from django.utils import timezone
+from rest_framework.test import APIClient
+from store import outbox
+from store.models import Cart, CartItem, Order, OutboxEvent, Product
+from store.signals import order_created
+from store.tasks import relay_outbox
+import pytest
+
+
+@pytest.fixture
+def received():
+    calls = []
+
+    def receiver(sender, order, event_id, **kwargs):
+        calls.append(order.id)
+    order_created.connect(receiver, weak=False)
+    yield calls
+    order_created.disconnect(receiver)
+
+
+def place_order(inventory=100):
+    Product.objects.create(id=1, title='a', slug='a', unit_price=10, inventory=inventory)
+    cart = Cart.objects.create()
+    CartItem.objects.create(cart=cart, product_id=1, quantity=2)
+    client = APIClient()
+    client.force_authenticate(user=User.objects.create_user('buyer'))
+    return client.post('/store/orders/', {'cart_id': str(cart.id)})
+
+
+@pytest.mark.django_db
+class TestOutbox:
+    def test_checkout_writes_an_event_instead_of_calling_receivers(self, received):
+        response = place_order()
+
+        event = OutboxEvent.objects.get()
+        assert (event.topic, event.payload) == ('order_created', {'order_id': response.data['id']})
+        assert received == []
+
+    def test_rolled_back_checkout_leaves_no_event(self, received):
+        place_order(inventory=1)
+
+        assert not Order.objects.exists()
+        assert not OutboxEvent.objects.exists()
+
+    def test_relay_delivers_and_marks_processed(self, received):
+        order_id = place_order().data['id']
+
+        assert relay_outbox() == 1
+
+        assert received == [order_id]
+        assert OutboxEvent.objects.get().processed_at is not None
+        assert outbox.relay() == 0
+
+    def test_failed_delivery_is_retried_later(self, received):
+        place_order()
+        def failing(sender, **kwargs):
+            raise RuntimeError('mail server down')
+        order_created.connect(failing, weak=False)
+        try:
+            assert outbox.relay() == 0
+        finally:
+            order_created.disconnect(failing)
+
+        event = OutboxEvent.objects.get()
+        assert (event.attempts, event.processed_at) == (1, None)
+        assert 'mail server down' in event.last_error
+        assert event.available_at > timezone.now()
+
+        OutboxEvent.objects.update(available_at=timezone.now())
+        assert outbox.relay() == 1
+        # At least once: the receiver that had succeeded ran again
+        assert len(received) == 2
@@ -0,0 +1,89 @@
+import json
+from base64 import urlsafe_b64encode
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+from rest_framework import status
+from store.models import Product
+import pytest
+
+
+@pytest.fixture
+def products():
+    cache.clear()
+    # Repeated titles and prices force the id tiebreaker
+    return Product.objects.bulk_create([
+        Product(id=i, title=f'p{i % 4}', slug='-', unit_price=10 + i % 3, inventory=10)
+        for i in range(1, 26)
+    ])
+
+
+def walk(client, url, params=None):
+    ids = []
+    response = client.get(url, params)
+    while True:
+        assert response.status_code == status.HTTP_200_OK
+        ids += [product['id'] for product in response.data['results']]
+        if response.data['next'] is None:
+            return ids, response
+        response = client.get(response.data['next'])
+
+
+@pytest.mark.django_db
+class TestKeysetPagination:
+    def test_pages_follow_title_then_id(self, products):
+        ids, _ = walk(APIClient(), '/store/products/')
+
+        expected = sorted(products, key=lambda product: (product.title, product.id))
+        assert ids == [product.id for product in expected]
+
+    def test_pages_follow_requested_ordering(self, products):
+        ids, _ = walk(APIClient(), '/store/products/', {'ordering': '-unit_price'})
+
+        expected = sorted(products, key=lambda product: (-product.unit_price, -product.id))
+        assert ids == [product.id for product in expected]
+
+    def test_previous_link_returns_previous_page(self, products):
+        client = APIClient()
+        first = client.get('/store/products/')
+        second = client.get(first.data['next'])
+
+        response = client.get(second.data['previous'])
+
+        assert response.data['results'] == first.data['results']
+        assert response.data['previous'] is None
+
+    def test_page_does_not_count_rows(self, products):
+        with CaptureQueriesContext(connection) as context:
+            APIClient().get('/store/products/', {'count': 'estimated'})
+
+        assert not any('COUNT(' in query['sql'] for query in context.captured_queries)
+        assert not any('OFFSET' in query['sql'] for query in context.captured_queries)
+
+    def test_invalid_cursor_returns_404(self, products):
+        response = APIClient().get('/store/products/', {'cursor': 'nope'})
+
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+    @pytest.mark.parametrize('ordering, values', [
+        ('unit_price', ['abc', 1]),
+        ('last_update', ['notadate', 1]),
+        (None, ['x', 'y']),
+    ])
+    def test_cursor_values_of_the_wrong_type_return_404(self, products, ordering, values):
+        fields = [ordering or 'title', 'id']
+        token = urlsafe_b64encode(json.dumps({'o': fields, 'v': values, 'r': False}).encode()).decode()
+        params = {'cursor': token, **({'ordering': ordering} if ordering else {})}
+
+        response = APIClient().get('/store/products/', params)
+
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+    def test_cursor_from_another_ordering_returns_404(self, products):
+        client = APIClient()
+        next_link = client.get('/store/products/').data['next']
+
+        response = client.get(next_link + '&ordering=unit_price')
+
+        assert response.status_code == status.HTTP_404_NOT_FOUND
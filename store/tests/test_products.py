@@ -0,0 +1,92 @@
+from django.core.cache import cache
+from rest_framework.test import APIClient
+from rest_framework import status
+from store.models import Product, ProductImage
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    cache.clear()
+    yield
+    cache.clear()
+
+
+@pytest.mark.django_db
+class TestProductResponseCache:
+    @pytest.mark.parametrize('backend', ['store.caching.DjangoCacheBackend', 'store.caching.LRUBackend'])
+    def test_repeated_list_is_served_from_cache(self, backend, settings, django_assert_num_queries):
+        settings.STORE_RESPONSE_CACHE = {'BACKEND': backend, 'TIMEOUT': 60}
+        Product.objects.create(id=1, title='a', slug='a', unit_price=10, inventory=10)
+        client = APIClient()
+
+        first = client.get('/store/products/', {'ordering': 'unit_price', 'page': 1})
+        with django_assert_num_queries(0):
+            second = client.get('/store/products/', {'page': 1, 'ordering': 'unit_price'})
+
+        assert first.status_code == status.HTTP_200_OK
+        assert second.data == first.data
+
+    @pytest.mark.parametrize('backend', ['store.caching.DjangoCacheBackend', 'store.caching.LRUBackend'])
+    def test_product_update_invalidates_cached_detail(self, backend, settings):
+        settings.STORE_RESPONSE_CACHE = {'BACKEND': backend, 'TIMEOUT': 60}
+        product = Product.objects.create(id=1, title='a', slug='a', unit_price=10, inventory=10)
+        client = APIClient()
+        client.get('/store/products/1/')
+
+        product.title = 'b'
+        product.save()
+        response = client.get('/store/products/1/')
+
+        assert response.data['title'] == 'b'
+
+    def test_missing_product_is_not_cached(self):
+        client = APIClient()
+        client.get('/store/products/1/')
+        # bulk_create skips the signals, so the generation stays the same
+        Product.objects.bulk_create([Product(id=1, title='a', slug='a', unit_price=10, inventory=10)])
+
+        response = client.get('/store/products/1/')
+
+        assert response.status_code == status.HTTP_200_OK
+
+
+def create_products(count, images_per_product=2):
+    products = Product.objects.bulk_create([
+        Product(id=i, title=f'p{i}', slug='-', unit_price=10, inventory=10)
+        for i in range(1, count + 1)
+    ])
+    ProductImage.objects.bulk_create([
+        ProductImage(product=product, image=f'store/images/{product.id}-{n}.jpg')
+        for product in products
+        for n in range(images_per_product)
+    ])
+
+
+@pytest.mark.django_db
+class TestProductQueries:
+    @pytest.mark.parametrize('count', [1, 10])
+    def test_list_query_count_does_not_grow_with_page_size(self, count, django_assert_num_queries):
+        create_products(count)
+
+        # products + images
+        with django_assert_num_queries(2):
+            response = APIClient().get('/store/products/')
+
+        assert len(response.data['results']) == count
+        assert all(len(product['images']) == 2 for product in response.data['results'])
+
+    def test_detail_loads_images_in_one_query(self, django_assert_num_queries):
+        create_products(1)
+
+        with django_assert_num_queries(2):
+            response = APIClient().get('/store/products/1/')
+
+        assert len(response.data['images']) == 2
+
+    def test_price_with_tax_is_exact(self):
+        Product.objects.create(id=1, title='a', slug='a', unit_price='19.99', inventory=10)
+
+        response = APIClient().get('/store/products/1/')
+
+        assert str(response.data['price_with_tax']) == '21.99'
@@ -0,0 +1,202 @@
+from datetime import date, timedelta
+from decimal import Decimal
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db.models import F
+from rest_framework.test import APIClient
+from rest_framework import status
+from store import outbox, reports
+from store.models import Cart, CartItem, Collection, CollectionSales, Customer, Order, OrderItem, Product, ProductSales
+import pytest
+
+
+@pytest.fixture
+def catalog():
+    Collection.objects.create(id=1, title='a')
+    Product.objects.bulk_create([
+        Product(id=1, title='p1', slug='-', unit_price=Decimal('2.50'), inventory=100, collection_id=1),
+        Product(id=2, title='p2', slug='-', unit_price=Decimal('4.00'), inventory=100, collection_id=1),
+        Product(id=3, title='p3', slug='-', unit_price=Decimal('1.10'), inventory=100),
+    ])
+
+
+@pytest.fixture
+def admin():
+    client = APIClient()
+    client.force_authenticate(user=User.objects.create_user('staff', is_staff=True))
+    return client
+
+
+def checkout(lines):
+    cart = Cart.objects.create()
+    CartItem.objects.bulk_create([CartItem(cart=cart, product_id=pk, quantity=quantity) for pk, quantity in lines])
+    client = APIClient()
+    client.force_authenticate(user=User.objects.get_or_create(username='buyer')[0])
+    return client.post('/store/orders/', {'cart_id': str(cart.id)}).data['id']
+
+
+def rollups():
+    return (
+        set(ProductSales.objects.values_list('product_id', 'payment_status', 'quantity', 'revenue')),
+        set(CollectionSales.objects.values_list('collection_id', 'payment_status', 'quantity', 'revenue')),
+    )
+
+
+@pytest.mark.django_db
+class TestSalesRollups:
+    def test_orders_are_counted_once_relayed(self, catalog):
+        checkout([(1, 2), (3, 1)])
+        checkout([(1, 1), (2, 3)])
+        assert not ProductSales.objects.exists()
+
+        outbox.relay()
+        outbox.relay()
+
+        assert rollups() == (
+            {(1, 'P', 3, Decimal('7.50')), (2, 'P', 3, Decimal('12.00')), (3, 'P', 1, Decimal('1.10'))},
+            {(1, 'P', 6, Decimal('19.50'))},
+        )
+        assert set(ProductSales.objects.values_list('day', flat=True)) == {date.today()}
+
+    def test_a_redelivered_event_is_not_counted_twice(self, catalog):
+        order_id = checkout([(1, 2)])
+        outbox.relay()
+
+        assert reports.sync_orders([order_id]) == 0
+
+        assert ProductSales.objects.get().quantity == 2
+
+    def test_payment_status_changes_move_the_totals(self, catalog, admin):
+        order_id = checkout([(1, 2)])
+        outbox.relay()
+
+        admin.patch(f'/store/orders/{order_id}/', {'payment_status': 'C'})
+
+        assert rollups() == (
+            {(1, 'P', 0, Decimal('0.00')), (1, 'C', 2, Decimal('5.00'))},
+            {(1, 'P', 0, Decimal('0.00')), (1, 'C', 2, Decimal('5.00'))},
+        )
+
+    def test_rebuild_matches_the_incremental_totals(self, catalog, admin):
+        for lines in ([(1, 2), (3, 1)], [(2, 1)], [(1, 1), (2, 2)]):
+            checkout(lines)
+        outbox.relay()
+        admin.patch(f'/store/orders/{Order.objects.order_by("pk").first().pk}/', {'payment_status': 'F'})
+        # The rebuild doesn't write the rows a status change emptied
+        incremental = tuple({row for row in rows if row[2]} for rows in rollups())
+
+        call_command('rebuild_sales_rollups')
+
+        assert rollups() == incremental
+        assert not Order.objects.exclude(rollup_status=F('payment_status')).exists()
+
+    def test_rebuild_since_keeps_earlier_days(self, catalog):
+        old = checkout([(1, 1)])
+        Order.objects.filter(pk=old).update(placed_at=date.today() - timedelta(days=3))
+        checkout([(2, 1)])
+        outbox.relay()
+        ProductSales.objects.filter(product_id=2).update(quantity=99)
+
+        assert reports.rebuild(since=date.today()) == 1
+
+        assert dict(ProductSales.objects.values_list('product_id', 'quantity')) == {1: 1, 2: 1}
+
+    def test_rebuild_in_batches_keeps_the_customer_counters(self, catalog, admin):
+        for lines in ([(1, 2)], [(2, 1)], [(3, 4)]):
+            checkout(lines)
+        outbox.relay()
+        admin.patch(f'/store/orders/{Order.objects.order_by("pk").last().pk}/', {'payment_status': 'C'})
+        before = rollups()
+
+        call_command('rebuild_sales_rollups', batch_size=2)
+
+        assert {row for row in rollups()[0] if row[2]} == {row for row in before[0] if row[2]}
+        assert not Order.objects.exclude(rollup_status=F('payment_status')).exists()
+        assert reports.reconcile_customers() == 0
+        assert User.objects.get(username='buyer').customer.order_count == 3
+
+
+@pytest.mark.django_db
+class TestSalesReport:
+    @pytest.fixture(autouse=True)
+    def sales(self, catalog, admin):
+        checkout([(1, 2), (3, 1)])
+        failed = checkout([(2, 5)])
+        outbox.relay()
+        admin.patch(f'/store/orders/{failed}/', {'payment_status': 'F'})
+
+    def report(self, client, **params):
+        today = date.today().isoformat()
+        return client.get('/store/reports/sales/', {'start': today, 'end': today, **params})
+
+    def test_is_admin_only(self):
+        client = APIClient()
+        client.force_authenticate(user=User.objects.create_user('customer'))
+
+        assert self.report(client).status_code == status.HTTP_403_FORBIDDEN
+
+    def test_totals_per_day_leave_out_failed_payments(self, admin):
+        response = self.report(admin)
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['results'] == [{'day': date.today(), 'quantity': 3, 'revenue': Decimal('6.10')}]
+        assert (response.data['quantity'], response.data['revenue']) == (3, Decimal('6.10'))
+
+    def test_groups_by_product_and_collection(self, admin):
+        by_product = self.report(admin, group_by='product').data['results']
+        by_collection = self.report(admin, group_by='collection', payment_status='F').data['results']
+
+        assert by_product == [
+            {'product': 1, 'quantity': 2, 'revenue': Decimal('5.00')},
+            {'product': 3, 'quantity': 1, 'revenue': Decimal('1.10')},
+        ]
+        assert by_collection == [{'collection': 1, 'quantity': 5, 'revenue': Decimal('20.00')}]
+
+    def test_reads_only_the_rollups(self, admin, django_assert_num_queries):
+        with django_assert_num_queries(1):
+            self.report(admin, start=(date.today() - timedelta(days=365)).isoformat())
+
+    def test_rejects_an_inverted_range(self, admin):
+        response = self.report(admin, start=date.today().isoformat(),
+                               end=(date.today() - timedelta(days=1)).isoformat())
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.django_db
+class TestCustomerStats:
+    def customer(self):
+        return User.objects.get(username='buyer').customer
+
+    def test_counters_follow_the_orders(self, catalog, admin):
+        paid = checkout([(1, 2), (2, 1)])
+        failed = checkout([(3, 1)])
+        outbox.relay()
+        assert (self.customer().order_count, self.customer().lifetime_spend) == (2, Decimal('0.00'))
+
+        admin.patch(f'/store/orders/{paid}/', {'payment_status': 'C'})
+        admin.patch(f'/store/orders/{failed}/', {'payment_status': 'F'})
+
+        assert (self.customer().order_count, self.customer().lifetime_spend) == (1, Decimal('9.00'))
+        assert reports.reconcile_customers() == 0
+
+    def test_deleted_orders_are_uncounted(self, catalog):
+        order_id = checkout([(1, 1)])
+        outbox.relay()
+        OrderItem.objects.filter(order_id=order_id).delete()
+
+        Order.objects.get(pk=order_id).delete()
+
+        assert self.customer().order_count == 0
+
+    def test_reconcile_repairs_drift(self, catalog, admin):
+        order_id = checkout([(1, 2)])
+        outbox.relay()
+        admin.patch(f'/store/orders/{order_id}/', {'payment_status': 'C'})
+        customer = self.customer()
+        Customer.objects.filter(pk=customer.pk).update(order_count=7, lifetime_spend=0)
+
+        call_command('reconcile_customer_stats', batch_size=1)
+
+        customer.refresh_from_db()
+        assert (customer.order_count, customer.lifetime_spend) == (1, Decimal('5.00'))
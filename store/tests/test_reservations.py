@@ -0,0 +1,101 @@
+from datetime import timedelta
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework import status
+from store import reservations
+from store.models import Cart, Product, Reservation
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def enabled(settings):
+    cache.clear()
+    settings.STORE_RESERVATIONS = {'ENABLED': True, 'TTL': 60, 'BATCH_SIZE': 2}
+
+
+@pytest.fixture
+def product():
+    return Product.objects.create(id=1, title='a', slug='a', unit_price=10, inventory=5)
+
+
+def add(cart, quantity, product_id=1):
+    return APIClient().post(f'/store/carts/{cart.id}/items/', {'product_id': product_id, 'quantity': quantity})
+
+
+@pytest.mark.django_db
+class TestReservations:
+    def test_adding_to_cart_reserves_stock(self, product):
+        client = APIClient()
+        assert client.get('/store/products/stock/', {'id': 1}).data == [{'id': 1, 'available_inventory': 5}]
+
+        add(Cart.objects.create(), 3)
+
+        assert Product.objects.get().reserved == 3
+        assert client.get('/store/products/stock/', {'id': 1}).data == [{'id': 1, 'available_inventory': 2}]
+
+    def test_reserved_stock_is_not_available_to_other_carts(self, product):
+        add(Cart.objects.create(), 3)
+        other = Cart.objects.create()
+
+        response = add(other, 3)
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert response.data == {'items': {'1': ['Only 2 left in stock']}}
+        assert not other.items.exists()
+
+    def test_checkout_takes_the_reserved_stock(self, product):
+        cart = Cart.objects.create()
+        add(cart, 3)
+        add(Cart.objects.create(), 2)
+        client = APIClient()
+        client.force_authenticate(user=User.objects.create_user('buyer'))
+
+        response = client.post('/store/orders/', {'cart_id': str(cart.id)})
+
+        assert response.status_code == status.HTTP_200_OK
+        product.refresh_from_db()
+        assert (product.inventory, product.reserved) == (2, 2)
+        assert not Reservation.objects.filter(cart_id=cart.id).exists()
+
+    def test_checkout_releases_what_is_held_for_products_not_bought(self, product):
+        Product.objects.create(id=2, title='b', slug='b', unit_price=10, inventory=5)
+        cart = Cart.objects.create()
+        add(cart, 3)
+        add(cart, 4, product_id=2)
+        # The line is gone but its reservation isn't, as after a PATCH to 0
+        cart.items.filter(product_id=2).delete()
+        client = APIClient()
+        client.force_authenticate(user=User.objects.create_user('buyer'))
+
+        response = client.post('/store/orders/', {'cart_id': str(cart.id)})
+
+        assert response.status_code == status.HTTP_200_OK
+        assert dict(Product.objects.values_list('pk', 'reserved')) == {1: 0, 2: 0}
+        assert not Reservation.objects.exists()
+
+    def test_removing_a_line_releases_its_reservation(self, product):
+        cart = Cart.objects.create()
+        line = add(cart, 3).data
+
+        APIClient().delete(f"/store/carts/{cart.id}/items/{line['id']}/")
+
+        assert Product.objects.get().reserved == 0
+        assert not Reservation.objects.exists()
+
+    def test_expired_reservations_are_released_in_batches(self, product, django_assert_num_queries):
+        Product.objects.create(id=2, title='b', slug='b', unit_price=10, inventory=5)
+        for product_id in (1, 2):
+            add(Cart.objects.create(), 1, product_id)
+            add(Cart.objects.create(), 2, product_id)
+        Reservation.objects.filter(quantity=2).update(expires_at=timezone.now() - timedelta(seconds=1))
+
+        # A full batch: select, products update, delete and the savepoint
+        # pair, then an empty select in its own savepoint
+        with django_assert_num_queries(5 + 3):
+            released = reservations.release_expired()
+
+        assert released == 2
+        assert dict(Product.objects.values_list('pk', 'reserved')) == {1: 1, 2: 1}
+        assert Reservation.objects.count() == 2
@@ -0,0 +1,49 @@
+from django.core.cache import cache
+from rest_framework.test import APIClient
+from store.models import Product
+import pytest
+
+
+@pytest.fixture
+def products():
+    cache.clear()
+    return [
+        Product.objects.create(id=1, title='Cheddar Cheese', slug='-', unit_price=5, inventory=10,
+                               description='aged cheddar from the farm'),
+        Product.objects.create(id=2, title='Wheat Bread', slug='-', unit_price=3, inventory=10,
+                               description='goes well with cheddar'),
+        Product.objects.create(id=3, title='Olive Oil', slug='-', unit_price=9, inventory=10,
+                               description='extra virgin'),
+    ]
+
+
+def search(**params):
+    response = APIClient().get('/store/products/', params)
+    return [product['id'] for product in response.data['results']]
+
+
+# Full-text indexes (InnoDB) only see committed rows
+@pytest.mark.django_db(transaction=True)
+class TestProductSearch:
+    def test_matches_title_and_description_ranked_by_relevance(self, products):
+        assert search(search='cheddar') == [1, 2]
+
+    def test_matches_prefix_of_last_term(self, products):
+        assert search(search='oli') == [3]
+
+    def test_composes_with_product_filter(self, products):
+        assert search(search='cheddar', unit_price__lt=4) == [2]
+
+    def test_index_follows_updates(self, products):
+        products[2].description = 'pairs with cheddar'
+        products[2].save()
+
+        assert sorted(search(search='cheddar')) == [1, 2, 3]
+
+    def test_operators_in_terms_are_ignored(self, products):
+        assert search(search='"olive*" (-') == [3]
+
+    def test_like_backend_matches_the_same_rows(self, products, settings):
+        settings.STORE_SEARCH_BACKEND = 'store.search.LikeSearchBackend'
+
+        assert search(search='cheddar') == [1, 2]
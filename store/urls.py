@@ -5,11 +5,12 @@ from rest_framework_nested import routers
 router = routers.DefaultRouter()
 router.register('products',views.ProductViewSet)
 router.register('collections',views.CollectionViewSet)
-router.register('carts', views.CartViewSet)
+router.register('carts', views.CartViewSet, basename='cart')
 router.register('customers', views.CustomerViewSet)
-router.register('orders', views.OrderViewset)
+router.register('orders', views.OrderViewset, basename='order')
+router.register('reports/sales', views.SalesReportViewSet, basename='sales-report')
 
-products_router = routers.NestedDefaultRouter(router, 'products', lookup='product_pk')
+products_router = routers.NestedDefaultRouter(router, 'products', lookup='product')
 products_router.register('reviews', views.ReviewViewSet, basename='product-reviews')
 products_router.register('images', views.ProductImageViewSet, basename='product-images')
 
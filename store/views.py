@@ -1,5 +1,10 @@
+from collections import defaultdict
+from decimal import Decimal, InvalidOperation
+from django.db.models import Case, Count, F, Prefetch, Value, When
+from django.db.models.functions import Floor
 from django.http import HttpResponse
 from rest_framework.decorators import api_view
+from rest_framework.exceptions import NotFound
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.permissions import IsAuthenticated, AllowAny, IsAdminUser
@@ -7,47 +12,206 @@ from rest_framework.mixins import CreateModelMixin, DestroyModelMixin, RetrieveM
 from rest_framework.viewsets import ModelViewSet,GenericViewSet
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.decorators import action
-from rest_framework.filters import SearchFilter, OrderingFilter
+from rest_framework.filters import OrderingFilter
 from .models import Product, ProductImage
-from .models import Collection, Review, Cart, CartItem, Customer, Order, OrderItem
+from .models import Collection, Review, Customer, Order, OrderItem
 from .serializers import ProductSerializer, ReviewSerializer, CustomerSerializer, OrderSerializer, CreateOrderSerializer, ProductImageSerializer
 from .serializers import CollectionSerializer, CartSerializer, CartItemSerializer, AddCartItemSerializer, UpdateCartItemSerializer, UpdateOrderSerializer
+from .serializers import BulkAddCartItemSerializer, SalesReportQuerySerializer
 from .filters import ProductFilter
-from .pagination import DefaultPagination
+from .pagination import KeysetPagination
 from .permissions import IsAdminOrReadOnly
+from uuid import UUID
+from .caching import CachedResponseMixin, ConditionalGetMixin, ConditionalRetrieveMixin
+from .caching import bump_version, cart_namespace, get_version, COLLECTIONS, PRODUCTS, STOCK
+from .search import ProductSearchFilter
+from .importers import CONTENT_TYPES, decode_lines, import_products, read_rows
+from .carts import CartNotFound, get_cart_store
+from . import reservations
+from .idempotency import idempotent
+from .authentication import get_customer_id
+from .reports import sales_report
+
+IMPORT_CHUNK_SIZE = 1000
+DEFAULT_BUCKET_WIDTH = 10
+MIN_BUCKET_WIDTH = 1
+# Same threshold as the admin's InventoryFilter
+LOW_STOCK_THRESHOLD = 10
+MAX_STOCK_IDS = 100
  
 # Create your views here.
 
-class ProductViewSet(ModelViewSet):
-       queryset = Product.objects.all()
+class ProductViewSet(ConditionalGetMixin, CachedResponseMixin, ModelViewSet):
+       # One query per page for the images instead of one per product
+       queryset = Product.objects.prefetch_related('images').all()
        serializer_class = ProductSerializer
-       filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
+       filter_backends = [DjangoFilterBackend, ProductSearchFilter, OrderingFilter]
        filterset_class = ProductFilter
-       pagination_class = DefaultPagination
+       pagination_class = KeysetPagination
        permission_classes = [IsAdminOrReadOnly]
-       search_fields = ['title']
+       search_fields = ['title', 'description']
        ordering_fields = ['unit_price', 'last_update']
+       cache_namespace = PRODUCTS
+
+       def get_validator_namespaces(self):
+              # Carts and checkouts bump only STOCK, the product payload
+              # leaves the stock to its own endpoint
+              if self.action == 'stock':
+                     return [PRODUCTS, STOCK]
+              return [PRODUCTS]
+
+       def get_cache_versions(self, action):
+              # The facets' stock levels go by the inventory
+              return [get_version(STOCK)] if action == 'facets' else []
+
+       # Available stock of the listed products, ?id=1&id=2
+       @action(detail=False)
+       def stock(self, request):
+              return self.conditional_response(request, self.get_stock, 'stock')
+
+       def get_stock(self, request):
+              try:
+                     ids = [int(pk) for pk in request.query_params.getlist('id')]
+              except ValueError:
+                     ids = None
+              if not ids or len(ids) > MAX_STOCK_IDS:
+                     return Response(
+                            {'id': [f'Give between 1 and {MAX_STOCK_IDS} product ids.']},
+                            status=status.HTTP_400_BAD_REQUEST)
+              rows = Product.objects \
+                     .filter(pk__in=ids) \
+                     .order_by('pk') \
+                     .values_list('pk', F('inventory') - F('reserved'))
+              return Response([{'id': pk, 'available_inventory': available} for pk, available in rows])
+
+       # Price histogram, stock levels and collection counts for the
+       # listing's filters, all folded from one GROUP BY
+       @action(detail=False)
+       def facets(self, request):
+              return self.cached_response(request, self.get_facets, 'facets')
+
+       def get_facets(self, request):
+              try:
+                     width = Decimal(request.query_params.get('bucket_width', DEFAULT_BUCKET_WIDTH))
+              except InvalidOperation:
+                     width = None
+              if width is None or not width.is_finite() or width < MIN_BUCKET_WIDTH:
+                     return Response(
+                            {'bucket_width': [f'Must be a number of at least {MIN_BUCKET_WIDTH}.']},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+              groups = self.filter_queryset(self.get_queryset()) \
+                     .prefetch_related(None) \
+                     .order_by() \
+                     .annotate(
+                            bucket=Floor(F('unit_price') / width),
+                            stock=Case(
+                                   When(inventory__lte=0, then=Value('out_of_stock')),
+                                   When(inventory__lt=LOW_STOCK_THRESHOLD, then=Value('low_stock')),
+                                   default=Value('in_stock'))) \
+                     .values('bucket', 'stock', 'collection_id') \
+                     .annotate(count=Count('pk'))
+
+              buckets = defaultdict(int)
+              inventory = {'in_stock': 0, 'low_stock': 0, 'out_of_stock': 0}
+              collections = defaultdict(int)
+              for group in groups:
+                     buckets[int(group['bucket'])] += group['count']
+                     inventory[group['stock']] += group['count']
+                     collections[group['collection_id']] += group['count']
+
+              return Response({
+                     'count': sum(inventory.values()),
+                     'price': {
+                            'bucket_width': width,
+                            'buckets': [
+                                   {'min': bucket * width, 'max': (bucket + 1) * width, 'count': count}
+                                   for bucket, count in sorted(buckets.items())
+                            ],
+                     },
+                     'inventory': inventory,
+                     'collections': [
+                            {'collection_id': collection_id, 'count': count}
+                            for collection_id, count in sorted(collections.items(), key=lambda item: item[0] or 0)
+                     ],
+              })
+
+       # Streams NDJSON or CSV from the request body, nothing is buffered
+       @action(detail=False, methods=['POST'], url_path='import', permission_classes=[IsAdminUser])
+       def bulk_import(self, request):
+              content_type = request.content_type.split(';')[0].strip()
+              format = CONTENT_TYPES.get(content_type)
+              if format is None:
+                     return Response(
+                            {'error': f'Content-Type must be one of {", ".join(CONTENT_TYPES)}'},
+                            status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+              rows = read_rows(decode_lines(request._request), format)
+              result = import_products(rows, chunk_size=IMPORT_CHUNK_SIZE)
+              return Response(result.as_dict())
         
 
-class CollectionViewSet(ModelViewSet):
+class CollectionViewSet(ConditionalGetMixin, ModelViewSet):
        queryset = Collection.objects.all()
        serializer_class = CollectionSerializer
+       cache_namespace = COLLECTIONS
        permission_classes = [IsAdminOrReadOnly]
        filter_backends = [OrderingFilter]
        ordering_fields = ['title', 'id']
 
+       def destroy(self, request, *args, **kwargs):
+              collection = self.get_object()
+              # Products protect their collection from being deleted
+              if collection.products.exists():
+                     return Response(
+                            {'error': 'Collection cannot be deleted because it includes one or more products.'},
+                            status=status.HTTP_405_METHOD_NOT_ALLOWED)
+              return super().destroy(request, *args, **kwargs)
+
 class ReviewViewSet(ModelViewSet):
        queryset = Review.objects.all()
        serializer_class = ReviewSerializer
+       pagination_class = KeysetPagination
+
+def parse_cart_id(value):
+       try:
+              return UUID(str(value))
+       except ValueError:
+              raise NotFound()
 
 # it won't support GET request
-class CartViewSet(CreateModelMixin, 
+# Carts are read and written through the configured store (store/carts.py)
+class CartViewSet(ConditionalRetrieveMixin,
+                  CreateModelMixin, 
                   GenericViewSet, 
                   DestroyModelMixin, 
                   RetrieveModelMixin):
-       queryset = Cart.objects.prefetch_related('items__product').all()
        serializer_class = CartSerializer
 
+       def get_object(self):
+              cart = get_cart_store().get(parse_cart_id(self.kwargs['pk']))
+              if cart is None:
+                     raise NotFound()
+              return cart
+
+       def perform_create(self, serializer):
+              serializer.instance = get_cart_store().create()
+
+       def destroy(self, request, *args, **kwargs):
+              cart_id = parse_cart_id(kwargs['pk'])
+              if not get_cart_store().delete(cart_id):
+                     raise NotFound()
+              if reservations.is_enabled():
+                     reservations.release(cart_id)
+              return Response(status=status.HTTP_204_NO_CONTENT)
+
+       # A cart changes with its items and with the prices of its products
+       def get_validator_namespaces(self):
+              try:
+                     cart_id = UUID(str(self.kwargs['pk']))
+              except ValueError:
+                     return []
+              return [cart_namespace(cart_id), PRODUCTS]
+
 
 class CartItemViewset(ModelViewSet):
        # Prevent put request in our class
@@ -61,19 +225,74 @@ class CartItemViewset(ModelViewSet):
               return CartItemSerializer
        
        def get_serializer_context(self):
-              return {'cart_id': self.kwargs['cart_pk']}
+              return {'cart_id': self.cart_id}
 
-       # Filter item by Cart id
-       def get_queryset(self):
-              return CartItem.objects \
-                     .filter(cart_id= self.kwargs['cart_pk']) \
-                     .select_related('product') # Implement Eager loading to avoid selecting similar queries for reading the product
+       @property
+       def cart_id(self):
+              return parse_cart_id(self.kwargs['cart_pk'])
+
+       def list(self, request, *args, **kwargs):
+              serializer = CartItemSerializer(get_cart_store().get_lines(self.cart_id), many=True)
+              return Response(serializer.data)
+
+       def get_object(self):
+              try:
+                     line_id = int(self.kwargs['pk'])
+              except ValueError:
+                     raise NotFound()
+              line = get_cart_store().get_line(self.cart_id, line_id)
+              if line is None:
+                     raise NotFound()
+              return line
+
+       # Retried with the same Idempotency-Key, the first response is replayed
+       @idempotent
+       def create(self, request, *args, **kwargs):
+              return super().create(request, *args, **kwargs)
+
+       # Adds many products in one request and one write
+       @action(detail=False, methods=['POST'])
+       @idempotent
+       def bulk(self, request, cart_pk=None):
+              serializer = BulkAddCartItemSerializer(data=request.data, context=self.get_serializer_context())
+              serializer.is_valid(raise_exception=True)
+              self.save_lines(serializer)
+              return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+       # Item writes change the cart's representation
+       def perform_create(self, serializer):
+              self.save_lines(serializer)
+
+       def save_lines(self, serializer):
+              try:
+                     serializer.save()
+              except CartNotFound:
+                     raise NotFound('No cart with the given id found')
+              self.invalidate_cart()
+
+       def perform_update(self, serializer):
+              line = get_cart_store().set_quantity(
+                     self.cart_id, serializer.instance.id, serializer.validated_data['quantity'])
+              if line is None:
+                     raise NotFound()
+              serializer.instance = line
+              self.invalidate_cart()
+
+       def perform_destroy(self, instance):
+              get_cart_store().remove(self.cart_id, instance.id)
+              if reservations.is_enabled():
+                     reservations.release(self.cart_id, [instance.product_id])
+              self.invalidate_cart()
+
+       def invalidate_cart(self):
+              bump_version(cart_namespace(self.cart_id))
 
 
 class CustomerViewSet(ModelViewSet):
        queryset = Customer.objects.all()
        serializer_class = CustomerSerializer
        permission_classes = [IsAdminOrReadOnly]
+       pagination_class = KeysetPagination # Seeks on the (first_name, last_name, id) index
 
        # # Set permission for different Method
        # def get_permissions(self):
@@ -85,7 +304,7 @@ class CustomerViewSet(ModelViewSet):
        # Create a customize action
        @action(detail=False, methods=['GET', 'PUT'], permission_classes=[IsAuthenticated]) # Action will be availiable on the list view i.e store/customer/me
        def me(self, request):
-              customer = Customer.objects.get(user_id = request.user.id)
+              customer = Customer.objects.get(pk=get_customer_id(request))
               if request.method == 'GET':
                      serializer = CustomerSerializer(customer)
                      return Response(serializer.data)
@@ -96,7 +315,7 @@ class CustomerViewSet(ModelViewSet):
                      return Response(serializer.data)
               
 class  OrderViewset(ModelViewSet):
-       queryset = Order.objects.all()
+       pagination_class = KeysetPagination
        http_method_names = ['get', 'post', 'patch', 'delete', 'option', 'head']
 
        def get_permissions(self):
@@ -104,15 +323,28 @@ class  OrderViewset(ModelViewSet):
                      return [IsAdminUser()]
               return [IsAuthenticated()]
 
+       @idempotent
        def create(self, request, *args, **kwargs):
               serializer = CreateOrderSerializer(
                      data=request.data,
-                     context={'user_id': self.request.user.id})
+                     context={'customer_id': get_customer_id(request)})
               serializer.is_valid(raise_exception=True)
               order = serializer.save()
               serializer = OrderSerializer(order)
               return Response(serializer.data)
        
+       # Customers see their own orders, staff see all of them
+       def get_queryset(self):
+              items = OrderItem.objects \
+                     .select_related('product') \
+                     .only('id', 'order_id', 'unit_price', 'quantity', 'product__id', 'product__title', 'product__unit_price')
+              queryset = Order.objects \
+                     .prefetch_related(Prefetch('items', queryset=items)) \
+                     .order_by('-placed_at', '-id') # Seeks on the (customer, placed_at, id) index
+              if self.request.user.is_staff:
+                     return queryset
+              return queryset.filter(customer_id=get_customer_id(self.request))
+
        def get_serializer_class(self):
               if self.request.method == 'POST':
                      return CreateOrderSerializer
@@ -120,6 +352,15 @@ class  OrderViewset(ModelViewSet):
                      return UpdateOrderSerializer
               return OrderSerializer
 
+# Read from the sales rollups (store/reports.py), not the order tables
+class SalesReportViewSet(GenericViewSet):
+       permission_classes = [IsAdminUser]
+
+       def list(self, request):
+              serializer = SalesReportQuerySerializer(data=request.query_params)
+              serializer.is_valid(raise_exception=True)
+              return Response(sales_report(**serializer.validated_data))
+
 class ProductImageViewSet(ModelViewSet):
        serializer_class = ProductImageSerializer
 
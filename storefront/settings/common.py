@@ -132,13 +132,15 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 REST_FRAMEWORK = {
     'COERCE_DECIMAL_TO_STRING': False,
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'store.authentication.JWTAuthentication',
     ),
  }
 
 SIMPLE_JWT = {
    'AUTH_HEADER_TYPES': ('JWT',),
-   'ACCESS_TOKEN_LIFETIME': timedelta(days=1)
+   'ACCESS_TOKEN_LIFETIME': timedelta(days=1),
+   # Adds the customer_id claim
+   'TOKEN_OBTAIN_SERIALIZER': 'store.authentication.TokenObtainPairSerializer',
 }
 
 DJOSER = {
@@ -161,6 +163,118 @@ ADMINS = [
 ]
 
 CELERY_BROKER_URL = 'redis://localhost:6379/1'
+CELERY_BEAT_SCHEDULE = {
+    'flush_idle_carts': {
+        'task': 'store.tasks.flush_idle_carts',
+        'schedule': 5 * 60,
+    },
+    'purge_carts': {
+        'task': 'store.tasks.purge_carts',
+        'schedule': 60 * 60,
+    },
+    'release_expired_reservations': {
+        'task': 'store.tasks.release_expired_reservations',
+        'schedule': 60,
+    },
+    'relay_outbox': {
+        'task': 'store.tasks.relay_outbox',
+        'schedule': 5,
+    },
+    'purge_idempotency_keys': {
+        'task': 'store.tasks.purge_idempotency_keys',
+        'schedule': 60 * 60,
+    },
+    'update_membership_tiers': {
+        'task': 'store.tasks.update_membership_tiers',
+        'schedule': 60 * 60,
+    },
+}
+
+# Per process, enough for dev and the tests. prod.py points it at Redis,
+# the store.W001 check warns wherever it isn't shared
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+# Response cache for the product endpoints
+# BACKEND can also be 'store.caching.LRUBackend' (per process)
+STORE_RESPONSE_CACHE = {
+    'BACKEND': 'store.caching.DjangoCacheBackend',
+    'VERSION_CACHE': 'default',
+    'TIMEOUT': 300,
+    'OPTIONS': {
+        'alias': 'default',
+    },
+}
+
+# Where live carts are kept. 'store.carts.KeyValueCartStore' keeps them
+# in Redis and writes them to the cart tables once idle, e.g.
+# {'BACKEND': 'store.carts.KeyValueCartStore',
+#  'OPTIONS': {'location': 'redis://localhost:6379/2', 'idle_timeout': 3600}}
+STORE_CART_BACKEND = {
+    'BACKEND': 'store.carts.ORMCartStore',
+    'OPTIONS': {},
+}
+
+# Carts older than MAX_AGE_DAYS are deleted by the purge_carts task
+# and command, BATCH_SIZE at a time with PAUSE seconds in between
+STORE_CART_PURGE = {
+    'MAX_AGE_DAYS': 30,
+    'BATCH_SIZE': 1000,
+    'PAUSE': 0.1,
+    'MAX_RUNTIME': 60,
+}
+
+# Stock set aside for TTL seconds when a product is added to a cart,
+# checkout takes it for good and the beat task frees expired ones
+STORE_RESERVATIONS = {
+    'ENABLED': False,
+    'TTL': 15 * 60,
+    'BATCH_SIZE': 1000,
+}
+
+# Delivery of the events checkout writes to the outbox table,
+# failed deliveries wait RETRY_DELAY * 2 ** attempts seconds
+STORE_OUTBOX = {
+    'BATCH_SIZE': 100,
+    'MAX_ATTEMPTS': 10,
+    'RETRY_DELAY': 30,
+    'RETENTION_DAYS': 7,
+}
+
+# Responses to requests with an Idempotency-Key header, replayed for
+# retries within TTL seconds. BACKEND can also be
+# 'store.idempotency.CacheBackend' with OPTIONS {'alias': ...} on a shared cache
+STORE_IDEMPOTENCY = {
+    'BACKEND': 'store.idempotency.DatabaseBackend',
+    'TTL': 24 * 60 * 60,
+    'LOCK_TIMEOUT': 30,
+    'WAIT_TIMEOUT': 10,
+    'OPTIONS': {},
+}
+
+# Membership tiers from the spend on completed orders placed in the last
+# WINDOW_DAYS days, (tier, minimum spend) highest first, Bronze below.
+# Kept up to date by the update_membership_tiers task
+STORE_MEMBERSHIP = {
+    'WINDOW_DAYS': 365,
+    'TIERS': [('G', 1000), ('S', 250)],
+    'BATCH_SIZE': 1000,
+    'EXPIRY_LOOKBACK_DAYS': 7,
+}
+
+# JWT authenticated users are kept in CACHE_ALIAS for CACHE_TIMEOUT
+# seconds instead of loaded per request, 0 turns that off. Use a shared
+# cache with several workers, saves clear it
+STORE_AUTH = {
+    'CACHE_TIMEOUT': 0,
+    'CACHE_ALIAS': 'default',
+}
+
+# Product search backend, picked from the database vendor when unset
+# STORE_SEARCH_BACKEND = 'store.search.LikeSearchBackend'
 
 LOGGING = {
     'version': 1,
@@ -5,4 +5,13 @@ DEBUG = False
 
 SECRET_KEY = os.environ['SECRET_KEY']
 
-ALLOWED_HOSTS = []
\ No newline at end of file
+ALLOWED_HOSTS = []
+
+# Shared by every web and Celery process: the response cache, the
+# version counters behind ETags and the cached principals all rely on it
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ.get('CACHE_URL', 'redis://localhost:6379/3'),
+    }
+}